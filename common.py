@@ -1,11 +1,18 @@
 import pandas as pd
 from modules.fetcher import Fetcher
+from modules.policy import FetchPolicy, OFFLINE
+from modules.spread_scanner import get_market_universe, scan_funding_spreads
+from modules.alignment import align_histories, RESULT_COLUMNS
 import json
+import os
+import shutil
 import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
 
 # Util function for fetching data
-def fetch_data(exchange, market):
-    fetcher = Fetcher()
+def fetch_data(exchange, market, policy = None):
+    fetcher = Fetcher(policy)
     funding_df = fetcher.fetch_funding_rate_history_until_start(exchange, market)
     funding_df['datetime'] = funding_df['datetime'].dt.tz_localize(None)
 
@@ -15,28 +22,55 @@ def fetch_data(exchange, market):
     price_df = fetcher.fetch_ohlc(exchange, market, start_funding_time, end_funding_time)
     price_df['datetime'] = price_df['datetime'].dt.tz_localize(None)
 
-    start_price_time = price_df['timestamp'].min()
-    end_price_time = price_df['timestamp'].max()
-
-    min_time = max(start_funding_time, start_price_time)
-    max_time = min(end_funding_time, end_price_time)
-
-    min_datetime = pd.to_datetime(min_time, unit='s')
-    max_datetime = pd.to_datetime(max_time, unit='s')
-
-    funding_df = funding_df[(funding_df['datetime'] >= min_datetime) & (funding_df['datetime'] <= max_datetime)]
-    price_df = price_df[(price_df['datetime'] >= min_datetime) & (price_df['datetime'] <= max_datetime)]
-
-    result_df = pd.merge_asof(funding_df, price_df, on=['datetime'], tolerance=pd.Timedelta('1h'), direction='nearest')
-    result_df['open'] = result_df['open'].ffill()
-    result_df['high'] = result_df['high'].ffill()
-    result_df['low'] = result_df['low'].ffill()
-    result_df['close'] = result_df['close'].ffill()
-    result_df['timestamp'] = result_df['timestamp_x']
-
-    result_df['datetime'] = result_df['datetime'].apply(lambda x: pd.to_datetime(x))
-
-    return result_df[['datetime', 'timestamp', 'open', 'high', 'low', 'close', 'funding_rate']]
+    return merge_funding_ohlc(funding_df, price_df)
+
+# Same as fetch_data for many (exchange, market) pairs, fetched concurrently with Fetcher.backfill.
+# Returns {(exchange, market): result_df}, pairs without funding data in the window are left out.
+def fetch_all_data(pairs, since = None, until = None, policy = None):
+    return fetch_aligned_data(pairs, since, until, policy)[0]
+
+# fetch_all_data plus the gap report of every pair (missing fundings, holes in the hourly prices), all pairs are
+# aligned in one pass (see modules/alignment.py), e.g. every venue of one base asset:
+# data, gaps_df = fetch_aligned_data([('binance', 'BTCUSDT'), ('bitmex', 'XBTUSDT'), ('drift', 'BTC-PERP')])
+# Only exchanges with hourly ohlc are supported, see Fetcher.backfill.
+def fetch_aligned_data(pairs, since = None, until = None, policy = None):
+    fetcher = Fetcher(policy)
+    try:
+        history = fetcher.backfill(pairs, since, until)
+        funding_intervals = {pair: fetcher.exchanges[pair[0]].funding_interval for pair in pairs}
+    finally:
+        fetcher.close()
+
+    return align_histories(history, funding_intervals)
+
+# Trim the funding and hourly ohlc history to their common time range and put the price next to every funding
+def merge_funding_ohlc(funding_df, price_df):
+    results, _ = align_histories({(None, None): (funding_df, price_df)})
+    return results.get((None, None), pd.DataFrame(columns=RESULT_COLUMNS))
+
+# Funding screener: annualized average funding rates of many (exchange, market) pairs, highest first by sort_by.
+# Reads the cached funding history only, unless another policy is given.
+def get_funding_rate_screener(pairs, sort_by = '7d', policy = None):
+    fetcher = Fetcher(policy or FetchPolicy(OFFLINE))
+    try:
+        stats_df = fetcher.fetch_annualized_average_funding_rates(pairs)
+    finally:
+        fetcher.close()
+    return stats_df.sort_values(by=sort_by, ascending=False)
+
+# Cross-exchange funding spread scanner: every pair of venues listing the same base asset, ranked by a backtest of the
+# funding carry over the last lookback_hours, with the side of every pair chosen from the formation_hours before it
+# (see modules/spread_scanner.py). The markets are listed from the exchange APIs, the funding histories are read from
+# the cache only unless another policy is given.
+def get_funding_spread_scanner(exchanges = None, lookback_hours = 720, fee_percent = 0.001, policy = None, formation_hours = 720):
+    list_fetcher = Fetcher()
+    fetcher = Fetcher(policy or FetchPolicy(OFFLINE))
+    try:
+        universe = get_market_universe(list_fetcher, exchanges)
+        return scan_funding_spreads(fetcher, universe, lookback_hours, fee_percent=fee_percent, formation_hours=formation_hours)
+    finally:
+        list_fetcher.close()
+        fetcher.close()
 
 def fetch_24h_vol(exchange, market):
     fetcher = Fetcher()
@@ -45,7 +79,125 @@ def fetch_24h_vol(exchange, market):
     return vol
 
 # Util functions for calculating pnl (long spot, short future)
+# The path is split into epochs between trades (stop loss or liquidation). Collateral and entry price are
+# constant within an epoch, so every column of the epoch is computed with array operations and the funding
+# pnl is a cumulative sum. The result matches get_iterative_backtest_result bit for bit.
 def get_backtest_result(input_df, l, fee = 0.001, maintenance_margin = 0.05, stop_loss_margin = 0.0625):
+    df = input_df.copy()
+    n = len(df)
+    if n == 0:
+        return df
+
+    price = df['close'].to_numpy(dtype=float)
+    funding_rate = df['funding_rate'].to_numpy(dtype=float)
+
+    clt = np.zeros(n)
+    entry = np.zeros(n)
+    pos_size = np.zeros(n)
+    change = np.zeros(n)
+    change_pnl = np.zeros(n)
+    funding = np.zeros(n)
+    funding_pnl = np.zeros(n)
+    margin = np.zeros(n)
+    mm = np.zeros(n)
+    mm_sl = np.zeros(n)
+    is_liq = np.zeros(n, dtype=bool)
+    is_sl = np.zeros(n, dtype=bool)
+    final_pnl = np.zeros(n)
+
+    # First record opens the position
+    trade_fee = -fee * l
+    fees = np.zeros(n, dtype=np.result_type(trade_fee))
+    clt[0] = float(1)
+    mm[0] = clt[0] * l * maintenance_margin
+    mm_sl[0] = clt[0] * l * stop_loss_margin
+    fees[0] = trade_fee
+
+    start = 1
+    while start < n:
+        # A zero fee never counts as a trade, so the epoch simply continues
+        traded = fees[start - 1] != 0
+        new_clt = clt[start - 1] + fees[start - 1] + (funding_pnl[start - 1] if traded else 0)
+
+        if new_clt == 0:
+            # Collateral is gone, every following record stays closed
+            final_pnl[start:] = -1
+            break
+
+        epoch_clt = max(new_clt, float(0))
+        epoch_entry = price[start] if traded else entry[start - 1]
+        epoch_mm = epoch_clt * l * maintenance_margin
+        epoch_mm_sl = epoch_clt * l * stop_loss_margin
+
+        # Grow the window until it contains the next stop loss (or the end of the data)
+        window = 256
+        while True:
+            stop = min(start + window, n)
+            w_price = price[start:stop]
+            w_change = (w_price - epoch_entry) / epoch_entry if epoch_entry != 0 else np.zeros(stop - start)
+            w_change_pnl = -np.abs(w_change * l)
+            w_funding = (epoch_clt - w_change / 2) * funding_rate[start:stop] * l / 2
+            w_funding_acc = w_funding.copy()
+            if not traded:
+                w_funding_acc[0] = w_funding_acc[0] + funding_pnl[start - 1]
+            w_funding_pnl = np.cumsum(w_funding_acc)
+            if epoch_clt != 0:
+                w_margin = (epoch_clt + w_change_pnl + w_funding_pnl) / epoch_clt
+            else:
+                w_margin = np.zeros(stop - start)
+            w_is_liq = w_margin < epoch_mm
+            w_is_sl = w_margin < epoch_mm_sl
+
+            if epoch_clt == 0:
+                # Nothing left to stop out, the next record closes the position
+                end = start + 1
+                break
+            hits = np.flatnonzero(w_is_liq | w_is_sl) if trade_fee != 0 else np.array([], dtype=int)
+            if hits.size > 0:
+                end = start + hits[0] + 1
+                break
+            if stop == n:
+                end = n
+                break
+            window *= 4
+
+        size = end - start
+        clt[start:end] = epoch_clt
+        entry[start:end] = epoch_entry
+        pos_size[start:end] = w_price[:size] * epoch_clt * l
+        change[start:end] = w_change[:size]
+        change_pnl[start:end] = w_change_pnl[:size]
+        funding[start:end] = w_funding[:size]
+        funding_pnl[start:end] = w_funding_pnl[:size]
+        margin[start:end] = w_margin[:size]
+        mm[start:end] = epoch_mm
+        mm_sl[start:end] = epoch_mm_sl
+        is_liq[start:end] = w_is_liq[:size]
+        is_sl[start:end] = w_is_sl[:size]
+        fees[start:end] = np.where(w_is_liq[:size] | w_is_sl[:size], trade_fee, 0)
+        final_pnl[start:end] = epoch_clt - 1 + w_funding_pnl[:size]
+
+        start = end
+
+    df['clt'] = clt
+    df['leverage'] = l
+    df['entry'] = entry
+    df['pos_size'] = pos_size
+    df['change'] = change
+    df['change_pnl'] = change_pnl
+    df['funding'] = funding
+    df['funding_pnl'] = funding_pnl
+    df['margin'] = margin
+    df['mm'] = mm
+    df['mm_sl'] = mm_sl
+    df['is_liq'] = is_liq
+    df['is_sl'] = is_sl
+    df['fee'] = fees
+    df['final_pnl'] = final_pnl
+    return df
+
+# Row by row reference of get_backtest_result, kept for checking the vectorized engine
+def get_iterative_backtest_result(input_df, l, fee = 0.001, maintenance_margin = 0.05, stop_loss_margin = 0.0625):
     df = input_df.copy()
     for index, row in enumerate(df.iterrows()):
         if index == 0:
@@ -127,7 +279,156 @@ def get_backtest_result(input_df, l, fee = 0.001, maintenance_margin = 0.05, sto
     return df
 
 # Util functions for calculating pnl (long + short futures)
+# The state of both legs (long = 0, short = 1) is kept in preallocated (2, n) arrays. Trades are applied one at a
+# time, while the records between two trades share the same collateral, entry and position size and are computed
+# with array operations. The result matches get_iterative_dual_backtest_result bit for bit.
 def get_dual_backtest_result(long_df, short_df, long_funding_freq, short_funding_freq, leverage, init_clt = 1, fee_percent = 0.001, stop_loss_margin = 0.0625):
+    df = pd.merge_asof(long_df, short_df, on='timestamp')
+    n = len(df)
+
+    # Use the same price reference to avoid fluctuation
+    price = df['close_x'].to_numpy(dtype=float)
+    funding_rate = np.vstack([
+        df['funding_rate_x'].to_numpy(dtype=float),
+        (df['funding_rate_y'] * long_funding_freq / short_funding_freq).to_numpy(dtype=float),
+    ])
+    side = np.array([1, -1])
+
+    is_trade = np.zeros((2, n), dtype=bool)
+    inj = np.zeros((2, n))
+    eq = np.zeros((2, n))
+    clt = np.zeros((2, n))
+    entry = np.zeros((2, n))
+    pos_size = np.zeros((2, n))
+    d = np.zeros((2, n), dtype=int)
+    change = np.zeros((2, n))
+    change_pnl = np.zeros((2, n))
+    funding = np.zeros((2, n))
+    funding_pnl = np.zeros((2, n))
+    margin = np.zeros((2, n))
+    mm_sl = np.zeros((2, n))
+    is_sl = np.zeros((2, n), dtype=bool)
+    fee = np.zeros((2, n))
+    pnl = np.zeros((2, n))
+
+    init_leg_clt = float(init_clt / 2)
+    inj[:, :1] = init_leg_clt
+    eq[:, :1] = init_leg_clt
+    clt[:, :1] = init_leg_clt
+
+    index = 1
+    trade_inj = np.zeros(2)
+    while index < n:
+        # Open both legs again (first trade or rebalancing after a stop loss)
+        new_clt = clt[:, index - 1] + change_pnl[:, index - 1] + funding_pnl[:, index - 1] + trade_inj
+        trade_fee = new_clt * leverage * fee_percent
+        new_clt = new_clt - trade_fee
+
+        is_trade[:, index] = True
+        inj[:, index] = trade_inj
+        eq[:, index] = eq[:, index - 1] + trade_inj
+        clt[:, index] = np.maximum(new_clt, 0)
+        d[:, index] = side
+        entry[:, index] = price[index]
+        pos_size[:, index] = clt[:, index] * leverage * side / price[index]
+        margin[:, index] = clt[:, index]
+        mm_sl[:, index] = clt[:, index] * leverage * stop_loss_margin
+        is_sl[:, index] = margin[:, index] < mm_sl[:, index]
+        fee[:, index] = trade_fee
+        pnl[:, index] = margin[:, index] - eq[:, index]
+
+        end = index + 1
+        if not is_sl[:, index].any():
+            epoch_clt = clt[:, index:index + 1]
+            epoch_entry = entry[:, index:index + 1]
+            epoch_pos_size = pos_size[:, index:index + 1]
+            epoch_eq = eq[:, index:index + 1]
+            epoch_mm_sl = mm_sl[:, index:index + 1]
+
+            # Grow the window until it contains the next stop loss of either leg (or the end of the data)
+            start = index + 1
+            window = 256
+            while start < n:
+                stop = min(start + window, n)
+                w_price = price[start:stop]
+                w_change = w_price - epoch_entry
+                w_change_pnl = w_change * epoch_pos_size
+                w_funding = -funding_rate[:, start:stop] * epoch_pos_size * w_price
+                w_funding_pnl = np.cumsum(w_funding, axis=1)
+                w_margin = epoch_clt + w_change_pnl + w_funding_pnl
+                w_is_sl = w_margin < epoch_mm_sl
+
+                hits = np.flatnonzero(w_is_sl.any(axis=0))
+                if hits.size > 0:
+                    end = start + hits[0] + 1
+                elif stop == n:
+                    end = n
+                else:
+                    window *= 4
+                    continue
+
+                size = end - start
+                inj[:, start:end] = 0
+                eq[:, start:end] = epoch_eq
+                clt[:, start:end] = epoch_clt
+                d[:, start:end] = side[:, None]
+                entry[:, start:end] = epoch_entry
+                pos_size[:, start:end] = epoch_pos_size
+                change[:, start:end] = w_change[:, :size]
+                change_pnl[:, start:end] = w_change_pnl[:, :size]
+                funding[:, start:end] = w_funding[:, :size]
+                funding_pnl[:, start:end] = w_funding_pnl[:, :size]
+                margin[:, start:end] = w_margin[:, :size]
+                mm_sl[:, start:end] = epoch_mm_sl
+                is_sl[:, start:end] = w_is_sl[:, :size]
+                pnl[:, start:end] = w_margin[:, :size] - epoch_eq
+                break
+
+        # Average the margin of both legs before the next trade
+        avg_margin = (margin[0, end - 1] + margin[1, end - 1]) / 2
+        trade_inj = avg_margin - margin[:, end - 1]
+        index = end
+
+    legs = []
+    for leg, (datetime_column, leg_funding_rate) in enumerate([('datetime_x', funding_rate[0]), ('datetime_y', funding_rate[1])]):
+        legs.append(pd.DataFrame({
+            'datetime': df[datetime_column],
+            'close': price,
+            'funding_rate': leg_funding_rate,
+            'is_trade': is_trade[leg],
+            'inj': inj[leg],
+            'eq': eq[leg],
+            'clt': clt[leg],
+            'leverage': leverage,
+            'entry': entry[leg],
+            'pos_size': pos_size[leg],
+            'd': d[leg],
+            'change': change[leg],
+            'change_pnl': change_pnl[leg],
+            'funding': funding[leg],
+            'funding_pnl': funding_pnl[leg],
+            'margin': margin[leg],
+            'mm_sl': mm_sl[leg],
+            'is_sl': is_sl[leg],
+            'fee': fee[leg],
+            'pnl': pnl[leg],
+        }, index=df.index))
+    long_df, short_df = legs
+
+    result_df = pd.DataFrame({
+        'datetime': long_df['datetime'],
+        'close': long_df['close'],
+        'long_funding': long_df['funding_rate'],
+        'short_funding': short_df['funding_rate'],
+        'long_pnl': long_df['pnl'],
+        'short_pnl': short_df['pnl'],
+        'final_pnl': long_df['pnl'] + short_df['pnl'],
+    })
+
+    return (result_df, long_df, short_df)
+
+# Row by row reference of get_dual_backtest_result, kept for checking the array kernel
+def get_iterative_dual_backtest_result(long_df, short_df, long_funding_freq, short_funding_freq, leverage, init_clt = 1, fee_percent = 0.001, stop_loss_margin = 0.0625):
 
     df = pd.merge_asof(long_df, short_df, on='timestamp')
 
@@ -178,6 +479,100 @@ def get_dual_backtest_result(long_df, short_df, long_funding_freq, short_funding
 
     return (result_df, long_df, short_df)
 
+# Util functions for sweeping backtest parameters (long spot, short future)
+# Every combination of leverage, fee, maintenance margin and stop loss margin is one column of a parameter axis.
+# The records are walked once and each step updates all combinations with the rules of get_backtest_result.
+def get_backtest_sweep(input_df, leverages, fees = (0.001,), maintenance_margins = (0.05,), stop_loss_margins = (0.0625,), risk_free_rate = 0.01, hr_interval = None):
+    grid = np.meshgrid(
+        np.asarray(leverages, dtype=float),
+        np.asarray(fees, dtype=float),
+        np.asarray(maintenance_margins, dtype=float),
+        np.asarray(stop_loss_margins, dtype=float),
+        indexing='ij',
+    )
+    l, fee, maintenance_margin, stop_loss_margin = [values.ravel() for values in grid]
+
+    n = len(input_df)
+    if n < 2:
+        # Without a second record there is no pnl change for the sharpe ratio (and no pnl at all without records)
+        pnl = np.full(len(l), 0.0 if n == 1 else np.nan)
+        return pd.DataFrame({
+            'leverage': l,
+            'fee': fee,
+            'maintenance_margin': maintenance_margin,
+            'stop_loss_margin': stop_loss_margin,
+            'final_pnl': pnl,
+            'max_drawdown': pnl,
+            'sharpe_ratio': np.nan,
+            'stop_outs': 0,
+            'liquidations': 0,
+        })
+
+    price = input_df['close'].to_numpy(dtype=float)
+    funding_rate = input_df['funding_rate'].to_numpy(dtype=float)
+    final_pnl = np.zeros((n, len(l)))
+    stop_outs = np.zeros(len(l), dtype=int)
+    liquidations = np.zeros(len(l), dtype=int)
+
+    trade_fee = -fee * l
+    clt = np.ones(len(l))
+    entry = np.zeros(len(l))
+    funding_pnl = np.zeros(len(l))
+    prev_fee = trade_fee
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for index in range(1, n):
+            traded = prev_fee != 0
+            new_clt = clt + prev_fee + np.where(traded, funding_pnl, 0)
+            closed = new_clt == 0
+
+            clt = np.maximum(new_clt, 0)
+            entry = np.where(traded, price[index], entry)
+            change = np.where(entry != 0, (price[index] - entry) / entry, 0)
+            change_pnl = -np.abs(change * l)
+            funding = (clt - change / 2) * funding_rate[index] * l / 2
+            funding_pnl = np.where(traded, funding, funding + funding_pnl)
+            margin = np.where(clt != 0, (clt + change_pnl + funding_pnl) / clt, 0)
+
+            is_liq = margin < clt * l * maintenance_margin
+            is_sl = margin < clt * l * stop_loss_margin
+            prev_fee = np.where(is_liq | is_sl, trade_fee, 0)
+            final_pnl[index] = clt - 1 + funding_pnl
+
+            # Collateral is gone, the combination stays closed
+            clt[closed] = 0
+            entry[closed] = 0
+            funding_pnl[closed] = 0
+            prev_fee[closed] = 0
+            final_pnl[index, closed] = -1
+
+            stop_outs += (is_liq | is_sl) & ~closed
+            liquidations += is_liq & ~closed
+
+        if hr_interval is None:
+            hr_interval = np.diff(input_df['timestamp'].to_numpy(dtype=float)).mean() / (60 * 60)
+
+        equity_curve = final_pnl + 1
+        cumulative_max = np.maximum.accumulate(equity_curve, axis=0)
+        drawdowns = (equity_curve - cumulative_max) / cumulative_max
+        drawdowns[np.isnan(drawdowns)] = 0
+
+        pnl_changes = np.diff(final_pnl, axis=0, prepend=final_pnl[:1])
+        std_excess_return = pnl_changes.std(axis=0, ddof=1) * np.sqrt((24 / hr_interval) * (365 / 2))
+        last_pnl = final_pnl[-1]
+
+        return pd.DataFrame({
+            'leverage': l,
+            'fee': fee,
+            'maintenance_margin': maintenance_margin,
+            'stop_loss_margin': stop_loss_margin,
+            'final_pnl': last_pnl,
+            'max_drawdown': drawdowns.min(axis=0),
+            'sharpe_ratio': (last_pnl - risk_free_rate) / std_excess_return,
+            'stop_outs': stop_outs,
+            'liquidations': liquidations,
+        })
+
 # Util functions for hodl pnl
 def get_hodl_result(input_df):
     df = input_df.copy()
@@ -203,14 +598,66 @@ def sharpe_ratio(values, invest_return, risk_free_rate = 0.01, hr_interval = 1):
     return excess_returns / std_excess_return
 
 # Util functions for managing cache data
+# The CSV files are the shared snapshot of the aggregated data. Reads go through a Parquet store partitioned by
+# exchange/market/year with typed columns, which is rebuilt from the CSV file whenever the CSV file is newer.
+CACHE_COLUMNS = ['datetime', 'timestamp', 'open', 'high', 'low', 'close', 'funding_rate']
+
 def get_cache_path(exchange, market):
     return f'./data/{exchange}_{market}.csv'
 
+def get_store_path(exchange, market):
+    return f'./data/store/{exchange}/{market}'
+
 def save_cache_data(exchange, market, data_df):
-    return data_df.to_csv(get_cache_path(exchange, market), index=False)
+    data_df.to_csv(get_cache_path(exchange, market), index=False)
+    save_store_data(exchange, market, data_df)
+
+def load_cache_data(exchange, market, start = None, end = None):
+    store_path = get_store_path(exchange, market)
+    cache_path = get_cache_path(exchange, market)
+    if not os.path.exists(store_path) or (os.path.exists(cache_path) and os.path.getmtime(cache_path) > os.path.getmtime(store_path)):
+        save_store_data(exchange, market, pd.read_csv(cache_path))
+
+    # Only the year partitions and row groups overlapping [start, end] are read
+    condition = None
+    if start is not None:
+        condition = (ds.field('year') >= pd.to_datetime(start, unit='s').year) & (ds.field('timestamp') >= start)
+    if end is not None:
+        end_condition = (ds.field('year') <= pd.to_datetime(end, unit='s').year) & (ds.field('timestamp') <= end)
+        condition = end_condition if condition is None else condition & end_condition
+
+    dataset = ds.dataset(store_path, format='parquet', partitioning='hive')
+    df = dataset.to_table(columns=CACHE_COLUMNS, filter=condition).to_pandas()
+    # Stores written before the timestamps were int64
+    df['timestamp'] = df['timestamp'].astype('int64')
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values(by='timestamp', ascending=True).reset_index(drop=True)
+    return df
 
-def load_cache_data(exchange, market):
-    return pd.read_csv(get_cache_path(exchange, market))
+def save_store_data(exchange, market, data_df):
+    store_df = pd.DataFrame({
+        'datetime': pd.to_datetime(data_df['datetime']).astype('datetime64[ns]'),
+        # Epoch seconds as int64 like the fetcher frames, merge_asof needs the same key dtype on both legs
+        'timestamp': data_df['timestamp'].astype(float).astype('int64'),
+        'open': data_df['open'].astype(float),
+        'high': data_df['high'].astype(float),
+        'low': data_df['low'].astype(float),
+        'close': data_df['close'].astype(float),
+        'funding_rate': data_df['funding_rate'].astype(float),
+    })
+    store_df['year'] = store_df['datetime'].dt.year
+
+    store_path = get_store_path(exchange, market)
+    shutil.rmtree(store_path, ignore_errors=True)
+    ds.write_dataset(
+        pa.Table.from_pandas(store_df, preserve_index=False),
+        store_path,
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([('year', pa.int32())]), flavor='hive'),
+        basename_template='part-{i}.parquet',
+        max_rows_per_group=2048,
+        min_rows_per_group=2048,
+    )
 
 def load_volume_data():
     file_path = "./storage/volume.json"
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+# Import time budget in seconds of the modules used by the analysis notebooks, measured in a fresh interpreter
+# (pandas, numpy and pyarrow included). Exchange code is imported lazily and must not be loaded by these imports.
+IMPORT_BUDGET = {
+    'common': 1.5,
+    'modules.fetcher': 1.0,
+}
+LAZY_MODULES = ['modules.exchanges.kwenta', 'web3', 'gql', 'aiohttp', 'dotenv']
+
+MEASURE_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(','.join(name for name in {lazy_modules!r} if name in sys.modules))
+"""
+
+# Best of `repeat` fresh imports, and the lazy modules that were loaded anyway
+def measure_import_time(module, repeat = 5):
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', MEASURE_SCRIPT.format(module=module, lazy_modules=LAZY_MODULES)],
+            capture_output=True, text=True, check=True,
+        ).stdout.split('\n')
+        times.append(float(output[0]))
+        loaded = [name for name in output[1].split(',') if name]
+    return min(times), loaded
+
+if __name__ == '__main__':
+    failed = False
+    for module, budget in IMPORT_BUDGET.items():
+        import_time, loaded = measure_import_time(module)
+        ok = import_time <= budget and not loaded
+        failed = failed or not ok
+        print(f"{'OK  ' if ok else 'FAIL'} import {module}: {import_time:.3f}s (budget {budget:.1f}s)" + (f", loaded {', '.join(loaded)}" if loaded else ''))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+TOLERANCE = 3600  # max seconds between a funding and its nearest hourly price
+PRICE_INTERVAL = 3600
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+RESULT_COLUMNS = ["datetime", "timestamp"] + PRICE_COLUMNS + ["funding_rate"]
+GAP_COLUMNS = ["exchange", "market", "kind", "start", "end", "missing"]
+GROUP_SHIFT = 40  # times of all pairs are joined as pair number << GROUP_SHIFT + epoch seconds
+
+# Put the nearest hourly price next to every funding of many (exchange, market) pairs at once, e.g. all venues of
+# one base asset. histories is {(exchange, market): (funding_df, price_df)} like Fetcher.backfill returns it.
+# Every pair is trimmed to the common time range of its funding and prices, then the times of all pairs are joined
+# into one sorted int64 key array so a single searchsorted finds the nearest price (the earlier one on a tie, like
+# merge_asof(direction='nearest')). Missing prices (no price within tolerance or NaN in the matched row) take the
+# last known value of their column, like the ffill of every column after merge_asof.
+# Returns ({pair: result_df}, gaps_df). result_df has the columns of merge_funding_ohlc in common.py, pairs without
+# funding or prices in their common range are left out. gaps_df has one row per gap in the aligned range:
+# kind "funding" for missing fundings (funding_intervals is {pair: hours}, the median spacing without it) and
+# "price" for holes between two prices longer than tolerance, with start and end the epoch times around the gap
+# and missing the number of fundings or hourly prices missing.
+def align_histories(histories, funding_intervals=None, tolerance=TOLERANCE):
+    pairs, fundings, prices = [], [], []
+    for pair, (funding_df, price_df) in histories.items():
+        if funding_df is None or price_df is None or len(funding_df) == 0 or len(price_df) == 0:
+            continue
+        funding_times, funding_order = get_sorted_times(funding_df)
+        price_times, price_order = get_sorted_times(price_df)
+        min_time = max(funding_times[0], price_times[0])
+        max_time = min(funding_times[-1], price_times[-1])
+        funding_mask = (funding_times >= min_time) & (funding_times <= max_time)
+        price_mask = (price_times >= min_time) & (price_times <= max_time)
+        if not funding_mask.any() or not price_mask.any():
+            continue
+        pairs.append(pair)
+        fundings.append((funding_df, funding_order[funding_mask], funding_times[funding_mask]))
+        prices.append((price_df, price_order[price_mask], price_times[price_mask]))
+
+    if not pairs:
+        return {}, pd.DataFrame(columns=GAP_COLUMNS)
+
+    funding_groups = np.repeat(np.arange(len(pairs)), [len(times) for _, _, times in fundings])
+    price_groups = np.repeat(np.arange(len(pairs)), [len(times) for _, _, times in prices])
+    funding_times = np.concatenate([times for _, _, times in fundings])
+    price_times = np.concatenate([times for _, _, times in prices])
+    price_values = np.concatenate([
+        np.column_stack([df[column].to_numpy(dtype=float)[order] for column in PRICE_COLUMNS]) for df, order, _ in prices
+    ])
+
+    price_index = match_nearest(funding_groups, funding_times, price_groups, price_times, tolerance)
+    values = np.where((price_index >= 0)[:, None], price_values[np.maximum(price_index, 0)], np.nan)
+    values = ffill_within_groups(values, funding_groups)
+
+    results = {}
+    bounds = np.concatenate([[0], np.cumsum([len(times) for _, _, times in fundings])])
+    for i, (pair, (funding_df, order, times)) in enumerate(zip(pairs, fundings)):
+        rows = slice(bounds[i], bounds[i + 1])
+        results[pair] = pd.DataFrame({
+            "datetime": get_datetimes(funding_df, order, times),
+            "timestamp": funding_df["timestamp"].to_numpy()[order],
+            **{column: values[rows, j] for j, column in enumerate(PRICE_COLUMNS)},
+            "funding_rate": funding_df["funding_rate"].to_numpy(dtype=float)[order],
+        }, columns=RESULT_COLUMNS)
+
+    intervals = np.array([
+        (funding_intervals or {}).get(pair, 0) * 3600 or get_median_spacing(times)
+        for pair, (_, _, times) in zip(pairs, fundings)
+    ], dtype=float)
+    gaps_df = pd.concat([
+        find_gaps(pairs, "funding", funding_groups, funding_times, intervals[funding_groups], 1.5 * intervals[funding_groups]),
+        find_gaps(pairs, "price", price_groups, price_times, PRICE_INTERVAL, tolerance),
+    ], ignore_index=True)
+    return results, gaps_df.sort_values(by=["exchange", "market", "kind", "start"], kind="stable").reset_index(drop=True)
+
+# Epoch seconds of a frame's timestamp column in ascending order, with the order that sorts the rows
+def get_sorted_times(df):
+    times = df["timestamp"].to_numpy(dtype=float)
+    order = np.argsort(times, kind="stable")
+    return np.floor(times[order]).astype(np.int64), order
+
+def get_datetimes(df, order, times):
+    if "datetime" in df.columns:
+        return pd.to_datetime(df["datetime"].to_numpy()[order]).tz_localize(None)
+    return pd.to_datetime(times, unit="s")
+
+def get_median_spacing(times):
+    return float(np.median(np.diff(times))) if len(times) > 1 else 0.0
+
+# Index of the nearest price of the same group for every funding, -1 when none is within tolerance
+def match_nearest(funding_groups, funding_times, price_groups, price_times, tolerance):
+    funding_keys = (funding_groups.astype(np.int64) << GROUP_SHIFT) + funding_times
+    price_keys = (price_groups.astype(np.int64) << GROUP_SHIFT) + price_times
+
+    after = np.searchsorted(price_keys, funding_keys, side="right")
+    before = np.maximum(after - 1, 0)
+    after = np.minimum(after, len(price_keys) - 1)
+    before_distance = np.where(price_groups[before] == funding_groups, np.abs(funding_keys - price_keys[before]), np.iinfo(np.int64).max)
+    after_distance = np.where(price_groups[after] == funding_groups, np.abs(price_keys[after] - funding_keys), np.iinfo(np.int64).max)
+    nearest = np.where(before_distance <= after_distance, before, after)
+    matched = np.minimum(before_distance, after_distance) <= tolerance
+    return np.where(matched, nearest, -1)
+
+# Forward fill of every column of a 2d array within groups of rows, all columns in one pass: every cell takes the
+# row of the last value of its column, dropped when that row belongs to another group
+def ffill_within_groups(values, groups):
+    rows = np.arange(len(values))[:, None]
+    last_valid = np.maximum.accumulate(np.where(np.isnan(values), -1, rows), axis=0)
+    source = np.maximum(last_valid, 0)
+    filled = (last_valid >= 0) & (groups[source] == groups[:, None])
+    return np.where(filled, np.take_along_axis(values, source, axis=0), np.nan)
+
+def find_gaps(pairs, kind, groups, times, spacing, threshold):
+    spacing = np.broadcast_to(spacing, times.shape)
+    threshold = np.broadcast_to(threshold, times.shape)
+    distances = np.diff(times)
+    gap = (groups[1:] == groups[:-1]) & (distances > threshold[1:]) & (spacing[1:] > 0)
+    index = np.flatnonzero(gap)
+    missing = np.maximum(np.rint(distances[index] / spacing[index + 1]).astype(np.int64) - 1, 1)
+    return pd.DataFrame({
+        "exchange": [pairs[g][0] for g in groups[index]],
+        "market": [pairs[g][1] for g in groups[index]],
+        "kind": kind,
+        "start": times[index],
+        "end": times[index + 1],
+        "missing": missing,
+    }, columns=GAP_COLUMNS)
@@ -1,14 +1,23 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
-import json
 import calendar
+from .libs.history import sync_month_history, load_history_until_start
+from .libs.paging import fetch_cursor_pages
+from .libs.raw_cache import get_month_mtime, load_month, save_month
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 class ApolloxFetcher:
     funding_interval = 8
     markets_base = {}
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -29,28 +38,24 @@ class ApolloxFetcher:
             "volume": float(raw["quoteVolume"]) if raw else 0,
         }
 
-    def fetch_annualized_average_funding_rate(self, market):
-        df = self.fetch_funding_rate_history_until_start(market)
-
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            '1y': 8760,
-            'all_time': len(df)
+    # Current funding of a market: the rate paid at the next funding time (epoch seconds) and the mark price
+    def fetch_funding_snapshot(self, market):
+        raw = self._fetch_premium_index(market)
+        if raw is None:
+            return None
+        return {
+            "exchange": "apollox",
+            "market": market,
+            "timestamp": raw["time"] / 1000,
+            "funding_time": raw["nextFundingTime"] / 1000,
+            "funding_rate": float(raw["lastFundingRate"]),
+            "mark_price": float(raw["markPrice"]),
         }
 
-        annualized_average_funding_rate = {}
+    def fetch_annualized_average_funding_rate(self, market):
+        df = self.fetch_funding_rate_history_until_start(market)
 
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "apollox",
@@ -58,17 +63,24 @@ class ApolloxFetcher:
             "annualized_average_funding_rate": annualized_average_funding_rate,
         }
 
+    # Walk back from the current month until the first month without funding; cached months are read in one pass
     def fetch_funding_rate_history_until_start(self, symbol):
-        result = []
-        cur = datetime.now()
-        while True:
-            data = self._fetch_funding_rate_history_by_month(symbol, cur.year, cur.month)
-            if not data:
-                break
-            result.extend(data)
-            cur = cur - timedelta(days=cur.day)
-        return self._format_funding_rate_history(result)
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/apollox/funding/{symbol}")
+
+        data = load_history_until_start(folder_path, symbol, lambda year, month: self._fetch_funding_rate_history_by_month(symbol, year, month), self.policy)
+        return self._format_funding_rate_history(data)
     
+    # Fetch only the funding records after the last stored one and append them to the month files
+    def sync_funding_rate_history(self, symbol):
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/apollox/funding/{symbol}")
+
+        data = sync_month_history(folder_path, symbol, lambda since: self._fetch_funding_rate_history_since(symbol, since), self._get_funding_time)
+        if data is None:
+            return self.fetch_funding_rate_history_until_start(symbol)
+        return self._format_funding_rate_history(data)
+
     def fetch_hourly_ohlc(self, symbol, start_time, end_time):
         result = []
         cur = datetime.fromtimestamp(end_time)
@@ -86,8 +98,7 @@ class ApolloxFetcher:
 
         df["funding_rate"] = df["fundingRate"].astype(float)
         
-        df['datetime'] = pd.to_datetime(df['fundingTime'], unit='ms')
-        df['timestamp'] = df['datetime'].apply(lambda x: x.timestamp())
+        add_time_columns(df, 'fundingTime', 'ms')
         df.sort_values(by=["datetime"], ascending=True, inplace=True)
         df.reset_index(inplace=True, drop=True)
 
@@ -96,13 +107,15 @@ class ApolloxFetcher:
     def _format_ohlc(self, data):
         df = pd.DataFrame(data, columns=["timestamp", "open", "high", "low", "close", "x1", "x2", "x3", "x4", "x5", "x6", "x7"])
 
-        df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df['timestamp'] = df['datetime'].apply(lambda x: x.timestamp())
+        add_time_columns(df, 'timestamp', 'ms')
 
         df.sort_values(by=["datetime"], ascending=True, inplace=True)
         return df[['datetime', 'timestamp', 'open', 'high', 'low', 'close']]
 
     # Private functions
+    def _get_funding_time(self, item):
+        return item["fundingTime"] / 1000
+
     def _init_markets(self):
         markets = self._fetch_markets()
         for market in markets:
@@ -110,7 +123,7 @@ class ApolloxFetcher:
 
     def _fetch_markets(self):
         url = "https://fapi.apollox.finance/fapi/v1/exchangeInfo"
-        response = requests.get(url)
+        response = self.http.get(url)
         if response.status_code == 200:
             return response.json()["symbols"]
         else:
@@ -125,7 +138,7 @@ class ApolloxFetcher:
         else:
             params = {}
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
 
         if response.status_code == 200:
             return response.json()
@@ -133,19 +146,24 @@ class ApolloxFetcher:
             print(f"Error: {response.status_code}")
             return None
 
+    def _fetch_premium_index(self, symbol):
+        url = "https://fapi.apollox.finance/fapi/v1/premiumIndex"
+        params = {"symbol": symbol}
+
+        response = self.http.get(url, params=params)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            print(f"ApolloX {symbol} Error: {response.status_code}")
+            return None
+
     def _fetch_funding_rate_history_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/apollox/funding/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
-
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
 
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -161,24 +179,18 @@ class ApolloxFetcher:
         data = self._fetch_funding_rate_history(symbol, start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
 
-        return data
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
     
     def _fetch_hourly_ohlc_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/apollox/prices/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
 
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
-
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -194,10 +206,11 @@ class ApolloxFetcher:
         data = self._fetch_ohlc(symbol, "1h", start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
 
-        return data
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
 
     def _fetch_funding_rate_history(
         self, symbol, start_time=None, end_time=None, limit=100
@@ -212,13 +225,22 @@ class ApolloxFetcher:
         if end_time is not None:
             params["endTime"] = int(end_time * 1000)  # Convert to ms
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()
         else:
             print(f"ApolloX {symbol} Error: {response.status_code}")
             return None
         
+    def _fetch_funding_rate_history_since(self, symbol, since, limit=1000):
+        now = datetime.now().timestamp()
+        return fetch_cursor_pages(
+            lambda start_time: self._fetch_funding_rate_history(symbol, start_time + 0.001, now, limit),
+            since,
+            lambda data: self._get_funding_time(data[-1]),
+            limit,
+        )
+
     def _fetch_ohlc(self, symbol, timeframe, start_time, end_time):
         url = "https://fapi.apollox.finance/fapi/v1/klines"
         params = {
@@ -231,7 +253,7 @@ class ApolloxFetcher:
         if end_time is not None:
             params["endTime"] = int(end_time * 1000)  # Convert to ms
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()
         else:
@@ -1,15 +1,24 @@
-import requests
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import os
-import json
 import calendar
+from .libs.history import sync_month_history, load_history_until_start
+from .libs.paging import fetch_cursor_pages
+from .libs.raw_cache import get_month_mtime, load_month, save_month
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 
 class BitmexFetcher:
     funding_interval = 8
     markets_base = {}
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -33,25 +42,7 @@ class BitmexFetcher:
     def fetch_annualized_average_funding_rate(self, market):
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            "1y": 8760,
-            "all_time": len(df),
-        }
-
-        annualized_average_funding_rate = {}
-
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "bitmex",
@@ -59,19 +50,24 @@ class BitmexFetcher:
             "annualized_average_funding_rate": annualized_average_funding_rate,
         }
     
+    # Walk back from the current month until the first month without funding; cached months are read in one pass
     def fetch_funding_rate_history_until_start(self, symbol):
-        result = []
-        cur = datetime.now()
-        while True:
-            data = self._fetch_funding_rate_history_by_month(
-                symbol, cur.year, cur.month
-            )
-            if not data:
-                break
-            result.extend(data)
-            cur = cur - timedelta(days=cur.day)
-        return self._format_funding_rate_history(result)
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/bitmex/funding/{symbol}")
+
+        data = load_history_until_start(folder_path, symbol, lambda year, month: self._fetch_funding_rate_history_by_month(symbol, year, month), self.policy)
+        return self._format_funding_rate_history(data)
     
+    # Fetch only the funding records after the last stored one and append them to the month files
+    def sync_funding_rate_history(self, symbol):
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/bitmex/funding/{symbol}")
+
+        data = sync_month_history(folder_path, symbol, lambda since: self._fetch_funding_rate_history_since(symbol, since), self._get_funding_time)
+        if data is None:
+            return self.fetch_funding_rate_history_until_start(symbol)
+        return self._format_funding_rate_history(data)
+
     def fetch_hourly_ohlc(self, symbol, start_time, end_time):
         result = []
         cur = datetime.fromtimestamp(end_time)
@@ -90,10 +86,7 @@ class BitmexFetcher:
 
         df["funding_rate"] = df["fundingRate"].astype(float)
 
-        df['datetime'] = pd.to_datetime(df["timestamp"])
-        df['datetime'] = df['datetime'].dt.tz_localize(None)
-    
-        df['timestamp'] = df['datetime'].apply(lambda x: x.timestamp())
+        add_time_columns(df, "timestamp")
         df.sort_values(by=["datetime"], ascending=True, inplace=True)
         df.reset_index(inplace=True, drop=True) 
 
@@ -102,8 +95,7 @@ class BitmexFetcher:
     def _format_ohlc(self, data):
         df = pd.DataFrame(data, columns=["timestamp", "open", "bidPrice", "askPrice"])
 
-        df['datetime'] = pd.to_datetime(df["timestamp"])
-        df['timestamp'] = df['datetime'].apply(lambda x: x.timestamp())
+        add_time_columns(df, "timestamp")
         df["open"] = (df["bidPrice"] + df["askPrice"]) / 2
         df["high"] = df["open"]
         df["low"] = df["open"]
@@ -113,6 +105,9 @@ class BitmexFetcher:
         return df[['datetime', 'timestamp', 'open', 'high', 'low', 'close']]
 
     # Private functions
+    def _get_funding_time(self, item):
+        return pd.Timestamp(item["timestamp"]).timestamp()
+
     def _init_markets(self):
         markets = self._fetch_markets()
         for market in markets:
@@ -121,7 +116,7 @@ class BitmexFetcher:
     def _fetch_markets(self):
         url = "https://www.bitmex.com/api/v1/instrument/active?typ=FFWCSX"
 
-        response = requests.get(url)
+        response = self.http.get(url)
         if response.status_code == 200:
             return response.json()
         else:
@@ -131,7 +126,7 @@ class BitmexFetcher:
     def _fetch_24h_vol(self, symbol=None):
         url = "https://www.bitmex.com/api/v1/instrument/active?typ=FFWCSX"
 
-        response = requests.get(url)
+        response = self.http.get(url)
 
         if response.status_code == 200:
             data = response.json()
@@ -144,16 +139,9 @@ class BitmexFetcher:
     def _fetch_funding_rate_history_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/bitmex/funding/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
 
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
-
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -171,24 +159,18 @@ class BitmexFetcher:
         data = self._fetch_funding_rate_history(symbol, start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
 
-        return data
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
     
     def _fetch_hourly_ohlc_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/bitmex/prices/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
 
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
-
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -204,10 +186,11 @@ class BitmexFetcher:
         data = self._fetch_ohlc(symbol, "1h", start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
 
-        return data
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
 
     def _fetch_funding_rate_history(
         self, symbol, start_time=None, end_time=None, limit=100
@@ -221,19 +204,26 @@ class BitmexFetcher:
             "limit": limit,
         }
         if start_time is not None:
-            start_time = datetime.fromtimestamp(start_time)
-            params["startTime"] = start_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            params["startTime"] = format_utc(start_time)
         if end_time is not None:
-            end_time = datetime.fromtimestamp(end_time)
-            params["endTime"] = end_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            params["endTime"] = format_utc(end_time)
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()
         else:
             print(f"Bitmex {symbol} Error: {response.status_code}")
             return None
     
+    def _fetch_funding_rate_history_since(self, symbol, since, limit=100):
+        now = datetime.now().timestamp()
+        return fetch_cursor_pages(
+            lambda start_time: self._fetch_funding_rate_history(symbol, start_time + 1, now, limit),
+            since,
+            lambda data: max(self._get_funding_time(item) for item in data),
+            limit,
+        )
+
     def _fetch_ohlc(self, symbol, timeframe, start_time, end_time):
         url = "https://www.bitmex.com/api/v1/quote/bucketed"
         params = {
@@ -244,13 +234,17 @@ class BitmexFetcher:
         }
 
         if start_time is not None:
-            params["startTime"] = datetime.fromtimestamp(start_time).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            params["startTime"] = format_utc(start_time)
         if end_time is not None:
-            params["endTime"] = datetime.fromtimestamp(end_time).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            params["endTime"] = format_utc(end_time)
         
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()
         else:
             print(f"Bitmex {symbol} Error: {response.status_code}")
             return None
+
+# Epoch seconds as the ISO time of the Bitmex API, which reads the "Z" suffix as UTC
+def format_utc(epoch):
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
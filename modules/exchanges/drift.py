@@ -1,12 +1,42 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 import os
-import json
 import calendar
 import asyncio
-from multiprocessing import Pool
+import io
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from .libs.history import get_walk_start
+from .libs.raw_cache import get_month_mtime, load_month, save_month
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy
+from ..session import default_client, POOL_SIZE
+from ..funding_stats import get_annualized_average_funding_rate
+
+# Day files of every month and market are downloaded by one bounded thread pool, so fetching several months at
+# once stays within the connection pool of the shared HTTP client
+DAY_FETCH_WORKERS = POOL_SIZE
+_day_executor = ThreadPoolExecutor(max_workers=DAY_FETCH_WORKERS)
+
+# Numeric columns of the S3 CSV files, the other columns are read as strings
+CSV_TYPES = {
+    "ts": pa.int64(),
+    "start": pa.int64(),
+    "fundingRate": pa.float64(),
+    "oraclePriceTwap": pa.float64(),
+    "open": pa.float64(),
+    "high": pa.float64(),
+    "low": pa.float64(),
+    "close": pa.float64(),
+    "fillOpen": pa.float64(),
+    "fillHigh": pa.float64(),
+    "fillLow": pa.float64(),
+    "fillClose": pa.float64(),
+    "quoteVolume": pa.float64(),
+    "baseVolume": pa.float64(),
+}
 
 class DriftMarketFetcher:
     funding_interval = 1
@@ -30,6 +60,10 @@ class DriftMarketFetcher:
     funding_rate_persision = 9
     price_precision = 6
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -46,44 +80,22 @@ class DriftMarketFetcher:
 
         current_time = datetime.now().timestamp() * 1000
         closest_data = None
-        closest_time_diff = float("inf")
 
-        for item in raw:
-            item_time = int(item["start"])
-            time_diff = abs(current_time - item_time)
-            if time_diff < closest_time_diff:
-                closest_time_diff = time_diff
-                closest_data = item
+        if raw is not None and len(raw) > 0:
+            time_diff = (current_time - raw["start"].astype(np.int64)).abs()
+            closest_data = raw.loc[time_diff.idxmin()]
 
         return {
             "exchange": "drift",
             "market": market,
             "timestamp": int(closest_data["start"]),
-            "volume": float(closest_data["baseVolume"]) if closest_data else 0,
+            "volume": float(closest_data["baseVolume"]) if closest_data is not None else 0,
         }
 
     def fetch_annualized_average_funding_rate(self, market):
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            "1y": 8760,
-            "all_time": len(df),
-        }
-
-        annualized_average_funding_rate = {}
-
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "drift",
@@ -92,17 +104,18 @@ class DriftMarketFetcher:
         }
     
     def fetch_funding_rate_history_until_start(self, symbol):
+        dirname = os.path.dirname(__file__)
         result = []
-        cur = datetime.now()
+        cur = get_walk_start(os.path.join(dirname, f"../data/drift/funding/{symbol}"), symbol, self.policy)
         while True:
             data = self._fetch_funding_rate_history_by_month(
                 symbol, cur.year, cur.month
             )
-            if not data:
+            if data is None or len(data) == 0:
                 break
-            result.extend(data)
+            result.append(data)
             cur = cur - timedelta(days=cur.day)
-        return self._format_funding_rate_history(result)
+        return self._format_funding_rate_history(pd.concat(result, ignore_index=True) if result else [])
     
     def fetch_hourly_ohlc(self, symbol, start_time, end_time):
         result = []
@@ -112,9 +125,9 @@ class DriftMarketFetcher:
             if cur.timestamp() < start_time:
                 break
             if data is not None:
-                result.extend(data)
+                result.append(data)
             cur = cur - timedelta(days=cur.day)
-        return self._format_ohlc(result)
+        return self._format_ohlc(pd.concat(result, ignore_index=True) if result else [])
     
     # Format functions
     def _format_funding_rate_history(self, data):
@@ -127,38 +140,30 @@ class DriftMarketFetcher:
         
         df["funding_rate"] = df["fundingRate"].astype(float) / df["oraclePriceTwap"].astype(float)
         
-        df["datetime"] = pd.to_datetime(df["ts"].astype(int), unit="s")
-        df['timestamp'] = df['datetime'].apply(lambda x: x.timestamp())
+        add_time_columns(df, "ts", "s")
         df.sort_values(by=["datetime"], ascending=True, inplace=True)
         df.reset_index(inplace=True, drop=True)
 
         return df[["datetime", "timestamp", "funding_rate"]]
     
     def _format_ohlc(self, data):
-        # Fix dirty Drift data
-        for index, item in enumerate(data):
-            keys = ["start", "open", "close", "high", "low", "quoteVolume", "baseVolume", "resolution", "recordKey"]
-            for k in keys:
-                if f"\"{k}\"" in item.keys():
-                    data[index][f"{k}"] = item[f"\"{k}\""].replace("\"", '').replace("\"", '')
-        
-        # Construct dataframe
-        df = pd.DataFrame(data, columns=["start", "open", "high", "low", "close", "fillOpen", "fillHigh", "fillLow", "fillClose"])
+        df = data.copy() if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
 
-        df['start'] = df['start'].astype(int) * 1000 * 1000
+        # Fix dirty Drift data: month files cached before the CSV reader was used have quoted keys and values
+        for column in [column for column in df.columns if column.startswith('"')]:
+            key = column.strip('"')
+            values = df[column].str.replace('"', '')
+            df[key] = df[key].fillna(values) if key in df.columns else values
 
-        df["datetime"] = pd.to_datetime(df["start"])
-        df["timestamp"] = df['datetime'].apply(lambda x: x.timestamp())
+        # Construct dataframe
+        df = df.reindex(columns=["start", "open", "high", "low", "close", "fillOpen", "fillHigh", "fillLow", "fillClose"])
 
-        df.loc[(df['open'] == "undefined") | (pd.isna(df['open'])), 'open'] = df['fillOpen']
-        df.loc[(df['high'] == "undefined") | (pd.isna(df['high'])), 'high'] = df['fillHigh']
-        df.loc[(df['low'] == "undefined") | pd.isna(df['low']), 'low'] = df['fillLow']
-        df.loc[(df['close'] == "undefined") | pd.isna(df['close']), 'close'] = df['fillClose']
+        add_time_columns(df, "start", "ms")
 
-        df["open"] = df["open"].astype(float)
-        df["high"] = df['high'].astype(float)
-        df["low"] = df['low'].astype(float)
-        df["close"] = df['close'].astype(float)
+        # Missing prices ("undefined" in month files cached as strings) use the fill prices
+        for column, fill_column in [("open", "fillOpen"), ("high", "fillHigh"), ("low", "fillLow"), ("close", "fillClose")]:
+            values = pd.to_numeric(df[column], errors="coerce")
+            df[column] = values.fillna(pd.to_numeric(df[fill_column], errors="coerce"))
 
         df.sort_values(by=["datetime"], ascending=True, inplace=True)
         return df[['datetime', 'timestamp', 'open', 'high', 'low', 'close']]
@@ -167,94 +172,101 @@ class DriftMarketFetcher:
     def _init_markets(self):
         pass
 
+    # Read a Drift S3 CSV file with the pyarrow CSV reader. Quoted header names and values are unquoted by the
+    # reader and "undefined" prices become NaN. Months are already fetched concurrently, so the reader is single threaded.
+    def _parse_csv(self, content):
+        table = pa_csv.read_csv(
+            io.BytesIO(content),
+            read_options=pa_csv.ReadOptions(use_threads=False),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=CSV_TYPES,
+                null_values=["undefined", ""],
+            ),
+        )
+        return table.rename_columns([column.strip().strip('"') for column in table.column_names]).to_pandas()
+
+    # Day files are tiny, so consecutive files with the same header are joined and parsed at once
+    # (the header changed a few times over Drift's history)
+    def _parse_csv_files(self, contents):
+        runs = []
+        for content in contents:
+            header, _, body = content.partition(b"\n")
+            if not body.endswith(b"\n"):
+                body += b"\n"
+            if runs and runs[-1][0] == header:
+                runs[-1][1].append(body)
+            else:
+                runs.append((header, [body]))
+        return pd.concat([self._parse_csv(header + b"\n" + b"".join(bodies)) for header, bodies in runs], ignore_index=True)
+
     def _fetch_24h_vol(self, symbol=None):
         url = f"https://drift-historical-data.s3.eu-west-1.amazonaws.com/program/dRiftyHA39MWEi3m9aunc5MzRF1JYuBsbn6VPcn33UH/market/{symbol}/candles/{datetime.now().year}/{datetime.now().month}/resolution/D"
-        response = requests.get(url)
+        response = self.http.get(url)
 
         if response.status_code == 200:
-            lines = response.text.strip().split("\n")
-            header = lines[0].split(",")
-            data = []
-            for line in lines[1:]:
-                values = line.split(",")
-                item = dict(zip(header, values))
-                data.append(item)
-            return data
+            return self._parse_csv(response.content)
         else:
             print(f"Error: {response.status_code}")
             return None
 
-    def _fetch_funding_rate_history_by_month(self, symbol, year, month, skip_refresh = True):
+    def _fetch_funding_rate_history_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/drift/funding/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
-
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
 
-        if file_existed and (not is_same_month or skip_refresh):
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return pd.DataFrame(load_month(folder_path, symbol, year, month))
         
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
         
         data = self._fetch_funding_rate_history(symbol, year, month)
 
-        if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
-        
-        return data
+        if data is not None and len(data) > 0:
+            save_month(folder_path, symbol, year, month, data)
+            return data
+
+        # Keep the cached month when a refresh returns nothing
+        cached = load_month(folder_path, symbol, year, month)
+        return data if cached is None else pd.DataFrame(cached)
     
-    def _fetch_hourly_ohlc_by_month(self, symbol, year, month, skip_refresh = True):
+    def _fetch_hourly_ohlc_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/drift/prices/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
-
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
 
-        if file_existed and (not is_same_month or skip_refresh):
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return pd.DataFrame(load_month(folder_path, symbol, year, month))
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
 
         data = self._fetch_ohlc(symbol, "60", year, month)
 
-        if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+        if data is not None and len(data) > 0:
+            save_month(folder_path, symbol, year, month, data)
+            return data
 
-        return data
+        # Keep the cached month when a refresh returns nothing
+        cached = load_month(folder_path, symbol, year, month)
+        return data if cached is None else pd.DataFrame(cached)
         
     def _fetch_funding_rate_history(self, symbol, year, month):
         # Change fetching type to suit the device calling this function
-        values = self._fetch_funding_rate_history_all_day_async(symbol, year, month)
-        result = []
-        for item in values:
-            if item is not None:
-                result.extend(item)
-        return result
+        values = self._fetch_funding_rate_history_all_day_concurrent(symbol, year, month)
+        contents = [item for item in values if item is not None]
+        return self._parse_csv_files(contents) if contents else None
         
-    # This function consumes a lot of CPU as it concurrently fetches data. Consider using sync alternative to reduce CPU usage
-    def _fetch_funding_rate_history_all_day_async(self, symbol, year, month):
+    # Fetches the remaining days of the month concurrently on the shared day pool (I/O bound, no extra processes)
+    def _fetch_funding_rate_history_all_day_concurrent(self, symbol, year, month):
         num_days_in_month = calendar.monthrange(year, month)[1]
         first_result = self._fetch_funding_rate_history_by_day(symbol, year, month, 1)
         if first_result is not None:
-            with Pool(processes=num_days_in_month) as pool:
-                values = pool.starmap(self._fetch_funding_rate_history_by_day, [(symbol, year, month, day + 2) for day in range(num_days_in_month)])
-                values.insert(0, first_result)
+            days = range(2, num_days_in_month + 1)
+            values = list(_day_executor.map(lambda day: self._fetch_funding_rate_history_by_day(symbol, year, month, day), days))
+            values.insert(0, first_result)
             return values
         return []
     
-    # This function consumes less CPU but processes in sequence, making it much slower than the async approach
+    # Processes the days in sequence, slower than the concurrent approach but uses a single connection
     def _fetch_funding_rate_history_all_day_sync(self, symbol, year, month):
         num_days_in_month = calendar.monthrange(year, month)[1]
         values = [self._fetch_funding_rate_history_by_day(symbol, year, month, day + 1) for day in range(num_days_in_month)]
@@ -262,33 +274,19 @@ class DriftMarketFetcher:
     
     def _fetch_funding_rate_history_by_day(self, symbol, year, month, day):
         url = f"https://drift-historical-data-v2.s3.eu-west-1.amazonaws.com/program/dRiftyHA39MWEi3m9aunc5MzRF1JYuBsbn6VPcn33UH/market/{symbol}/fundingRateRecords/{year}/{year}{month:02}{day:02}"
-        response = requests.get(url)
+        response = self.http.get(url)
         
         if response.status_code == 200:
-            lines = response.text.strip().split("\n")
-            header = lines[0].split(",")
-            data = []
-            for line in lines[1:]:
-                values = line.split(",")
-                item = dict(zip(header, values))
-                data.append(item)
-            return data
+            return response.content
         else:
             return None
         
     def _fetch_ohlc(self, symbol, timeframe, year, month):
         url = f"https://drift-historical-data.s3.eu-west-1.amazonaws.com/program/dRiftyHA39MWEi3m9aunc5MzRF1JYuBsbn6VPcn33UH/market/{symbol}/candles/{year}/{month}/resolution/{timeframe}"
-        response = requests.get(url)
+        response = self.http.get(url)
 
         if response.status_code == 200:
-            lines = response.text.strip().split("\n")
-            header = lines[0].split(",")
-            data = []
-            for line in lines[1:]:
-                values = line.split(",")
-                item = dict(zip(header, values))
-                data.append(item)
-            return data
+            return self._parse_csv(response.content)
         else:
             print(f"Use fallback {symbol}...")
             return self._fetch_fallback_ohlc(symbol, year, month)
@@ -317,10 +315,10 @@ class DriftMarketFetcher:
         if end_time is not None:
             params["endTime"] = int(end_time * 1000)  # Convert to ms
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             binance_price = response.json()
-            drift_price = [{
+            drift_price = pd.DataFrame([{
                 "start": str(item[0]),
                 "open": item[1],
                 "close": item[4],
@@ -330,7 +328,7 @@ class DriftMarketFetcher:
                 "baseVolume": item[5],
                 "resolution": "60",
                 "recordKey": str(item[0])
-            } for item in binance_price]
+            } for item in binance_price], dtype=str)
             return drift_price
         else:
             print(f"Drift fallback price {symbol} Error: {response.status_code}")
@@ -1,14 +1,23 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
 import json
 from glob import glob
+from .libs.segments import append_segment, get_last_time, load_segments
+from .libs.paging import fetch_cursor_pages
+from .libs.timestamps import add_time_columns, to_datetime, to_epoch
+from ..policy import default_policy, get_folder_mtime
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 class DYDXFetcher:
     funding_interval = 8
     markets_base = {}
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -32,25 +41,7 @@ class DYDXFetcher:
     def fetch_annualized_average_funding_rate(self, market):
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            "1y": 8760,
-            "all_time": len(df),
-        }
-
-        annualized_average_funding_rate = {}
-
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "dydx",
@@ -58,63 +49,17 @@ class DYDXFetcher:
             "annualized_average_funding_rate": annualized_average_funding_rate,
         }
     
+    # The history is kept in an append-only segment store (see libs/segments.py): a refresh requests the pages
+    # newer than the last stored record and writes them as one new segment
     def fetch_funding_rate_history_until_start(self, symbol):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/dydx/{symbol}")
 
-        cache = self._load_cache(folder_path)
-
-        latest_time_in_cache = None
-        if cache:
-            latest_time_in_cache = datetime.strptime(
-                cache[0]["effectiveAt"], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
-
-        start_time = datetime.now()
-        new_data = []
-        while True:
-            response_data = self._fetch_funding_rate_history(symbol, start_time)
-
-            if not response_data:
-                break
-
-            data = response_data["historicalFunding"]
-
-            if len(data) == 0:
-                break
-
-            response_oldest_time = datetime.strptime(
-                data[-1]["effectiveAt"], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
+        self._migrate_cache(folder_path)
+        if self.policy.should_fetch_latest(get_folder_mtime(folder_path)):
+            self._sync_funding_rate_history(symbol, folder_path)
 
-            # Break if we've reached the point in time where our cache starts
-            if (
-                latest_time_in_cache
-                and response_oldest_time.timestamp() <= latest_time_in_cache.timestamp()
-            ):
-                break
-
-            if start_time.timestamp() == response_oldest_time.timestamp():
-                break
-
-            new_data.extend(data)
-            start_time = response_oldest_time
-
-        if latest_time_in_cache:
-            new_data = [
-                entry
-                for entry in new_data
-                if datetime.strptime(
-                    entry["effectiveAt"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                ).timestamp()
-                > latest_time_in_cache.timestamp()
-            ]
-
-        data = new_data + cache
-
-        self._save_cache(data, folder_path)
-
-        return self.format_funding_rate_history(data)
+        return self.format_funding_rate_history(load_segments(folder_path))
     
     # Format functions
     def format_funding_rate_history(self, data):
@@ -122,10 +67,11 @@ class DYDXFetcher:
 
         df["funding_time"] = df["effectiveAt"]
         df["funding_rate"] = df["rate"].astype(float)
+        add_time_columns(df, "funding_time")
 
         df.sort_values(by=["funding_time"], ascending=False, inplace=True)
 
-        return df[['funding_time', 'funding_rate']]
+        return df[['funding_time', 'funding_rate', 'datetime', 'timestamp']]
 
 
     # Private functions
@@ -137,7 +83,7 @@ class DYDXFetcher:
     def _fetch_markets(self):
         url = "https://api.dydx.exchange/v3/markets"
 
-        response = requests.get(url)
+        response = self.http.get(url)
         if response.status_code == 200:
             return response.json()['markets']
         else:
@@ -147,7 +93,7 @@ class DYDXFetcher:
     def _fetch_24h_vol(self, symbol=None):
         url = f"https://api.dydx.exchange/v3/stats/{symbol}"
 
-        response = requests.get(url)
+        response = self.http.get(url)
 
         if response.status_code == 200:
             return response.json()["markets"][symbol]
@@ -155,36 +101,58 @@ class DYDXFetcher:
             print(f"Error: {response.status_code}")
             return None
 
-    def _load_cache(self, folder_path):
-        cache_files = sorted(glob(f"{folder_path}/*.json"), reverse=True)
+    # Fetch the pages newer than the last stored record (newest first, 100 records each) and append them
+    def _sync_funding_rate_history(self, symbol, folder_path):
+        last_time = get_last_time(folder_path)
+
+        def fetch_page(before):
+            response_data = self._fetch_funding_rate_history(symbol, before)
+            return response_data["historicalFunding"] if response_data else None
+
+        # Stop at the page reaching the stored history, or when the API has nothing older (the cursor stays)
+        def next_cursor(data):
+            if last_time is not None and to_epoch(to_datetime(pd.Series([item["effectiveAt"] for item in data]))).min() <= last_time:
+                return None
+            return data[-1]["effectiveAt"]
+
+        data = fetch_cursor_pages(fetch_page, None, next_cursor)
+        if not data:
+            return
+        records = pd.DataFrame(data)
+        epochs = to_epoch(to_datetime(records["effectiveAt"]))
+        new = (epochs > last_time) if last_time is not None else pd.Series(True, index=epochs.index)
+        new &= ~epochs.duplicated()
+        append_segment(folder_path, records[new], epochs[new])
+
+    # History cached by older versions as JSON chunks ({effectiveAt}.json, newest first) becomes one segment
+    def _migrate_cache(self, folder_path):
+        cache_files = glob(f"{folder_path}/*.json")
+        if not cache_files:
+            return
         data = []
         for file in cache_files:
             with open(file, "r") as f:
                 data.extend(json.load(f))
-        return data
-
-    def _save_cache(self, data, folder_path):
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
-
-        RECORDS_PER_FILE = 1000
-        for i in range(0, len(data), RECORDS_PER_FILE):
-            chunk = data[i : i + RECORDS_PER_FILE]
-            filename = f"{folder_path}/{chunk[0]['effectiveAt']}.json"
-            with open(filename, "w") as f:
-                json.dump(chunk, f)
+        if data:
+            records = pd.DataFrame(data)
+            epochs = to_epoch(to_datetime(records["effectiveAt"]))
+            keep = ~epochs.duplicated()
+            append_segment(folder_path, records[keep], epochs[keep])
+        for file in cache_files:
+            os.remove(file)
 
-    def _fetch_funding_rate_history(self, symbol, start_time=None):
+    # Records effective at or before effective_before (an effectiveAt string), the newest ones without it
+    def _fetch_funding_rate_history(self, symbol, effective_before=None):
         url = f"https://api.dydx.exchange/v3/historical-funding/{symbol}"
 
         params = {
             "limit": 100
         }
 
-        if start_time is not None:
-            params["effectiveBeforeOrAt"] = start_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        if effective_before is not None:
+            params["effectiveBeforeOrAt"] = effective_before
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()
         else:
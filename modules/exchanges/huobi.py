@@ -1,15 +1,23 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
 import json
 from glob import glob
+from .libs.paging import fetch_all_pages
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy, get_folder_mtime
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 class HuobiFetcher:
 
     funding_interval = 8
     markets_base = {}
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -36,25 +44,7 @@ class HuobiFetcher:
     def fetch_annualized_average_funding_rate(self, market):
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            '1y': 8760,
-            'all_time': len(df)
-        }
-
-        annualized_average_funding_rate = {}
-        
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "huobi",
@@ -67,26 +57,24 @@ class HuobiFetcher:
         folder_path = os.path.join(dirname, f"../data/huobi/{symbol}")
         
         cache = self.load_cache(folder_path)
+        if not self.policy.should_fetch_latest(get_folder_mtime(folder_path)):
+            return self._format_funding_rate_history(cache)
 
         latest_time_in_cache = None
         if cache:
             latest_time_in_cache = cache[0]['funding_time']
 
-        page_index = 1
-        new_data = []
-        while True:
-            response_data = self._fetch_funding_rate_history(symbol, page_index)
-
-            if not response_data:
-                break
-
-            # Break if we've reached the point in time where our cache starts
-            if latest_time_in_cache is not None and response_data[-1]['funding_time'] <= latest_time_in_cache:
-                break
-
-            new_data.extend(response_data)
-            page_index += 1
-        
+        # Newest records first: page 1 reports the number of pages, the other pages are requested concurrently
+        reaches_cache = None
+        if latest_time_in_cache is not None:
+            reaches_cache = lambda records: records[-1]['funding_time'] <= latest_time_in_cache
+        new_data = fetch_all_pages(lambda page_index: self._fetch_funding_rate_history(symbol, page_index), stop=reaches_cache)
+
+        # A funding published during the walk shifts the pages by one record, keep its first copy only
+        unique = {}
+        for entry in new_data:
+            unique.setdefault(entry['funding_time'], entry)
+        new_data = list(unique.values())
         if latest_time_in_cache:
             new_data = [entry for entry in new_data if entry['funding_time'] > latest_time_in_cache]
 
@@ -101,9 +89,10 @@ class HuobiFetcher:
         df = pd.DataFrame(data, columns=["funding_time", "funding_rate"])
 
         df["funding_rate"] = df["funding_rate"].astype(float)
+        add_time_columns(df, "funding_time", "ms")
 
         df.sort_values(by=["funding_time"], ascending=False, inplace=True)
-        return df[["funding_time", "funding_rate"]]
+        return df[["funding_time", "funding_rate", "datetime", "timestamp"]]
     
     # Private functions
     def _init_markets(self):
@@ -114,7 +103,7 @@ class HuobiFetcher:
     def _fetch_markets(self):
         url = 'https://api.hbdm.com/swap-api/v1/swap_contract_info'
 
-        response = requests.get(url)
+        response = self.http.get(url)
         if response.status_code == 200:
             return response.json()['data']
         else:
@@ -129,7 +118,7 @@ class HuobiFetcher:
         else:
             params = {}
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
 
         if response.status_code == 200:
             return response.json()
@@ -156,6 +145,7 @@ class HuobiFetcher:
             with open(filename, 'w') as f:
                 json.dump(chunk, f)
 
+    # One page of the history (newest first) and the number of pages
     def _fetch_funding_rate_history(
         self, symbol, page_index = 1, limit=50
     ):
@@ -166,9 +156,10 @@ class HuobiFetcher:
             "page_size": limit,
         }
         
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
-            return response.json()['data']['data']
+            data = response.json()['data']
+            return data['data'], data['total_page']
         else:
             print(f"Huobi {symbol} Error: {response.status_code}")
             return None
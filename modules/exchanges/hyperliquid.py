@@ -1,15 +1,24 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
-import json
 import calendar
+from .libs.history import sync_month_history, load_history_until_start
+from .libs.paging import fetch_cursor_pages
+from .libs.raw_cache import get_month_mtime, load_month, save_month
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 
 class HyperLiquidFetcher:
     funding_interval = 8
     markets_base = {}
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -34,25 +43,7 @@ class HyperLiquidFetcher:
     def fetch_annualized_average_funding_rate(self, market):
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            "1y": 8760,
-            "all_time": len(df),
-        }
-
-        annualized_average_funding_rate = {}
-
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "hyperliquid",
@@ -60,28 +51,39 @@ class HyperLiquidFetcher:
             "annualized_average_funding_rate": annualized_average_funding_rate,
         }
     
+    # Walk back from the current month until the first month without funding; cached months are read in one pass
     def fetch_funding_rate_history_until_start(self, symbol):
-        result = []
-        cur = datetime.now()
-        while True:
-            data = self._fetch_funding_rate_history_by_month(symbol, cur.year, cur.month)
-            if not data:
-                break
-            result.extend(data)
-            cur = cur - timedelta(days=calendar.monthrange(cur.year, cur.month)[1])
-        return self._format_funding_rate_history(result)
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/hyperliquid/{symbol}")
+
+        data = load_history_until_start(folder_path, symbol, lambda year, month: self._fetch_funding_rate_history_by_month(symbol, year, month), self.policy)
+        return self._format_funding_rate_history(data)
     
+    # Fetch only the funding records after the last stored one and append them to the month files
+    def sync_funding_rate_history(self, symbol):
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/hyperliquid/{symbol}")
+
+        data = sync_month_history(folder_path, symbol, lambda since: self._fetch_funding_rate_history_since(symbol, since), self._get_funding_time)
+        if data is None:
+            return self.fetch_funding_rate_history_until_start(symbol)
+        return self._format_funding_rate_history(data)
+
     # Format functions
     def _format_funding_rate_history(self, data):
         df = pd.DataFrame(data, columns=["time", "fundingRate"])
 
         df['funding_time'] = df["time"]
         df["funding_rate"] = df["fundingRate"].astype(float)
+        add_time_columns(df, "funding_time", "ms")
 
         df.sort_values(by=["funding_time"], ascending=False, inplace=True)
-        return df[["funding_time", "funding_rate"]]
+        return df[["funding_time", "funding_rate", "datetime", "timestamp"]]
 
     # Private functions
+    def _get_funding_time(self, item):
+        return item["time"] / 1000
+
     def _init_markets(self):
         markets = self._fetch_markets()
         for market in markets:
@@ -92,7 +94,7 @@ class HyperLiquidFetcher:
         body = {
             "type": "meta"
         }
-        response = requests.post(url, json=body)
+        response = self.http.post(url, json=body)
         if response.status_code == 200:
             return response.json()["universe"]
         else:
@@ -115,7 +117,7 @@ class HyperLiquidFetcher:
             },
         }
 
-        response = requests.post(url, json=data)
+        response = self.http.post(url, json=data)
 
         if response.status_code == 200:
             return response.json()
@@ -126,16 +128,9 @@ class HyperLiquidFetcher:
     def _fetch_funding_rate_history_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/hyperliquid/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
-
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
 
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -153,10 +148,20 @@ class HyperLiquidFetcher:
         data = self._fetch_funding_rate_history(symbol, start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
 
-        return data
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
+
+    def _fetch_funding_rate_history_since(self, symbol, since, limit=500):
+        now = datetime.now().timestamp()
+        return fetch_cursor_pages(
+            lambda start_time: self._fetch_funding_rate_history(symbol, start_time + 0.001, now),
+            since,
+            lambda data: self._get_funding_time(data[-1]),
+            limit,
+        )
 
     def _fetch_funding_rate_history(self, symbol, start_time, end_time=None):
         url = "https://api.hyperliquid.xyz/info"
@@ -168,7 +173,7 @@ class HyperLiquidFetcher:
             "endTime": int(end_time * 1000),
         }
 
-        response = requests.post(url, json=data)
+        response = self.http.post(url, json=data)
 
         if response.status_code == 200:
             return response.json()
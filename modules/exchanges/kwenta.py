@@ -1,21 +1,29 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
 import os
-import json
 from .libs.kwenta.contracts import addresses, abis
-from web3 import Web3
+from .libs.kwenta.onchain import OnchainClient
+from .libs.kwenta.subgraph import default_subgraph
 from dotenv import load_dotenv
-import asyncio
 from decimal import Decimal
 import calendar
 
-from gql import gql, Client
-from gql.transport.aiohttp import AIOHTTPTransport
+from .libs.history import get_walk_start
+from .libs.raw_cache import get_month_mtime, load_month, save_month
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 load_dotenv()
 
+FUNDING_RATE_FIELDS = ['id', 'period', 'asset', 'marketKey', 'fundingRate', 'timestamp']
+VOLUME_FIELDS = ['id', 'marketKey', 'period', 'timestamp', 'volume']
+
+NETWORK_ID = 10  # Optimism
+MARKET_SUMMARIES_TTL = 150  # blocks (about 5 minutes on Optimism) before the on-chain market reads are refreshed
+
 
 class KwentaMarketFetcher:
 
@@ -27,6 +35,13 @@ class KwentaMarketFetcher:
     markets: dict = {}
     markets_base = {}
 
+    def __init__(self, http=None, policy=None, subgraph=None, onchain=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+        self.subgraph = subgraph or default_subgraph
+        # Contract reads share the pooled HTTP session, see libs/kwenta/onchain.py
+        self.onchain = onchain or OnchainClient(http=self.http)
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -57,25 +72,7 @@ class KwentaMarketFetcher:
 
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            '1h': 1,
-            '24h': 24,
-            '3d': 72,
-            '7d': 168,
-            '30d': 720,
-            '90d': 2160,
-            '120d': 2880,
-            '1y': 8760,
-            'all_time': len(df)
-        }
-
-        annualized_average_funding_rate = {}
-        
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "kwenta",
@@ -84,15 +81,38 @@ class KwentaMarketFetcher:
         }
     
     def fetch_funding_rate_history_until_start(self, symbol):
-        result = []
-        cur = datetime.now()
-        while True:
-            data = self._fetch_funding_rate_history_by_month(symbol, cur.year, cur.month)
-            if not data:
-                break
-            result.extend(data)
-            cur = cur - timedelta(days=calendar.monthrange(cur.year, cur.month)[1])
-        return self._format_funding_rate_history(result)
+        return self.fetch_all_funding_rate_history([symbol])[symbol]
+
+    # Funding history of many markets (all markets by default) as {symbol: df}. Every month is requested for all
+    # markets at once on the shared subgraph connection, a few markets per request.
+    # Every market walks back from its own first month (see get_walk_start), it joins the walk once it is reached.
+    def fetch_all_funding_rate_history(self, symbols=None):
+        symbols = self.list_markets() if symbols is None else symbols
+        dirname = os.path.dirname(__file__)
+        starts = {symbol: get_walk_start(os.path.join(dirname, f"../data/kwenta/{symbol}"), symbol, self.policy) for symbol in symbols}
+        result = {symbol: [] for symbol in symbols}
+        pending = list(symbols)
+        cur = max(starts.values(), default=None)
+        while pending:
+            active = [symbol for symbol in pending if (starts[symbol].year, starts[symbol].month) >= (cur.year, cur.month)]
+            months = self._fetch_funding_rate_history_by_month_many(active, cur.year, cur.month)
+            pending = [symbol for symbol in pending if symbol not in months or months[symbol]]
+            for symbol in active:
+                if months[symbol]:
+                    result[symbol].extend(months[symbol])
+            cur = cur - timedelta(days=cur.day)
+        return {symbol: self._format_funding_rate_history(data) for symbol, data in result.items()}
+
+    # Current hourly funding rate of every market, {symbol: rate}, read from all market contracts in one call
+    def fetch_current_funding_rates(self):
+        if len(self.markets_base) == 0:
+            self._init_markets()
+
+        rates = self._read_markets("currentFundingRate")
+        return {
+            symbol: float(Decimal(rate) / Decimal(10**18) / Decimal(24))
+            for symbol, rate in rates.items() if rate is not None
+        }
     
     # Format functions
     def _format_funding_rate_history(self, raw_data):
@@ -108,10 +128,11 @@ class KwentaMarketFetcher:
 
         df['funding_time'] = df['timestamp'].astype(int)
         df['funding_rate'] = df['funding_rate'].astype(float)
+        add_time_columns(df, 'funding_time', 's')
 
         df.sort_values(by=['funding_time'], ascending=False, inplace=True)
         
-        return df[['funding_time', 'funding_rate']]
+        return df[['funding_time', 'funding_rate', 'datetime', 'timestamp']]
 
     # Private functions
     def _init_markets(self):
@@ -121,18 +142,11 @@ class KwentaMarketFetcher:
             self.markets_base[key] = key
 
     def _fetch_markets(self):
-        rpc_url = os.environ["KWENTA_RPC_URL"]
-        web3 = Web3(Web3.HTTPProvider(rpc_url))
-
-        network_id = 10
-        marketdata_contract = web3.eth.contract(
-            web3.to_checksum_address(
-                addresses["PerpsV2MarketData"][network_id]
-            ),
-            abi=abis["PerpsV2MarketData"],
-        )
-        allmarketsdata = (
-            marketdata_contract.functions.allProxiedMarketSummaries().call()
+        marketdata_contract = self.onchain.get_contract(addresses["PerpsV2MarketData"][NETWORK_ID], abis["PerpsV2MarketData"])
+        allmarketsdata = self.onchain.cached(
+            "allProxiedMarketSummaries",
+            MARKET_SUMMARIES_TTL,
+            lambda block_number: self.onchain.multicall([(marketdata_contract, "allProxiedMarketSummaries")], block_number)[0],
         )
 
         markets = {}
@@ -160,52 +174,28 @@ class KwentaMarketFetcher:
             markets[token_symbol] = normalized_market
 
         return markets
+
+    # One view function (without arguments) of every market contract, {symbol: value}, in a single multicall
+    def _read_markets(self, function_name):
+        symbols = list(self.markets.keys())
+        contracts = [self.onchain.get_contract(self.markets[symbol]["market_address"], abis["PerpsV2Market"]) for symbol in symbols]
+        values = self.onchain.cached(
+            function_name,
+            MARKET_SUMMARIES_TTL,
+            lambda block_number: self.onchain.multicall([(contract, function_name) for contract in contracts], block_number),
+        )
+        return dict(zip(symbols, values))
         
     def _fetch_24h_vol(self, symbol=None):
-        url = 'https://api.thegraph.com/subgraphs/name/kwenta/optimism-perps'
-        query = """
-            query (
-                $last_id: ID!
-                $market_key: Bytes!
-                $min_timestamp: BigInt = 0
-            ) {
-                futuresAggregateStats(
-                    where: {
-                        id_gt: $last_id
-                        marketKey: $market_key
-                        period: 3600
-                        timestamp_gte: $min_timestamp
-                    }
-                    first: 1000
-                    orderBy: timestamp
-                    orderDirection: desc
-                ) {
-                    id
-                    marketKey
-                    period
-                    timestamp
-                    volume
-                }
-            }
-        """
-
-        transport = AIOHTTPTransport(url=url)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-        query = gql(query)
-
-        market_key = None if self.markets[symbol] is None else self.markets[symbol]['key']
-
+        market_key = self.markets[symbol]['key']
         min_timestamp = int((datetime.now() - timedelta(days=1)).timestamp())
-        variables = {
-            "last_id": "",
-            "market_key": market_key.hex(),
-            "min_timestamp": min_timestamp
-        }
 
-        response = asyncio.run(self._gql_fetch(client, query, variables))
+        data = self.subgraph.fetch_by_market(
+            'futuresAggregateStats', VOLUME_FIELDS, {symbol: market_key.hex()}, where="period: 3600", start_time=min_timestamp - 1
+        )[symbol]
 
-        if response['futuresAggregateStats']:
-            return self._format_24h_volume(symbol, response['futuresAggregateStats'])
+        if data:
+            return self._format_24h_volume(symbol, data[::-1])
         else:
             print(f"Kwenta {symbol} Error")
             return None
@@ -233,7 +223,7 @@ class KwentaMarketFetcher:
             'convert': 'USD'
         }
 
-        response = requests.get(url, headers=headers, params=parameters)
+        response = self.http.get(url, headers=headers, params=parameters)
 
         if response.status_code == 200:
             price_data = response.json()
@@ -243,21 +233,22 @@ class KwentaMarketFetcher:
             raise Exception(f"Failed to fetch price for {symbol}. Status code: {response.status_code}")
     
     def _fetch_funding_rate_history_by_month(self, symbol, year, month):
-        dirname = os.path.dirname(__file__)
-        folder_path = os.path.join(dirname, f"../data/kwenta/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
-
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
+        return self._fetch_funding_rate_history_by_month_many([symbol], year, month)[symbol]
 
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
-
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
+    # Month of many markets as {symbol: records}, the markets without a usable cached month are fetched together
+    def _fetch_funding_rate_history_by_month_many(self, symbols, year, month):
+        dirname = os.path.dirname(__file__)
+        folder_paths = {symbol: os.path.join(dirname, f"../data/kwenta/{symbol}") for symbol in symbols}
+
+        result = {}
+        fetch_symbols = []
+        for symbol, folder_path in folder_paths.items():
+            if self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+                fetch_symbols.append(symbol)
+            else:
+                result[symbol] = load_month(folder_path, symbol, year, month)
+        if not fetch_symbols:
+            return result
 
         now = datetime.now().timestamp()
         start_time = datetime(year, month, 1).timestamp()
@@ -267,69 +258,24 @@ class KwentaMarketFetcher:
         end_time = (datetime(year, month, 1) + timedelta(days=num_days_in_month)).timestamp()
         end_time = min(end_time, now)
 
-        data = self._fetch_funding_rate_history(symbol, start_time, end_time)
+        fetched = self._fetch_funding_rate_history_many(fetch_symbols, start_time, end_time)
 
-        if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+        for symbol in fetch_symbols:
+            folder_path = folder_paths[symbol]
+            data = fetched[symbol]
+            if data:
+                save_month(folder_path, symbol, year, month, data)
+                result[symbol] = data
+            else:
+                # Keep the cached month when a refresh returns nothing
+                result[symbol] = load_month(folder_path, symbol, year, month) or data
+        return result
 
-        return data
-        
-    def _fetch_funding_rate_history(
-        self, symbol, start_time=0, end_time = int(datetime.now().timestamp()), limit=1000
-    ):
-        url = 'https://api.thegraph.com/subgraphs/name/kwenta/optimism-perps'
-        query = """
-            query (
-                $last_id: ID!
-                $market_key: Bytes!
-                $min_timestamp: BigInt = 0
-                $max_timestamp: BigInt!
-                $limit: Int = 1000                      
-            ) {
-                fundingRatePeriods(
-                    where: {
-                        id_gt: $last_id
-                        marketKey: $market_key
-                        timestamp_gt: $min_timestamp
-                        timestamp_lt: $max_timestamp
-                        period: Hourly
-                    }
-                    first: $limit
-                    orderBy: timestamp
-                    orderDirection: asc
-                ) {
-                    id
-                    period
-                    asset
-                    marketKey
-                    fundingRate
-                    timestamp
-                }
-            }
-        """
-
-        market_key = None if self.markets[symbol] is None else self.markets[symbol]['key']
-
-        transport = AIOHTTPTransport(url=url)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-        query = gql(query)
-        variables = {
-            "last_id": "",
-            "market_key": market_key.hex(),
-            "min_timestamp": int(start_time),
-            "max_timestamp": int(end_time),
-            "limit": int(limit)
-        }
-
-        response = asyncio.run(self._gql_fetch(client, query, variables))
+    def _fetch_funding_rate_history_many(self, symbols, start_time=0, end_time=None):
+        if len(self.markets_base) == 0:
+            self._init_markets()
 
-        if response['fundingRatePeriods']:
-            return response['fundingRatePeriods']
-        else:
-            print(f"Kwenta {symbol} Error")
-            return None
-        
-    async def _gql_fetch(self, client, query, variables={}):
-        response = await client.execute_async(query, variable_values=variables)
-        return response
\ No newline at end of file
+        market_keys = {symbol: self.markets[symbol]['key'].hex() for symbol in symbols}
+        return self.subgraph.fetch_by_market(
+            'fundingRatePeriods', FUNDING_RATE_FIELDS, market_keys, where="period: Hourly", start_time=start_time, end_time=end_time
+        )
@@ -0,0 +1,108 @@
+import os
+import json
+from datetime import datetime, timedelta
+import pandas as pd
+from .raw_cache import list_months, load_month, save_month, load_months_frame, get_month_mtime
+
+# Helpers for fetchers that store raw funding history as month files of the raw cache (see raw_cache.py).
+# The high-water mark (time of the newest stored record, in epoch seconds) is kept in sync.json next to the
+# month files, so a sync only requests the records published after it and appends them to the month files.
+
+def load_high_water_mark(folder_path):
+    file_path = os.path.join(folder_path, "sync.json")
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, "r") as f:
+        return json.load(f)["last_time"]
+
+def save_high_water_mark(folder_path, last_time):
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+    with open(os.path.join(folder_path, "sync.json"), "w") as f:
+        json.dump({"last_time": last_time}, f)
+
+# Newest record of the newest month file, for month files written without updating sync.json
+def find_high_water_mark(folder_path, symbol, time_of):
+    for year, month in reversed(list_months(folder_path, symbol)):
+        records = get_records(load_month(folder_path, symbol, year, month))
+        if records:
+            return max(time_of(item) for item in records)
+    return None
+
+# Add records to the month files they belong to (local time, same as the month windows used for fetching)
+def append_month_records(folder_path, symbol, records, time_of):
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+
+    months = {}
+    for item in records:
+        record_time = datetime.fromtimestamp(time_of(item))
+        months.setdefault((record_time.year, record_time.month), []).append(item)
+
+    for (year, month), items in months.items():
+        data = load_month(folder_path, symbol, year, month)
+        # Records already stored (e.g. written by a full refresh after the last sync) are not appended again
+        stored_times = set(time_of(item) for item in get_records(data))
+        items = [item for item in items if time_of(item) not in stored_times]
+        if not items:
+            continue
+        if isinstance(data, pd.DataFrame):
+            data = pd.concat([data, pd.DataFrame(items)], ignore_index=True)
+        else:
+            data = (data or []) + items
+        save_month(folder_path, symbol, year, month, data)
+
+# Records of a month payload as dicts, month files hold lists of records or frames (Drift)
+def get_records(data):
+    if data is None:
+        return []
+    if isinstance(data, pd.DataFrame):
+        return data.to_dict("records")
+    return data
+
+# Fetch and store the records newer than the high-water mark.
+# fetch_since(since) returns the raw records published after `since` (epoch seconds), time_of(record) returns
+# the record time in epoch seconds. Returns the new records, or None if nothing is stored yet (full backfill needed).
+def sync_month_history(folder_path, symbol, fetch_since, time_of):
+    # A full refresh writes month files without moving the mark, the newest stored record may be newer than it
+    marks = [mark for mark in (load_high_water_mark(folder_path), find_high_water_mark(folder_path, symbol, time_of)) if mark is not None]
+    if not marks:
+        return None
+    since = max(marks)
+
+    data = [item for item in (fetch_since(since) or []) if time_of(item) > since]
+    if data:
+        append_month_records(folder_path, symbol, data, time_of)
+        since = max(time_of(item) for item in data)
+    save_high_water_mark(folder_path, since)
+
+    return data
+
+# Walk back month by month from the current month until a month without data, like the fetchers' full backfill.
+# fetch_month(year, month) returns the raw records of a month and caches them, it is only called for the months the
+# fetch policy wants to fetch. The other cached months are not loaded one by one: all months of the walk are read
+# together with one load_months_frame call.
+def load_history_until_start(folder_path, symbol, fetch_month, policy):
+    cached = set(list_months(folder_path, symbol))
+    cur = get_walk_start(folder_path, symbol, policy)
+    months = []
+    while True:
+        key = (cur.year, cur.month)
+        if policy.should_fetch_month(get_month_mtime(folder_path, symbol, cur.year, cur.month), cur.year, cur.month):
+            data = fetch_month(cur.year, cur.month)
+            if not data:
+                break
+        elif key not in cached:
+            break
+        months.append(key)
+        cur = cur - timedelta(days=cur.day)
+    return load_months_frame(folder_path, symbol, months)
+
+# First month of a walk back from the current month. Offline nothing is fetched: early in a month the current one is
+# not cached yet, the walk starts at the newest cached one instead of ending before it started.
+def get_walk_start(folder_path, symbol, policy):
+    cur = datetime.now()
+    cached = list_months(folder_path, symbol)
+    if policy.offline and cached and (cur.year, cur.month) not in cached:
+        cur = min(cur, datetime(*max(cached), 1))
+    return cur
@@ -0,0 +1,127 @@
+import os
+import threading
+from eth_abi import decode
+from eth_utils.abi import collapse_if_tuple
+from web3 import Web3
+from ....session import OfflineError, default_client
+
+# Multicall3 is deployed at the same address on every chain (Optimism included)
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+MULTICALL3_ABI = [
+    {
+        "name": "aggregate3",
+        "type": "function",
+        "stateMutability": "payable",
+        "inputs": [{
+            "name": "calls",
+            "type": "tuple[]",
+            "components": [
+                {"name": "target", "type": "address"},
+                {"name": "allowFailure", "type": "bool"},
+                {"name": "callData", "type": "bytes"},
+            ],
+        }],
+        "outputs": [{
+            "name": "returnData",
+            "type": "tuple[]",
+            "components": [
+                {"name": "success", "type": "bool"},
+                {"name": "returnData", "type": "bytes"},
+            ],
+        }],
+    },
+]
+
+# Contract reads over one Web3 provider. The provider sends its requests on the pooled session of the HTTP client,
+# reads are batched into a single eth_call to Multicall3, and cached() keeps a result for a number of blocks.
+# rpc_calls counts the JSON-RPC requests sent, e.g. to measure the calls of a refresh.
+class OnchainClient:
+    def __init__(self, rpc_url=None, http=None, web3=None, multicall_address=MULTICALL3_ADDRESS):
+        self.rpc_url = rpc_url
+        self.http = http or default_client
+        self.multicall_address = multicall_address
+        self.rpc_calls = 0
+        self.web3 = None
+        self.multicall_contract = None
+        self.contracts = {}
+        self.cache = {}
+        self.lock = threading.Lock()
+        if web3 is not None:
+            self._setup(web3)
+
+    def get_web3(self):
+        with self.lock:
+            if self.web3 is None:
+                rpc_url = self.rpc_url or os.environ["KWENTA_RPC_URL"]
+                provider = Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": self.http.timeout}, session=self.http.session(rpc_url))
+                self._setup(Web3(provider))
+            return self.web3
+
+    def get_contract(self, address, abi):
+        web3 = self.get_web3()
+        address = web3.to_checksum_address(address)
+        with self.lock:
+            if address not in self.contracts:
+                self.contracts[address] = web3.eth.contract(address, abi=abi)
+            return self.contracts[address]
+
+    def get_block_number(self):
+        return self.get_web3().eth.block_number
+
+    # Results of many view calls (contract, function name, args) in one eth_call, None for the calls that reverted
+    # (or returned nothing, e.g. an address without code).
+    # Results are decoded like contract calls: one value for functions with one output, a tuple otherwise.
+    def multicall(self, calls, block_identifier="latest"):
+        web3 = self.get_web3()
+        requests = [(call[0].address, True, call[0].encodeABI(fn_name=call[1], args=list(call[2]) if len(call) > 2 else [])) for call in calls]
+        # One eth_call with every call encoded for aggregate3, the block is pinned by block_identifier
+        transaction = {"to": self.multicall_contract.address, "data": self.multicall_contract.encodeABI(fn_name="aggregate3", args=[requests])}
+        responses = decode(["(bool,bytes)[]"], web3.eth.call(transaction, block_identifier))[0]
+
+        results = []
+        for call, (success, data) in zip(calls, responses):
+            if not success or len(data) == 0:
+                results.append(None)
+                continue
+            outputs = call[0].get_function_by_name(call[1]).abi["outputs"]
+            values = [normalize_output(output, value) for output, value in zip(outputs, decode([collapse_if_tuple(output) for output in outputs], data))]
+            results.append(values[0] if len(values) == 1 else tuple(values))
+        return results
+
+    # Value of read(block_number) for key, read again once the cached value is ttl blocks old.
+    # A cached read costs one eth_blockNumber request.
+    def cached(self, key, ttl, read):
+        block_number = self.get_block_number()
+        with self.lock:
+            entry = self.cache.get(key)
+        if entry is not None and block_number - entry[0] < ttl:
+            return entry[1]
+        value = read(block_number)
+        with self.lock:
+            self.cache[key] = (block_number, value)
+        return value
+
+    def _setup(self, web3):
+        web3.middleware_onion.add(self._count_rpc_calls, name="rpc_calls")
+        self.web3 = web3
+        self.multicall_contract = web3.eth.contract(web3.to_checksum_address(self.multicall_address), abi=MULTICALL3_ABI)
+
+    def _count_rpc_calls(self, make_request, web3):
+        def middleware(method, params):
+            if self.http.offline:
+                raise OfflineError(f"Offline, not calling {method}")
+            self.rpc_calls += 1
+            return make_request(method, params)
+        return middleware
+
+# Decoded ABI values as contract calls return them: addresses checksummed, structs as tuples
+def normalize_output(output, value):
+    abi_type = output["type"]
+    if abi_type.endswith("]"):
+        item = dict(output, type=abi_type[:abi_type.rindex("[")])
+        return [normalize_output(item, v) for v in value]
+    if abi_type == "tuple":
+        return tuple(normalize_output(component, v) for component, v in zip(output["components"], value))
+    if abi_type == "address":
+        return Web3.to_checksum_address(value)
+    return value
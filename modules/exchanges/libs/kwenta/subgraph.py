@@ -0,0 +1,120 @@
+import asyncio
+import threading
+from gql import gql, Client
+from gql.transport.aiohttp import AIOHTTPTransport
+
+SUBGRAPH_URL = 'https://api.thegraph.com/subgraphs/name/kwenta/optimism-perps'
+PAGE_SIZE = 1000  # largest page the subgraph returns
+BATCH_MARKETS = 10  # markets queried together in one request, one aliased field per market
+MAX_CONCURRENCY = 8  # requests in flight on the connection
+
+# One connection to the Kwenta subgraph shared by every query. The schema is downloaded once when the client
+# connects, and the connection lives on its own event loop thread so fetchers running in other threads (backfill)
+# can use it from synchronous code.
+class SubgraphClient:
+    def __init__(self, url=SUBGRAPH_URL, max_concurrency=MAX_CONCURRENCY):
+        self.client = Client(transport=AIOHTTPTransport(url=url), fetch_schema_from_transport=True)
+        self.max_concurrency = max_concurrency
+        self.loop = None
+        self.session = None
+        self.semaphore = None
+        self.queries = {}
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                asyncio.run_coroutine_threadsafe(self.client.close_async(), self.loop).result()
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.loop = None
+                self.session = None
+
+    def execute(self, query, variables={}):
+        return self._run(self._execute(query, variables))
+
+    # Rows of an entity for many markets ({name: market_key}), returned as {name: rows ordered by timestamp}.
+    # The markets are queried together in batches and paged by timestamp (timestamp_gt the last row of the previous
+    # page, the entities have one row per market and timestamp) until a page is shorter than PAGE_SIZE.
+    # The batches are requested concurrently. where holds the other filters, e.g. "period: Hourly".
+    def fetch_by_market(self, entity, fields, market_keys, where="", start_time=0, end_time=None):
+        return self._run(self._fetch_by_market(entity, fields, market_keys, where, start_time, end_time))
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    def _get_loop(self):
+        with self.lock:
+            if self.session is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True).start()
+                try:
+                    self.session = asyncio.run_coroutine_threadsafe(self._connect(), loop).result()
+                except Exception:
+                    loop.call_soon_threadsafe(loop.stop)
+                    raise
+                self.loop = loop
+            return self.loop
+
+    async def _connect(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await self.client.connect_async()
+
+    async def _execute(self, query, variables):
+        if query not in self.queries:
+            self.queries[query] = gql(query)
+        async with self.semaphore:
+            return await self.session.execute(self.queries[query], variable_values=variables)
+
+    async def _fetch_by_market(self, entity, fields, market_keys, where, start_time, end_time):
+        rows = {name: [] for name in market_keys}
+        cursors = {name: int(start_time) for name in market_keys}
+        pending = list(market_keys)
+        while pending:
+            batches = [pending[i:i + BATCH_MARKETS] for i in range(0, len(pending), BATCH_MARKETS)]
+            pages = await asyncio.gather(*[
+                self._fetch_page(entity, fields, where, {name: (market_keys[name], cursors[name]) for name in batch}, end_time)
+                for batch in batches
+            ])
+            pending = []
+            for page in pages:
+                for name, items in page.items():
+                    rows[name].extend(items)
+                    if len(items) == PAGE_SIZE:
+                        cursors[name] = int(items[-1]['timestamp'])
+                        pending.append(name)
+        return rows
+
+    # One page of every market of a batch ({name: (market_key, min_timestamp)}) in a single request
+    async def _fetch_page(self, entity, fields, where, batch, end_time):
+        declarations = []
+        selections = []
+        variables = {}
+        for i, (market_key, min_timestamp) in enumerate(batch.values()):
+            declarations.append(f"$market_key_{i}: Bytes! $min_timestamp_{i}: BigInt!")
+            conditions = [f"marketKey: $market_key_{i}", f"timestamp_gt: $min_timestamp_{i}"]
+            if end_time is not None:
+                conditions.append("timestamp_lt: $max_timestamp")
+            if where:
+                conditions.append(where)
+            selections.append(f"""
+                market_{i}: {entity}(
+                    where: {{ {' '.join(conditions)} }}
+                    first: {PAGE_SIZE}
+                    orderBy: timestamp
+                    orderDirection: asc
+                ) {{
+                    {' '.join(fields)}
+                }}
+            """)
+            variables[f"market_key_{i}"] = market_key
+            variables[f"min_timestamp_{i}"] = int(min_timestamp)
+        if end_time is not None:
+            declarations.append("$max_timestamp: BigInt!")
+            variables["max_timestamp"] = int(end_time)
+
+        query = f"query ({' '.join(declarations)}) {{ {''.join(selections)} }}"
+        response = await self._execute(query, variables)
+        return {name: response[f"market_{i}"] for i, name in enumerate(batch)}
+
+# Client used by Kwenta fetchers created without an explicit one
+default_subgraph = SubgraphClient()
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# Requests in flight per paged walk, the venue rate limits of the HTTP client apply on top
+PAGE_CONCURRENCY = 4
+
+# Every record of a page-indexed endpoint (pages 1 to total), in page order.
+# fetch_page(page_index) returns (records, total_pages), or None when the request failed. Page 1 is requested
+# alone for the total, the other pages concurrently with at most max_workers requests in flight.
+# stop(records) ends the walk at the first page it returns True for (that page included), e.g. once a page reaches
+# the cached history: the pages are then requested max_workers at a time so a refresh stops after a few requests.
+# A failed or empty page ends the walk too, the result is always a run of consecutive pages from page 1.
+def fetch_all_pages(fetch_page, max_workers=PAGE_CONCURRENCY, stop=None):
+    first = fetch_page(1)
+    if not first or not first[0]:
+        return []
+    records, total_pages = first
+    pages = [records]
+    if stop is not None and stop(records):
+        return records
+
+    remaining = list(range(2, total_pages + 1))
+    step = max_workers if stop is not None else max(1, len(remaining))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(remaining), step):
+            for result in executor.map(fetch_page, remaining[start:start + step]):
+                if not result or not result[0]:
+                    return join_pages(pages)
+                pages.append(result[0])
+                if stop is not None and stop(result[0]):
+                    return join_pages(pages)
+    return join_pages(pages)
+
+def join_pages(pages):
+    return [record for page in pages for record in page]
+
+# Every record of a cursor-paged endpoint (each page is requested with a cursor taken from the previous one, e.g. the
+# time of its last record), in page order. Cursor pages can't be requested concurrently, they are walked one by one.
+# fetch_page(cursor) returns the records of a page, None or empty when the request failed or nothing is left.
+# next_cursor(records) returns the cursor of the following page, None to end the walk (e.g. once a page reaches the
+# cached history). A page shorter than limit is the last one, and a cursor that does not move ends the walk too.
+def fetch_cursor_pages(fetch_page, cursor, next_cursor, limit=None):
+    pages = []
+    while True:
+        records = fetch_page(cursor)
+        if not records:
+            break
+        pages.append(records)
+        if limit is not None and len(records) < limit:
+            break
+        next_value = next_cursor(records)
+        if next_value is None or next_value == cursor:
+            break
+        cursor = next_value
+    return join_pages(pages)
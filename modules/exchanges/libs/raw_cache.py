@@ -0,0 +1,159 @@
+import os
+import re
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Raw API payloads cached per month as Parquet files ({symbol}_{year}_{month}.parquet), one typed column per field.
+# Payloads are lists of records (dicts), lists of rows (lists), dicts of columns or frames. The shape is kept in the
+# file metadata so load_month returns the payload the way the fetcher received it. Fields with mixed value types
+# are stored as JSON strings, other dicts as one JSON document. Fields missing from some records come back as None. Month files of the old JSON cache are converted the first time they are read.
+
+SHAPE_KEY = b"raw_cache.shape"
+JSON_COLUMNS_KEY = b"raw_cache.json_columns"
+
+MONTH_FILE_PATTERN = re.compile(r"^(?P<symbol>.+)_(?P<year>\d{4})_(?P<month>\d{1,2})\.(?P<ext>json|parquet)$")
+
+def get_month_path(folder_path, symbol, year, month, ext="parquet"):
+    return os.path.join(folder_path, f"{symbol}_{year}_{month}.{ext}")
+
+def has_month(folder_path, symbol, year, month):
+    return os.path.exists(get_month_path(folder_path, symbol, year, month)) or os.path.exists(get_month_path(folder_path, symbol, year, month, "json"))
+
+# Modification time of a cached month, None if it is not cached
+def get_month_mtime(folder_path, symbol, year, month):
+    for ext in ("parquet", "json"):
+        file_path = get_month_path(folder_path, symbol, year, month, ext)
+        if os.path.exists(file_path):
+            return os.path.getmtime(file_path)
+    return None
+
+# (year, month) of every cached month of a symbol, oldest first
+def list_months(folder_path, symbol):
+    months = set()
+    if os.path.exists(folder_path):
+        for file_name in os.listdir(folder_path):
+            match = MONTH_FILE_PATTERN.match(file_name)
+            if match and match.group("symbol") == symbol:
+                months.add((int(match.group("year")), int(match.group("month"))))
+    return sorted(months)
+
+def load_month(folder_path, symbol, year, month):
+    file_path = get_month_path(folder_path, symbol, year, month)
+    if os.path.exists(file_path):
+        return from_table(pq.read_table(file_path))
+
+    json_path = get_month_path(folder_path, symbol, year, month, "json")
+    if os.path.exists(json_path):
+        with open(json_path, "r") as f:
+            data = json.load(f)
+        if data:
+            save_month(folder_path, symbol, year, month, data)
+            os.remove(json_path)
+        return data
+
+    return None
+
+def save_month(folder_path, symbol, year, month, data):
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+    file_path = get_month_path(folder_path, symbol, year, month)
+    # Write next to the target and rename, readers never see a partial month file
+    pq.write_table(to_table(data), file_path + ".tmp")
+    os.replace(file_path + ".tmp", file_path)
+
+# All cached months of a symbol as one frame (months in the old JSON cache are converted first).
+# The month files are read as Arrow tables and joined without building Python objects per record.
+# Columns are named after the record fields, or "0", "1", ... for payloads of rows.
+def load_months_frame(folder_path, symbol, months=None):
+    months = list_months(folder_path, symbol) if months is None else months
+    tables = []
+    for year, month in months:
+        if not os.path.exists(get_month_path(folder_path, symbol, year, month)):
+            load_month(folder_path, symbol, year, month)
+        file_path = get_month_path(folder_path, symbol, year, month)
+        if os.path.exists(file_path):
+            tables.append(pq.read_table(file_path))
+    if not tables:
+        return pd.DataFrame()
+
+    # Fields stored as JSON strings (mixed value types) or typed differently across months are rebuilt per month
+    if not any(get_json_columns(table) for table in tables):
+        try:
+            return pa.concat_tables([table.replace_schema_metadata(None) for table in tables], promote_options="permissive").to_pandas()
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    return pd.concat([pd.DataFrame(from_table(table)) for table in tables], ignore_index=True)
+
+# Convert every month file of the old JSON cache under root_path (e.g. modules/data) to Parquet.
+# Returns the number of converted files, empty and unreadable files are left as they are.
+def migrate_json_tree(root_path):
+    count = 0
+    for dirpath, _, file_names in os.walk(root_path):
+        for file_name in file_names:
+            match = MONTH_FILE_PATTERN.match(file_name)
+            if not match or match.group("ext") != "json":
+                continue
+            symbol, year, month = match.group("symbol"), int(match.group("year")), int(match.group("month"))
+            try:
+                load_month(dirpath, symbol, year, month)
+            except (ValueError, OSError, pa.ArrowException) as e:
+                print(f"{os.path.join(dirpath, file_name)} Error: {e}")
+                continue
+            if not os.path.exists(get_month_path(dirpath, symbol, year, month, "json")):
+                count += 1
+    return count
+
+def to_table(data):
+    if isinstance(data, pd.DataFrame):
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        return table.replace_schema_metadata({SHAPE_KEY: b"frame", JSON_COLUMNS_KEY: b"[]"})
+    if isinstance(data, dict):
+        lengths = set(len(values) if isinstance(values, list) else None for values in data.values())
+        if len(lengths) != 1 or None in lengths:
+            # Not a table (scalar fields or columns of different lengths), keep the payload as one JSON document
+            table = pa.table({"payload": [json.dumps(data)]})
+            return table.replace_schema_metadata({SHAPE_KEY: b"json", JSON_COLUMNS_KEY: b"[]"})
+        shape, columns = "columns", data
+    elif len(data) > 0 and isinstance(data[0], (list, tuple)):
+        width = max(len(row) for row in data)
+        shape, columns = "rows", {str(i): [row[i] if i < len(row) else None for row in data] for i in range(width)}
+    else:
+        keys = list(dict.fromkeys(key for item in data for key in item))
+        shape, columns = "records", {key: [item.get(key) for item in data] for key in keys}
+
+    arrays = {}
+    json_columns = []
+    for name, values in columns.items():
+        try:
+            arrays[name] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays[name] = pa.array([None if value is None else json.dumps(value) for value in values], type=pa.string())
+            json_columns.append(name)
+
+    table = pa.table(arrays)
+    return table.replace_schema_metadata({SHAPE_KEY: shape.encode(), JSON_COLUMNS_KEY: json.dumps(json_columns).encode()})
+
+def from_table(table):
+    metadata = table.schema.metadata or {}
+    shape = metadata.get(SHAPE_KEY, b"records").decode()
+    if shape == "frame":
+        return table.replace_schema_metadata(None).to_pandas()
+    if shape == "json":
+        return json.loads(table.column("payload")[0].as_py())
+
+    columns = table.to_pydict()
+    for name in get_json_columns(table):
+        columns[name] = [None if value is None else json.loads(value) for value in columns[name]]
+
+    if shape == "columns":
+        return columns
+    if shape == "rows":
+        return [list(row) for row in zip(*columns.values())]
+    names = list(columns.keys())
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+def get_json_columns(table):
+    metadata = table.schema.metadata or {}
+    return json.loads(metadata.get(JSON_COLUMNS_KEY, b"[]").decode())
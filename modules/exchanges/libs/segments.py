@@ -0,0 +1,95 @@
+import os
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Append-only store of raw records keyed by epoch seconds. Every sync writes its new records as one segment file
+# named after the epoch range of its records ({first}_{last}.parquet, records oldest first, times in an "epoch"
+# column), so a refresh costs the size of the new records instead of a rewrite of the whole history, and the newest
+# stored time is read from the file names. Segments are compacted in tiers of their size (tier t holds the segments
+# of 16^t to 16^(t+1) - 1 records): once a tier has more than MAX_TIER_SEGMENTS segments they are merged into one,
+# which lands in a higher tier, and segments of SEGMENT_RECORDS records or more are never merged. A merge output is
+# therefore only merged again with segments of its own size, which keeps the number of files small while every
+# record is rewritten at most once per tier. The merged segment is written before the merged ones are removed and
+# loads drop duplicated epochs, so an interrupted compaction loses nothing.
+
+SEGMENT_FILE_PATTERN = re.compile(r"^(?P<start>\d+)_(?P<end>\d+)\.parquet$")
+SEGMENT_RECORDS = 10000
+MAX_TIER_SEGMENTS = 16
+TIER_FACTOR = 16
+
+def get_segment_path(folder_path, start, end):
+    return os.path.join(folder_path, f"{start}_{end}.parquet")
+
+# (start, end, path) of every segment, oldest first
+def list_segments(folder_path):
+    segments = []
+    if os.path.exists(folder_path):
+        for file_name in os.listdir(folder_path):
+            match = SEGMENT_FILE_PATTERN.match(file_name)
+            if match:
+                segments.append((int(match.group("start")), int(match.group("end")), os.path.join(folder_path, file_name)))
+    return sorted(segments)
+
+# Epoch of the newest stored record, None if nothing is stored
+def get_last_time(folder_path):
+    segments = list_segments(folder_path)
+    return max(end for _, end, _ in segments) if segments else None
+
+# Every stored record as one frame, oldest first
+def load_segments(folder_path):
+    segments = list_segments(folder_path)
+    if not segments:
+        return pd.DataFrame()
+    table = pa.concat_tables([pq.read_table(path) for _, _, path in segments], promote_options="permissive")
+    df = table.to_pandas()
+    if not df["epoch"].is_monotonic_increasing:
+        df = df.sort_values(by="epoch", kind="stable")
+    return df.drop_duplicates(subset="epoch", keep="last").reset_index(drop=True)
+
+# Store records (a frame of raw fields) with their epochs as a new segment, then compact the small segments
+def append_segment(folder_path, records, epochs):
+    if len(records) == 0:
+        return
+    df = records.reset_index(drop=True).assign(epoch=pd.Series(epochs).to_numpy(dtype="int64"))
+    df = df.sort_values(by="epoch", kind="stable")
+    write_segment(folder_path, df)
+    compact_segments(folder_path)
+
+def write_segment(folder_path, df):
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+    file_path = get_segment_path(folder_path, int(df["epoch"].iloc[0]), int(df["epoch"].iloc[-1]))
+    # Write next to the target and rename, readers never see a partial segment
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), file_path + ".tmp")
+    os.replace(file_path + ".tmp", file_path)
+
+def compact_segments(folder_path):
+    while True:
+        tiers = {}
+        for segment in list_segments(folder_path):
+            num_rows = pq.read_metadata(segment[2]).num_rows
+            if num_rows < SEGMENT_RECORDS:
+                tiers.setdefault(get_tier(num_rows), []).append(segment)
+        full = [segments for _, segments in sorted(tiers.items()) if len(segments) > MAX_TIER_SEGMENTS]
+        if not full:
+            return
+        merge_segments(folder_path, full[0])
+
+# Tier of a segment of num_rows records, segments of one tier differ in size by less than TIER_FACTOR
+def get_tier(num_rows):
+    tier = 0
+    while num_rows >= TIER_FACTOR:
+        num_rows //= TIER_FACTOR
+        tier += 1
+    return tier
+
+def merge_segments(folder_path, segments):
+    table = pa.concat_tables([pq.read_table(path) for _, _, path in segments], promote_options="permissive")
+    df = table.to_pandas().sort_values(by="epoch", kind="stable").drop_duplicates(subset="epoch", keep="last")
+    write_segment(folder_path, df)
+    merged_path = get_segment_path(folder_path, int(df["epoch"].iloc[0]), int(df["epoch"].iloc[-1]))
+    for _, _, path in segments:
+        if path != merged_path:
+            os.remove(path)
@@ -0,0 +1,17 @@
+import pandas as pd
+
+# Time columns of the formatted frames from the time field of a venue, converted in one vectorized step:
+# datetime as naive UTC datetime64[ns] and timestamp as int64 epoch seconds.
+# unit is "s" or "ms" for epochs and None for date strings (ISO 8601, with or without a time zone).
+def add_time_columns(df, column, unit=None):
+    df["datetime"] = to_datetime(df[column], unit)
+    df["timestamp"] = to_epoch(df["datetime"])
+    return df
+
+def to_datetime(values, unit=None):
+    if unit is not None:
+        values = pd.to_numeric(values)
+    return pd.to_datetime(values, unit=unit, utc=True).dt.tz_convert(None).astype("datetime64[ns]")
+
+def to_epoch(datetimes):
+    return datetimes.astype("datetime64[ns]").astype("int64") // 10**9
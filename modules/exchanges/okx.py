@@ -1,15 +1,24 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
-import json
 import calendar
+from .libs.history import sync_month_history, load_history_until_start
+from .libs.paging import fetch_cursor_pages
+from .libs.raw_cache import get_month_mtime, load_month, save_month
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 class OKXFetcher:
 
     funding_interval = 8
     markets_base = {}
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -30,28 +39,25 @@ class OKXFetcher:
             "volume": float(raw[0]['vol24h']) if raw else 0,
         }
     
+    # Current funding of a market: the rate paid at the next funding time (epoch seconds) and the mark price
+    def fetch_funding_snapshot(self, market):
+        funding = self._fetch_current_funding_rate(market)
+        mark = self._fetch_mark_price(market)
+        if not funding or not mark:
+            return None
+        return {
+            "exchange": "okx",
+            "market": market,
+            "timestamp": int(mark[0]["ts"]) / 1000,
+            "funding_time": int(funding[0]["fundingTime"]) / 1000,
+            "funding_rate": float(funding[0]["fundingRate"]),
+            "mark_price": float(mark[0]["markPx"]),
+        }
+
     def fetch_annualized_average_funding_rate(self, market):
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            '1h': 1,
-            '24h': 24,
-            '3d': 72,
-            '7d': 168,
-            '30d': 720,
-            '90d': 2160,
-            '120d': 2880,
-            '1y': 8760,
-            'all_time': len(df)
-        }
-
-        annualized_average_funding_rate = {}
-        
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "okx",
@@ -59,29 +65,40 @@ class OKXFetcher:
             "annualized_average_funding_rate": annualized_average_funding_rate
         }
     
+    # Walk back from the current month until the first month without funding; cached months are read in one pass
     def fetch_funding_rate_history_until_start(self, symbol):
-        result = []
-        cur = datetime.now()
-        while True:
-            data = self._fetch_funding_rate_history_by_month(symbol, cur.year, cur.month)
-            if not data:
-                break
-            result.extend(data)
-            cur = cur - timedelta(days=calendar.monthrange(cur.year, cur.month)[1])
-        return self._format_funding_rate_history(result)
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/okx/{symbol}")
+
+        data = load_history_until_start(folder_path, symbol, lambda year, month: self._fetch_funding_rate_history_by_month(symbol, year, month), self.policy)
+        return self._format_funding_rate_history(data)
     
+    # Fetch only the funding records after the last stored one and append them to the month files
+    def sync_funding_rate_history(self, symbol):
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/okx/{symbol}")
+
+        data = sync_month_history(folder_path, symbol, lambda since: self._fetch_funding_rate_history_since(symbol, since), self._get_funding_time)
+        if data is None:
+            return self.fetch_funding_rate_history_until_start(symbol)
+        return self._format_funding_rate_history(data)
+
     # Format functions
     def _format_funding_rate_history(self, data):
         df = pd.DataFrame(data, columns=['fundingTime', 'fundingRate'])
 
         df['funding_time'] = df['fundingTime'].astype(float)
         df['funding_rate'] = df['fundingRate'].astype(float)
+        add_time_columns(df, 'funding_time', 'ms')
 
         df.sort_values(by=['funding_time'], ascending=False, inplace=True)
         
-        return df[['funding_time', 'funding_rate']]
+        return df[['funding_time', 'funding_rate', 'datetime', 'timestamp']]
 
     # Private functions
+    def _get_funding_time(self, item):
+        return int(item["fundingTime"]) / 1000
+
     def _init_markets(self):
         markets = self._fetch_markets()
         for market in markets:
@@ -90,7 +107,7 @@ class OKXFetcher:
     def _fetch_markets(self):
         url = 'https://www.okx.com/api/v5/public/instruments?instType=SWAP'
 
-        response = requests.get(url)
+        response = self.http.get(url)
         if response.status_code == 200:
             return response.json()['data']
         else:
@@ -102,7 +119,7 @@ class OKXFetcher:
         params = {
             "instId": symbol
         }
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
 
         if response.status_code == 200:
             return response.json()["data"]
@@ -110,19 +127,39 @@ class OKXFetcher:
             print(f"Error: {response.status_code}")
             return None
 
+    def _fetch_current_funding_rate(self, symbol):
+        url = "https://www.okx.com/api/v5/public/funding-rate"
+        params = {
+            "instId": symbol
+        }
+        response = self.http.get(url, params=params)
+
+        if response.status_code == 200:
+            return response.json()["data"]
+        else:
+            print(f"OKX {symbol} Error: {response.status_code}")
+            return None
+
+    def _fetch_mark_price(self, symbol):
+        url = "https://www.okx.com/api/v5/public/mark-price"
+        params = {
+            "instType": "SWAP",
+            "instId": symbol
+        }
+        response = self.http.get(url, params=params)
+
+        if response.status_code == 200:
+            return response.json()["data"]
+        else:
+            print(f"OKX {symbol} Error: {response.status_code}")
+            return None
+
     def _fetch_funding_rate_history_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/okx/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
 
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
-
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -138,10 +175,25 @@ class OKXFetcher:
         data = self._fetch_funding_rate_history(symbol, start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
+
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
+
+    # OKX returns the newest records first, so page backwards from now until the high-water mark
+    def _fetch_funding_rate_history_since(self, symbol, since, limit=100):
+        # The page reaching the high-water mark is the last one
+        def next_cursor(data):
+            oldest_time = min(self._get_funding_time(item) for item in data)
+            return oldest_time if oldest_time > since else None
 
-        return data
+        return fetch_cursor_pages(
+            lambda after: self._fetch_funding_rate_history(symbol, since, after, limit),
+            datetime.now().timestamp(),
+            next_cursor,
+            limit,
+        )
 
     def _fetch_funding_rate_history(self, symbol, before=None, after=None, limit=100):
         url = "https://www.okx.com/api/v5/public/funding-rate-history"
@@ -155,7 +207,7 @@ class OKXFetcher:
         if after is not None:
             params['after'] = int(after) * 1000
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()["data"]
         else:
@@ -1,13 +1,19 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
-import json
 import calendar
+from .libs.raw_cache import get_month_mtime, load_month, save_month
+from ..policy import default_policy
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 class PerpetualFetcher:
     funding_interval = 8
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def fetch_24h_vol(self, market):
         symbol = self.s_symbol(market)
@@ -24,28 +30,10 @@ class PerpetualFetcher:
         data = self._fetch_funding_rate_history_until_start(symbol)
 
         df = pd.DataFrame(data, columns=["fundingTime", "fundingRate"])
-        df.sort_values(by=["fundingTime"], ascending=False, inplace=True)
+        df["funding_time"] = df["fundingTime"]
         df["funding_rate"] = df["fundingRate"].astype(float)
 
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            '1y': 8760,
-            'all_time': len(df)
-        }
-
-        annualized_average_funding_rate = {}
-        
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "apollox",
@@ -69,7 +57,7 @@ class PerpetualFetcher:
         else:
             params = {}
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
 
         if response.status_code == 200:
             return response.json()
@@ -91,16 +79,9 @@ class PerpetualFetcher:
     def _fetch_funding_rate_history_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/apollox/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
 
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
-
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -116,10 +97,11 @@ class PerpetualFetcher:
         data = self._fetch_funding_rate_history(symbol, start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
 
-        return data
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
 
     def _fetch_funding_rate_history(
         self, symbol, start_time=None, end_time=None, limit=100
@@ -134,7 +116,7 @@ class PerpetualFetcher:
         if end_time is not None:
             params["endTime"] = int(end_time * 1000)  # Convert to ms
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()
         else:
@@ -1,9 +1,14 @@
-import requests
 from datetime import datetime, timedelta
 import pandas as pd
 import os
-import json
 import calendar
+from .libs.history import get_walk_start, load_high_water_mark, save_high_water_mark
+from .libs.paging import fetch_cursor_pages
+from .libs.raw_cache import get_month_mtime, list_months, load_month, save_month
+from .libs.timestamps import add_time_columns
+from ..policy import default_policy
+from ..session import default_client
+from ..funding_stats import get_annualized_average_funding_rate
 
 class ZetaFetcher:
     funding_interval = 1
@@ -15,6 +20,10 @@ class ZetaFetcher:
         "ARB": "ARB"
     }
 
+    def __init__(self, http=None, policy=None):
+        self.http = http or default_client
+        self.policy = policy or default_policy
+
     # Public functions
     def list_markets(self):
         if len(self.markets_base) == 0:
@@ -38,25 +47,7 @@ class ZetaFetcher:
     def fetch_annualized_average_funding_rate(self, market):
         df = self.fetch_funding_rate_history_until_start(market)
 
-        timeframes_preset = {
-            "1h": 1,
-            "24h": 24,
-            "3d": 72,
-            "7d": 168,
-            "30d": 720,
-            "90d": 2160,
-            "120d": 2880,
-            '1y': 8760,
-            'all_time': len(df)
-        }
-
-        annualized_average_funding_rate = {}
-        
-        for timeframe, average_window in timeframes_preset.items():
-            average_window = max(1, average_window)
-            daily_rate = df["funding_rate"].head(average_window).mean() * (24 / self.funding_interval)
-            annualized_rate = daily_rate * 365
-            annualized_average_funding_rate[timeframe] = annualized_rate
+        annualized_average_funding_rate = get_annualized_average_funding_rate(df, self.funding_interval)
 
         return {
             "exchange": "zeta",
@@ -67,30 +58,65 @@ class ZetaFetcher:
     def fetch_funding_rate_history_until_start(self, symbol):
         timestamps = []
         funding_rates = []
-        cur = datetime.now()
+        dirname = os.path.dirname(__file__)
+        cur = get_walk_start(os.path.join(dirname, f"../data/zeta/{symbol}"), symbol, self.policy)
         while True:
             data = self._fetch_funding_rate_history_by_month(symbol, cur.year, cur.month)
             if not data or len(data['t']) == 0:
                 break
             timestamps.extend(data['t'])
             funding_rates.extend(data['o'])
-            cur = cur - timedelta(days=calendar.monthrange(cur.year, cur.month)[1])
+            cur = cur - timedelta(days=cur.day)
         data = {
             "timestamp": timestamps,
             "funding_rate": funding_rates
         }
         return self._format_funding_rate_history(data)
     
+    # Fetch only the funding records after the last stored one and append them to the month files.
+    # Zeta month files hold the raw TradingView response ({"t": [...], "o": [...], ...}) instead of a list of records.
+    def sync_funding_rate_history(self, symbol):
+        dirname = os.path.dirname(__file__)
+        folder_path = os.path.join(dirname, f"../data/zeta/{symbol}")
+
+        since = load_high_water_mark(folder_path)
+        if since is None:
+            since = self._find_high_water_mark(folder_path, symbol)
+        if since is None:
+            return self.fetch_funding_rate_history_until_start(symbol)
+
+        data = self._fetch_funding_rate_history_since(symbol, since)
+        timestamps = [t for t in data["t"] if t > since]
+        funding_rates = [o for t, o in zip(data["t"], data["o"]) if t > since]
+
+        months = {}
+        for t, o in zip(timestamps, funding_rates):
+            record_time = datetime.fromtimestamp(t)
+            month_data = months.setdefault((record_time.year, record_time.month), {"t": [], "o": []})
+            month_data["t"].append(t)
+            month_data["o"].append(o)
+
+        for (year, month), month_data in months.items():
+            stored = load_month(folder_path, symbol, year, month) or {"t": [], "o": []}
+            stored["t"] = stored.get("t", []) + month_data["t"]
+            stored["o"] = stored.get("o", []) + month_data["o"]
+            save_month(folder_path, symbol, year, month, stored)
+
+        save_high_water_mark(folder_path, max(timestamps) if timestamps else since)
+
+        return self._format_funding_rate_history({"timestamp": timestamps, "funding_rate": funding_rates})
+
     # Format functions
     def _format_funding_rate_history(self, data):
         df = pd.DataFrame(data)
 
         df["funding_time"] = df["timestamp"]
         df["funding_rate"] = df["funding_rate"].astype(float) / 10000
+        add_time_columns(df, "funding_time", "s")
 
         df.sort_values(by=['funding_time'], ascending=False, inplace=True)
         
-        return df[['funding_time', 'funding_rate']]
+        return df[['funding_time', 'funding_rate', 'datetime', 'timestamp']]
 
     # Private functions
     def _init_markets(self):
@@ -102,16 +128,9 @@ class ZetaFetcher:
     def _fetch_funding_rate_history_by_month(self, symbol, year, month):
         dirname = os.path.dirname(__file__)
         folder_path = os.path.join(dirname, f"../data/zeta/{symbol}")
-        file_path = os.path.join(dirname, f"{folder_path}/{symbol}_{year}_{month}.json")
 
-        now = datetime.now()
-        file_existed = os.path.exists(file_path)
-        is_same_month = now.year == year and now.month == month
-
-        if file_existed and not is_same_month:
-            with open(file_path, "r") as f:
-                data = json.load(f)
-            return data
+        if not self.policy.should_fetch_month(get_month_mtime(folder_path, symbol, year, month), year, month):
+            return load_month(folder_path, symbol, year, month)
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -127,10 +146,28 @@ class ZetaFetcher:
         data = self._fetch_funding_rate_history(symbol, start_time, end_time)
 
         if data:
-            with open(file_path, "w") as f:
-                json.dump(data, f)
+            save_month(folder_path, symbol, year, month, data)
+            return data
+
+        # Keep the cached month when a refresh returns nothing
+        return load_month(folder_path, symbol, year, month) or data
+
+    def _find_high_water_mark(self, folder_path, symbol):
+        for year, month in reversed(list_months(folder_path, symbol)):
+            data = load_month(folder_path, symbol, year, month)
+            if data and len(data.get("t", [])) > 0:
+                return max(data["t"])
+        return None
+
+    # The TradingView endpoint returns the last `countback` bars before `to`, so page backwards from now
+    def _fetch_funding_rate_history_since(self, symbol, since, limit=1000):
+        # Pages of (t, o) bars, the response holds one list per field
+        def fetch_page(end_time):
+            data = self._fetch_funding_rate_history(symbol, since + 1, end_time, limit)
+            return list(zip(data.get("t", []), data.get("o", []))) if data else None
 
-        return data
+        bars = fetch_cursor_pages(fetch_page, datetime.now().timestamp(), lambda page: min(t for t, _ in page) - 1, limit)
+        return {"t": [t for t, _ in bars], "o": [o for _, o in bars]}
 
     def _fetch_funding_rate_history(
         self, symbol, start_time=None, end_time=None, limit=1000
@@ -146,7 +183,7 @@ class ZetaFetcher:
         if end_time is not None:
             params["to"] = int(end_time)  # Convert to ms
 
-        response = requests.get(url, params=params)
+        response = self.http.get(url, params=params)
         if response.status_code == 200:
             return response.json()
         else:
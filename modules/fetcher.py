@@ -1,31 +1,96 @@
-from .exchanges.binance import BinanceFetcher
-from .exchanges.gate import GateIOFetcher
-from .exchanges.okx import OKXFetcher
-from .exchanges.huobi import HuobiFetcher
-from .exchanges.bitmex import BitmexFetcher
-from .exchanges.drift import DriftMarketFetcher
-from .exchanges.dydx import DYDXFetcher
-from .exchanges.kwenta import KwentaMarketFetcher
-from .exchanges.apollox import ApolloxFetcher
-from .exchanges.zeta import ZetaFetcher
-from .exchanges.hyperliquid import HyperLiquidFetcher
+import asyncio
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from importlib import import_module
+from importlib.metadata import entry_points
+import pandas as pd
+from .session import HTTPClient, POOL_SIZE
+from .policy import FetchPolicy
+from .funding_stats import get_annualized_average_funding_rates
+from .schema import to_funding_records, to_price_records
+
+# Exchange fetchers as "module:Class". A module is only imported when its exchange is first used, so importing
+# the Fetcher (and common.py) does not load web3/gql for Kwenta or any other exchange code.
+EXCHANGES = {
+    'binance': '.exchanges.binance:BinanceFetcher',
+    'gate': '.exchanges.gate:GateIOFetcher',
+    'okx': '.exchanges.okx:OKXFetcher',
+    'huobi': '.exchanges.huobi:HuobiFetcher',
+    'bitmex': '.exchanges.bitmex:BitmexFetcher',
+    'drift': '.exchanges.drift:DriftMarketFetcher',
+    'dydx': '.exchanges.dydx:DYDXFetcher',
+    'kwenta': '.exchanges.kwenta:KwentaMarketFetcher',
+    'apollox': '.exchanges.apollox:ApolloxFetcher',
+    'zeta': '.exchanges.zeta:ZetaFetcher',
+    'hyperliquid': '.exchanges.hyperliquid:HyperLiquidFetcher',
+    # add more exchanges here
+}
+
+# Exchanges of other packages, registered as entry points of this group, e.g. in their pyproject.toml:
+# [tool.poetry.plugins."funding_backtest.exchanges"]
+# myvenue = "my_package.myvenue:MyVenueFetcher"
+ENTRY_POINT_GROUP = 'funding_backtest.exchanges'
+
+# Concurrent requests per venue during a backfill
+BACKFILL_CONCURRENCY = 4
+VENUE_CONCURRENCY = {
+    'drift': 2,  # every month download already fetches its days on the shared day pool
+}
+
+# Venues whose month fetchers return a list of raw records, their months are requested concurrently
+MONTHLY_FUNDING_VENUES = ['binance', 'apollox', 'bitmex', 'drift', 'gate', 'okx', 'hyperliquid', 'kwenta']
+MONTHLY_OHLC_VENUES = ['binance', 'apollox', 'bitmex', 'drift']
+
+# Add an exchange at runtime, target is a fetcher class or a "module:Class" string
+def register_exchange(name, target):
+    EXCHANGES[name] = target
+
+# Registered exchanges plus the ones of installed packages (entry points)
+def get_exchange_targets():
+    targets = dict(EXCHANGES)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        targets.setdefault(entry_point.name, entry_point.value)
+    return targets
+
+def load_exchange_class(target):
+    if not isinstance(target, str):
+        return target
+    module_name, class_name = target.split(':')
+    return getattr(import_module(module_name, package=__package__), class_name)
+
+# Exchange name -> fetcher instance. Every fetcher is imported and created on first access.
+class ExchangeRegistry(Mapping):
+    def __init__(self, targets, *args):
+        self.targets = targets
+        self.args = args
+        self.instances = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.instances:
+                self.instances[name] = load_exchange_class(self.targets[name])(*self.args)
+            return self.instances[name]
+
+    def __iter__(self):
+        return iter(self.targets)
+
+    def __len__(self):
+        return len(self.targets)
 
 class Fetcher:
-    def __init__(self):
-        self.exchanges = {
-            'binance': BinanceFetcher(),
-            'gate': GateIOFetcher(),
-            'okx': OKXFetcher(),
-            'huobi': HuobiFetcher(),
-            'bitmex': BitmexFetcher(),
-            'drift': DriftMarketFetcher(),
-            'dydx': DYDXFetcher(),
-            'kwenta': KwentaMarketFetcher(),
-            'apollox': ApolloxFetcher(),
-            'zeta': ZetaFetcher(),
-            'hyperliquid': HyperLiquidFetcher(),
-            # add more exchanges here
-        }
+    # policy is a FetchPolicy deciding when the cached data is used and when the exchange APIs are called,
+    # e.g. Fetcher(FetchPolicy(OFFLINE)) for analysis without network access
+    def __init__(self, policy=None):
+        self.policy = policy or FetchPolicy()
+        # One pooled HTTP client for all exchanges, connections are kept alive between requests
+        self.http = HTTPClient(offline=self.policy.offline)
+        self.exchanges = ExchangeRegistry(get_exchange_targets(), self.http, self.policy)
+
+    def close(self):
+        self.http.close()
 
     def list_markets(self, exchange):
         return self.exchanges[exchange].list_markets()
@@ -36,11 +101,117 @@ class Fetcher:
     def fetch_24h_vol(self, exchange, market):
         return self.exchanges[exchange].fetch_24h_vol(market)
     
+    # Current funding rate, next funding time and mark price (venues with a fetch_funding_snapshot, see monitor.py)
+    def fetch_funding_snapshot(self, exchange, market):
+        return self.exchanges[exchange].fetch_funding_snapshot(market)
+
     def fetch_annualized_average_funding_rate(self, exchange, market):
         return self.exchanges[exchange].fetch_annualized_average_funding_rate(market)
     
+    # Annualized average funding rates of many (exchange, market) pairs, one row per pair and one column per timeframe.
+    # The histories are loaded concurrently (only from the cache with FetchPolicy(OFFLINE)) and the windows of all
+    # pairs are computed together, see funding_stats.py.
+    def fetch_annualized_average_funding_rates(self, pairs):
+        with ThreadPoolExecutor(max_workers=POOL_SIZE) as executor:
+            histories = list(executor.map(lambda pair: self.fetch_funding_records(*pair), pairs))
+        funding_intervals = {pair: self.exchanges[pair[0]].funding_interval for pair in pairs}
+        return get_annualized_average_funding_rates(dict(zip(pairs, histories)), funding_intervals)
+
     def fetch_funding_rate_history_until_start(self, exchange, market):
         return self.exchanges[exchange].fetch_funding_rate_history_until_start(market)
+
+    # Funding history and hourly ohlc as canonical records (see schema.py), None when the fetcher returns nothing
+    def fetch_funding_records(self, exchange, market):
+        df = self.fetch_funding_rate_history_until_start(exchange, market)
+        if df is None:
+            return None
+        return to_funding_records(df, exchange, market, self.exchanges[exchange].funding_interval)
+
+    def fetch_price_records(self, exchange, market, start_time, end_time):
+        df = self.fetch_ohlc(exchange, market, start_time, end_time)
+        if df is None:
+            return None
+        return to_price_records(df, exchange, market)
+
+    def sync_funding_rate_history(self, exchange, market):
+        return self.exchanges[exchange].sync_funding_rate_history(market)
     
     def fetch_ohlc(self, exchange, market, start_time, end_time):
-        return self.exchanges[exchange].fetch_hourly_ohlc(market, start_time, end_time)
\ No newline at end of file
+        return self.exchanges[exchange].fetch_hourly_ohlc(market, start_time, end_time)
+
+    # Fetch the funding and hourly ohlc history of many (exchange, market) pairs concurrently.
+    # All requests run on one event loop and every venue is limited to its own number of concurrent requests,
+    # so the backfill takes as long as the slowest venue instead of the sum of all of them.
+    # With since (epoch seconds) the months between since and until are requested concurrently, without it the
+    # whole funding history of every pair is fetched. Returns {(exchange, market): (funding_df, price_df)}, with
+    # (None, None) for the pairs that failed (e.g. exchanges without hourly ohlc, like OKX or Gate).
+    def backfill(self, pairs, since=None, until=None):
+        return asyncio.run(self._backfill(pairs, since, until))
+
+    async def _backfill(self, pairs, since, until):
+        limits = {exchange: VENUE_CONCURRENCY.get(exchange, BACKFILL_CONCURRENCY) for exchange, _ in pairs}
+        semaphores = {exchange: asyncio.Semaphore(limit) for exchange, limit in limits.items()}
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=max(1, sum(limits.values()))) as executor:
+            async def call(exchange, function, *args):
+                async with semaphores[exchange]:
+                    return await loop.run_in_executor(executor, function, *args)
+
+            results = await asyncio.gather(*[self._backfill_pair(call, exchange, market, since, until) for exchange, market in pairs], return_exceptions=True)
+
+        # A failed pair gets (None, None), the other pairs keep their history
+        history = {}
+        for (exchange, market), result in zip(pairs, results):
+            if isinstance(result, Exception):
+                print(f"{exchange} {market} Error: {result}")
+                result = (None, None)
+            history[(exchange, market)] = result
+        return history
+
+    async def _backfill_pair(self, call, exchange, market, since, until):
+        fetcher = self.exchanges[exchange]
+        if not hasattr(fetcher, 'fetch_hourly_ohlc'):
+            raise ValueError(f"{exchange} has no hourly ohlc source, backfill needs the funding and price history")
+        until = datetime.now().timestamp() if until is None else until
+
+        if since is not None and exchange in MONTHLY_FUNDING_VENUES:
+            months = await asyncio.gather(*[call(exchange, fetcher._fetch_funding_rate_history_by_month, market, year, month) for year, month in get_months(since, until)])
+            funding_df = fetcher._format_funding_rate_history(concat_month_data(months))
+        else:
+            funding_df = await call(exchange, fetcher.fetch_funding_rate_history_until_start, market)
+        funding_df['datetime'] = funding_df['datetime'].dt.tz_localize(None)
+        if since is not None:
+            funding_df = funding_df[(funding_df['timestamp'] >= since) & (funding_df['timestamp'] <= until)].reset_index(drop=True)
+
+        if len(funding_df) == 0:
+            return funding_df, None
+
+        start_time = funding_df['timestamp'].min()
+        end_time = funding_df['timestamp'].max()
+        if exchange in MONTHLY_OHLC_VENUES:
+            months = await asyncio.gather(*[call(exchange, fetcher._fetch_hourly_ohlc_by_month, market, year, month) for year, month in get_months(start_time, end_time)])
+            price_df = fetcher._format_ohlc(concat_month_data(months))
+        else:
+            price_df = await call(exchange, fetcher.fetch_hourly_ohlc, market, start_time, end_time)
+        price_df['datetime'] = price_df['datetime'].dt.tz_localize(None)
+
+        return funding_df, price_df
+
+# Join the raw records of several months, fetchers return them as a list of records or as a frame (Drift)
+def concat_month_data(months):
+    months = [data for data in months if data is not None and len(data) > 0]
+    if any(isinstance(data, pd.DataFrame) for data in months):
+        return pd.concat(months, ignore_index=True)
+    return [item for data in months for item in data]
+
+# (year, month) of every month between two epoch times, in local time like the month files of the fetchers
+def get_months(start_time, end_time):
+    cur = datetime.fromtimestamp(start_time)
+    end = datetime.fromtimestamp(end_time)
+    months = []
+    year, month = cur.year, cur.month
+    while (year, month) <= (end.year, end.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
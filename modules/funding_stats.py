@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from .schema import to_funding_records
+
+# Trailing windows (in hours) of the annualized average funding rate, "all_time" averages the whole history
+TIMEFRAMES = {
+    "1h": 1,
+    "24h": 24,
+    "3d": 72,
+    "7d": 168,
+    "30d": 720,
+    "90d": 2160,
+    "120d": 2880,
+    "1y": 8760,
+    "all_time": None,
+}
+
+# Annualized average funding rate of every trailing window ({timeframe: rate}) of one funding history.
+# df is canonical funding records or a fetcher output (see schema.to_funding_records).
+def get_annualized_average_funding_rate(df, funding_interval):
+    return get_annualized_average_funding_rates({None: df}, {None: funding_interval}).iloc[0].to_dict()
+
+# Annualized average funding rates of many histories at once. histories is {key: df} (e.g. (exchange, market) keys)
+# and funding_intervals {key: hours between fundings}. Returns a frame with one row per key and one column per
+# timeframe. A window of h hours averages the newest h / funding_interval fundings (at least one).
+# All histories share one prefix sum, so every window of every market is two lookups into it.
+def get_annualized_average_funding_rates(histories, funding_intervals):
+    keys = list(histories.keys())
+    rates = [get_newest_first_rates(histories[key], funding_intervals[key]) for key in keys]
+    lengths = np.array([len(r) for r in rates])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]) if keys else np.array([], dtype=int)
+    values = np.concatenate(rates) if keys else np.array([])
+
+    # NaN rates are skipped like pandas mean() does
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+
+    intervals = np.array([funding_intervals[key] for key in keys], dtype=float)
+    windows = np.array([
+        [lengths[i] if hours is None else max(1, int(hours // intervals[i])) for hours in TIMEFRAMES.values()]
+        for i in range(len(keys))
+    ], dtype=int).reshape(len(keys), len(TIMEFRAMES))
+    ends = starts[:, None] + np.minimum(windows, lengths[:, None])
+
+    window_sums = sums[ends] - sums[starts][:, None]
+    window_counts = counts[ends] - counts[starts][:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = window_sums / window_counts
+    annualized = means * (24 / intervals[:, None]) * 365
+
+    return pd.DataFrame(annualized, index=keys, columns=list(TIMEFRAMES.keys()))
+
+# Rates of one history newest first, histories are converted to canonical records unless they already are
+def get_newest_first_rates(df, funding_interval):
+    if df is None or len(df) == 0:
+        return np.array([], dtype=float)
+    return to_funding_records(df, None, None, funding_interval)["funding_rate"].to_numpy()[::-1]
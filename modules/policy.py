@@ -0,0 +1,56 @@
+import os
+import time
+import calendar
+from datetime import datetime
+
+OFFLINE = "offline"  # only read the cache, never call the exchange APIs
+REFRESH = "refresh"  # fetch missing and stale data
+FORCE = "force"  # fetch every month again (caches of the newest records fetch them regardless of age)
+
+# When the exchange fetchers read their cache and when they call the exchange APIs.
+# With REFRESH a cached month is stale when it was written before the month ended (the current month or an
+# interrupted download) and is older than max_age seconds. Months written after they ended are complete and are
+# never fetched again. max_age=0 refreshes the current month on every call (the previous behaviour).
+class FetchPolicy:
+    def __init__(self, mode=REFRESH, max_age=0):
+        if mode not in (OFFLINE, REFRESH, FORCE):
+            raise ValueError(f"Unknown fetch policy mode: {mode}")
+        self.mode = mode
+        self.max_age = max_age
+
+    @property
+    def offline(self):
+        return self.mode == OFFLINE
+
+    # updated_time is the modification time of the cached month (None when the month is not cached)
+    def should_fetch_month(self, updated_time, year, month):
+        if self.mode == FORCE:
+            return True
+        if updated_time is None:
+            return self.mode != OFFLINE
+        if self.mode == OFFLINE:
+            return False
+        return updated_time < get_month_end(year, month) and time.time() - updated_time >= self.max_age
+
+    # Caches that only add the newest records (Huobi, dYdX): fetch when the last update is older than max_age
+    def should_fetch_latest(self, updated_time):
+        if self.mode == FORCE or updated_time is None:
+            return self.mode != OFFLINE
+        if self.mode == OFFLINE:
+            return False
+        return time.time() - updated_time >= self.max_age
+
+# End of a month in local time, like the month windows used by the fetchers
+def get_month_end(year, month):
+    num_days_in_month = calendar.monthrange(year, month)[1]
+    return datetime(year, month, num_days_in_month).timestamp() + 24 * 60 * 60
+
+# Newest modification time of the files in a cache folder, None if there are none
+def get_folder_mtime(folder_path):
+    if not os.path.exists(folder_path):
+        return None
+    times = [entry.stat().st_mtime for entry in os.scandir(folder_path) if entry.is_file()]
+    return max(times) if times else None
+
+# Policy used by fetchers created without an explicit one
+default_policy = FetchPolicy()
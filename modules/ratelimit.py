@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+
+# Request budget of every exchange: (host, requests per second, burst).
+# Binance and Apollox allow 2400 request weight per minute (klines and funding pages weigh up to 10),
+# Bitmex 30 requests per minute without an API key, OKX 10 funding history requests per 2 seconds,
+# Hyperliquid 1200 weight per minute with 20 per info request.
+VENUE_LIMITS = {
+    'binance': ('fapi.binance.com', 4, 10),
+    'apollox': ('fapi.apollox.finance', 4, 10),
+    'bitmex': ('www.bitmex.com', 0.5, 5),
+    'okx': ('www.okx.com', 5, 10),
+    'gate': ('api.gateio.ws', 15, 30),
+    'huobi': ('api.hbdm.com', 10, 20),
+    'dydx': ('api.dydx.exchange', 10, 20),
+    'hyperliquid': ('api.hyperliquid.xyz', 1, 5),
+    'zeta': ('dex-funding-rate-mainnet.zeta.markets', 5, 10),
+}
+
+# Weight budget per minute of the venues reporting the used weight in X-MBX-USED-WEIGHT-1M
+WEIGHT_LIMITS = {
+    'binance': 2400,
+    'apollox': 2400,
+}
+WEIGHT_SAFETY = 0.9  # pause the venue until the next minute above this share of the budget
+
+RETRY_STATUS = [418, 429, 500, 502, 503, 504]
+MAX_RETRIES = 5
+BACKOFF_BASE = 1  # seconds, doubled on every retry
+BACKOFF_MAX = 60
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    # Block until a request may be sent
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    # Stop sending requests for the given number of seconds (server asked us to slow down)
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+# Throttles requests per exchange with a token bucket, reads the rate limit headers of the venues that send
+# them and tells the client how long to back off before retrying a rejected request.
+class RateLimiter:
+    def __init__(self, limits=VENUE_LIMITS):
+        self.venues = {host: venue for venue, (host, _, _) in limits.items()}
+        self.buckets = {venue: TokenBucket(rate, burst) for venue, (_, rate, burst) in limits.items()}
+
+    def get_venue(self, host):
+        return self.venues.get(host)
+
+    def acquire(self, host):
+        venue = self.get_venue(host)
+        if venue is not None:
+            self.buckets[venue].acquire()
+
+    def update(self, host, response):
+        venue = self.get_venue(host)
+        if venue is None:
+            return
+        headers = response.headers
+
+        used_weight = headers.get('X-MBX-USED-WEIGHT-1M')
+        if venue in WEIGHT_LIMITS and used_weight is not None and int(used_weight) >= WEIGHT_LIMITS[venue] * WEIGHT_SAFETY:
+            self.buckets[venue].pause(60 - time.time() % 60)
+
+        remaining = headers.get('x-ratelimit-remaining')
+        reset = headers.get('x-ratelimit-reset')
+        if remaining is not None and reset is not None and int(remaining) <= 1:
+            self.buckets[venue].pause(max(0, float(reset) - time.time()))
+
+        retry_after = get_retry_after(response)
+        if response.status_code in RETRY_STATUS and retry_after is not None:
+            self.buckets[venue].pause(retry_after)
+
+    # Jittered exponential backoff before retry number `attempt` (0 based)
+    def get_backoff(self, attempt, response=None):
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+        retry_after = get_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 1)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+# Retry-After in seconds (the HTTP date form is not used by the venues)
+def get_retry_after(response):
+    retry_after = response.headers.get('Retry-After')
+    try:
+        return float(retry_after) if retry_after is not None else None
+    except ValueError:
+        return None
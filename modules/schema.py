@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+# Canonical funding and price records. Every fetcher output is converted once (to_funding_records, to_price_records)
+# so the vectorized code downstream needs no per-venue fix-ups: one row per time in ascending order, times as int64
+# epoch seconds and naive UTC datetimes, the rate paid per funding and per hour, exchange and market as categoricals.
+FUNDING_SCHEMA = {
+    "exchange": "category",
+    "market": "category",
+    "timestamp": "int64",
+    "datetime": "datetime64[ns]",
+    "funding_rate": "float64",
+    "hourly_rate": "float64",
+}
+PRICE_SCHEMA = {
+    "exchange": "category",
+    "market": "category",
+    "timestamp": "int64",
+    "datetime": "datetime64[ns]",
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+}
+PRICE_COLUMNS = ["open", "high", "low", "close"]
+
+class SchemaError(ValueError):
+    pass
+
+# Funding history of one market as canonical records. df is a fetcher output: a funding_rate column (the rate of
+# one funding, funding_interval hours apart) and a timestamp or funding_time column, in any order.
+# Rows without a time are dropped, the last one of a duplicated time is kept. Records are returned as they are.
+def to_funding_records(df, exchange, market, funding_interval):
+    if is_records(df, FUNDING_SCHEMA):
+        return df
+    if "funding_rate" not in df.columns:
+        raise SchemaError(f"{exchange} {market}: no funding_rate column")
+    records = pd.DataFrame({
+        "timestamp": get_epoch_seconds(df),
+        "funding_rate": to_float(df["funding_rate"]),
+    })
+    records["hourly_rate"] = records["funding_rate"] / funding_interval
+    return finish_records(records, FUNDING_SCHEMA, exchange, market)
+
+# Hourly ohlc of one market as canonical records, df is a fetcher output with a timestamp and the price columns
+def to_price_records(df, exchange, market):
+    if is_records(df, PRICE_SCHEMA):
+        return df
+    missing = [column for column in ["timestamp"] + PRICE_COLUMNS if column not in df.columns]
+    if missing:
+        raise SchemaError(f"{exchange} {market}: no {', '.join(missing)} column")
+    records = pd.DataFrame({"timestamp": get_epoch_seconds(df)})
+    for column in PRICE_COLUMNS:
+        records[column] = to_float(df[column])
+    return finish_records(records, PRICE_SCHEMA, exchange, market)
+
+def finish_records(records, schema, exchange, market):
+    records = records[~np.isnan(records["timestamp"])]
+    records = records.sort_values(by="timestamp", kind="stable").drop_duplicates(subset="timestamp", keep="last")
+    records = records.reset_index(drop=True)
+    records["timestamp"] = records["timestamp"].astype("int64")
+    records["datetime"] = pd.to_datetime(records["timestamp"], unit="s")
+    records["exchange"] = pd.Categorical([exchange] * len(records))
+    records["market"] = pd.Categorical([market] * len(records))
+    return records[list(schema)].astype(schema)
+
+# Whether df already has the columns and dtypes of the schema with strictly increasing times
+def is_records(df, schema):
+    if df is None or list(df.columns) != list(schema):
+        return False
+    if any(str(df[column].dtype) != dtype for column, dtype in schema.items()):
+        return False
+    return bool((np.diff(df["timestamp"].to_numpy()) > 0).all())
+
+def validate_records(df, schema):
+    if not is_records(df, schema):
+        raise SchemaError(f"Not canonical records, columns: {dict(df.dtypes.astype(str)) if df is not None else None}")
+    return df
+
+# Values as float64 (NaN when missing). Numeric strings are converted exactly like astype(float) does, only values
+# that can't be parsed go through pd.to_numeric.
+def to_float(values):
+    try:
+        return values.to_numpy(dtype="float64")
+    except (TypeError, ValueError):
+        return pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64")
+
+# Times of a fetcher output in epoch seconds (float, NaN when missing). Fetchers return a timestamp column in
+# seconds, or a funding_time column in seconds, milliseconds or as date strings depending on the venue.
+def get_epoch_seconds(df):
+    if "timestamp" in df.columns:
+        return pd.to_numeric(df["timestamp"], errors="coerce").to_numpy(dtype=float)
+    times = pd.to_numeric(df["funding_time"], errors="coerce")
+    if times.isna().any():
+        times = pd.to_datetime(df["funding_time"], utc=True, errors="coerce")
+        return ((times - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+    times = times.to_numpy(dtype=float)
+    return np.where(times > 1e11, times / 1000, times)
@@ -0,0 +1,91 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from .ratelimit import RateLimiter, RETRY_STATUS, MAX_RETRIES
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) in seconds
+POOL_SIZE = 16
+
+# Raised instead of sending a request when the client is offline (FetchPolicy OFFLINE)
+class OfflineError(requests.ConnectionError):
+    pass
+
+# Pooled HTTP client shared by the exchange fetchers.
+# One requests.Session (keep-alive connection pool) is kept per host, so paged backfills reuse the same
+# TCP + TLS connections instead of opening a new one for every request.
+# Requests are throttled per exchange by the rate limiter, and 418/429/5xx responses or connection errors are
+# retried with jittered exponential backoff. The last response is returned when the retries run out.
+class HTTPClient:
+    def __init__(self, pool_size=POOL_SIZE, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES, offline=False):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.offline = offline
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.rate_limiter = RateLimiter()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        if self.offline:
+            raise OfflineError(f"Offline, not requesting {url}")
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlparse(url).netloc
+        session = self.session(url)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(host)
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self.rate_limiter.get_backoff(attempt))
+                attempt += 1
+                continue
+
+            self.rate_limiter.update(host, response)
+            if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                return response
+            time.sleep(self.rate_limiter.get_backoff(attempt, response))
+            attempt += 1
+
+    def session(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = self._create_session()
+            return self.sessions[host]
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        return session
+
+    # Sessions and locks are per process, a copy sent to another process starts with an empty pool
+    def __getstate__(self):
+        return {"pool_size": self.pool_size, "timeout": self.timeout, "max_retries": self.max_retries, "offline": self.offline}
+
+    def __setstate__(self, state):
+        self.__init__(state["pool_size"], state["timeout"], state["max_retries"], state["offline"])
+
+# Client used by fetchers created without an explicit one
+default_client = HTTPClient()
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from .session import POOL_SIZE
+
+LOOKBACK_HOURS = 720  # trailing window of the scan (30 days)
+FORMATION_HOURS = 720  # window before it the side of every venue pair is chosen from
+LOAD_CHUNK = 64  # funding histories loaded at a time, only their hourly rates in the window are kept
+PAIR_CHUNK = 4096  # venue pairs compared at a time
+MIN_COVERAGE = 0.9  # share of the window's hours both venues need a funding rate for
+BASE_ALIASES = {"XBT": "BTC"}
+
+# Every market of the given exchanges (all registered exchanges by default) with its base asset, as a frame of
+# exchange, market and base. Exchanges whose markets can't be listed are left out.
+def get_market_universe(fetcher, exchanges=None):
+    rows = []
+    for exchange in (list(fetcher.exchanges) if exchanges is None else exchanges):
+        try:
+            for market in fetcher.list_markets(exchange):
+                base = str(fetcher.get_market_base(exchange, market)).upper()
+                rows.append((exchange, market, BASE_ALIASES.get(base, base)))
+        except Exception as e:
+            print(f"{exchange} Error: {e}")
+    return pd.DataFrame(rows, columns=["exchange", "market", "base"])
+
+# Hourly funding rates of many (exchange, market) pairs over the given hours (epoch seconds), as a float32 array
+# of shape (pairs, hours). Every hour gets the latest funding at or before it divided by the venue's funding
+# interval (the rate paid per hour), NaN without one in the last interval. Histories are loaded in chunks.
+def load_hourly_funding_rates(fetcher, pairs, hours):
+    rates = np.full((len(pairs), len(hours)), np.nan, dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=POOL_SIZE) as executor:
+        for start in range(0, len(pairs), LOAD_CHUNK):
+            chunk = pairs[start:start + LOAD_CHUNK]
+            histories = executor.map(lambda pair: load_funding_history(fetcher, *pair), chunk)
+            for i, ((exchange, _), df) in enumerate(zip(chunk, histories)):
+                if df is not None and len(df) > 0:
+                    rates[start + i] = align_hourly(df, hours, fetcher.exchanges[exchange].funding_interval)
+    return rates
+
+def load_funding_history(fetcher, exchange, market):
+    try:
+        return fetcher.fetch_funding_records(exchange, market)
+    except Exception as e:
+        print(f"{exchange} {market} Error: {e}")
+        return None
+
+# records are canonical funding records (schema.py), already sorted with their hourly rates
+def align_hourly(records, hours, funding_interval):
+    times = records["timestamp"].to_numpy()
+    values = records["hourly_rate"].to_numpy()
+
+    index = np.searchsorted(times, hours, side="right") - 1
+    valid = (index >= 0) & (hours - times[np.maximum(index, 0)] < funding_interval * 3600)
+    return np.where(valid, values[np.maximum(index, 0)], np.nan)
+
+# Rank every pair of venues listing the same base asset by a backtest of their funding spread over the last
+# lookback_hours. The side of every venue pair is chosen from the formation_hours before that window (long the venue
+# with the lower average funding, short the other one) and then held over the scored window, so the results carry no
+# look-ahead: the hourly carry is the short rate minus the long rate and can be negative. The result has one row per
+# venue pair with the annualized average carry, the annualized volatility of the hourly spread, the pnl of holding
+# the pair over the scored window (carry per unit of notional less fee_percent for opening and closing both legs),
+# the max drawdown of that pnl and the coverage, best pnl first. Pairs where both venues have rates for less than
+# min_coverage of the hours of either window are left out. universe is a frame of exchange, market and base (see
+# get_market_universe).
+def scan_funding_spreads(fetcher, universe, lookback_hours=LOOKBACK_HOURS, end_time=None, fee_percent=0.001, min_coverage=MIN_COVERAGE, formation_hours=FORMATION_HOURS):
+    end_time = datetime.now().timestamp() if end_time is None else end_time
+    end_hour = int(end_time // 3600) * 3600
+    hours = end_hour - 3600 * np.arange(formation_hours + lookback_hours - 1, -1, -1, dtype=np.int64)
+
+    universe = universe.drop_duplicates(subset=["exchange", "market"]).reset_index(drop=True)
+    bases = universe.groupby("base").indices
+    pair_index = np.array([
+        pair for indices in bases.values()
+        for pair in combinations(sorted(indices), 2)
+        if universe.at[pair[0], "exchange"] != universe.at[pair[1], "exchange"]
+    ], dtype=np.int64).reshape(-1, 2)
+
+    # Only markets with another venue to compare to are loaded
+    markets = np.unique(pair_index)
+    row_of = np.full(len(universe), -1)
+    row_of[markets] = np.arange(len(markets))
+    rates = load_hourly_funding_rates(fetcher, list(zip(universe["exchange"].iloc[markets], universe["market"].iloc[markets])), hours)
+
+    results = []
+    for start in range(0, len(pair_index), PAIR_CHUNK):
+        chunk = pair_index[start:start + PAIR_CHUNK]
+        spread = rates[row_of[chunk[:, 1]]] - rates[row_of[chunk[:, 0]]]
+        valid = ~np.isnan(spread)
+        spread = np.where(valid, spread, 0)
+
+        # Long the first venue when the second one paid more funding over the formation window
+        formation_counts = valid[:, :formation_hours].sum(axis=1)
+        formation_sums = spread[:, :formation_hours].sum(axis=1, dtype=np.float64)
+        direction = np.where(formation_sums >= 0, 1, -1)
+
+        valid = valid[:, formation_hours:]
+        spread = spread[:, formation_hours:] * direction[:, None]
+        counts = valid.sum(axis=1)
+        coverage = np.minimum(counts / lookback_hours, formation_counts / formation_hours) if formation_hours > 0 else counts / lookback_hours
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = spread.sum(axis=1, dtype=np.float64) / counts
+            volatility = np.sqrt((np.where(valid, spread - mean[:, None], 0) ** 2).sum(axis=1) / counts) * np.sqrt(24 * 365)
+        pnl = spread.cumsum(axis=1, dtype=np.float64)
+        drawdown = (np.maximum(np.maximum.accumulate(pnl, axis=1), 0) - pnl).max(axis=1)
+
+        long_index = np.where(direction > 0, chunk[:, 0], chunk[:, 1])
+        short_index = np.where(direction > 0, chunk[:, 1], chunk[:, 0])
+        results.append(pd.DataFrame({
+            "base": universe["base"].to_numpy()[long_index],
+            "long_exchange": universe["exchange"].to_numpy()[long_index],
+            "long_market": universe["market"].to_numpy()[long_index],
+            "short_exchange": universe["exchange"].to_numpy()[short_index],
+            "short_market": universe["market"].to_numpy()[short_index],
+            "spread": mean * 24 * 365,
+            "volatility": volatility,
+            "pnl": pnl[:, -1] - 4 * fee_percent,
+            "max_drawdown": drawdown,
+            "coverage": coverage,
+        }))
+
+    columns = ["base", "long_exchange", "long_market", "short_exchange", "short_market", "spread", "volatility", "pnl", "max_drawdown", "coverage"]
+    result_df = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=columns)
+    result_df = result_df[result_df["coverage"] >= min_coverage]
+    return result_df.sort_values(by="pnl", ascending=False).reset_index(drop=True)
@@ -0,0 +1,218 @@
+import json
+import os
+import time
+import pandas as pd
+from modules.fetcher import Fetcher
+
+MONITOR_PATH = './storage/monitor'
+POLL_INTERVAL = 60  # seconds between two polls of the funding snapshots
+RESULT_COLUMNS = ['datetime', 'timestamp', 'close', 'long_funding', 'short_funding', 'long_pnl', 'short_pnl', 'final_pnl']
+SNAPSHOT_COLUMNS = ['timestamp', 'funding_time', 'funding_rate', 'mark_price']
+
+# State of get_dual_backtest_result after its last record, updated one record at a time.
+# update() applies the rules of make_trade and record_row to both legs (long = 0, short = 1): the first record only
+# opens the account, the second one opens both legs and the legs are opened again with averaged margins after a
+# stop loss of either leg. Feeding the records of a backtest one by one gives the pnl of get_dual_backtest_result.
+class DualBacktestState:
+    def __init__(self, leverage, init_clt = 1, fee_percent = 0.001, stop_loss_margin = 0.0625):
+        self.leverage = leverage
+        self.fee_percent = fee_percent
+        self.stop_loss_margin = stop_loss_margin
+        self.index = 0
+        self.legs = [new_leg(init_clt / 2) for _ in range(2)]
+
+    # close is the price reference of both legs, short_funding_rate is already scaled to the long funding frequency.
+    # Returns the (long, short) pnl after the record.
+    def update(self, close, long_funding_rate, short_funding_rate):
+        if self.index == 1:
+            for leg, side in zip(self.legs, (1, -1)):
+                self._trade(leg, close, side, 0)
+        elif self.index > 1 and any(leg['is_sl'] for leg in self.legs):
+            avg_margin = (self.legs[0]['margin'] + self.legs[1]['margin']) / 2
+            for leg, side in zip(self.legs, (1, -1)):
+                self._trade(leg, close, side, avg_margin - leg['margin'])
+        elif self.index > 1:
+            for leg, funding_rate in zip(self.legs, (long_funding_rate, short_funding_rate)):
+                self._record(leg, close, funding_rate)
+        self.index += 1
+        return self.legs[0]['pnl'], self.legs[1]['pnl']
+
+    def to_dict(self):
+        return {
+            'leverage': self.leverage,
+            'fee_percent': self.fee_percent,
+            'stop_loss_margin': self.stop_loss_margin,
+            'index': self.index,
+            'legs': self.legs,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['leverage'], fee_percent=data['fee_percent'], stop_loss_margin=data['stop_loss_margin'])
+        state.index = data['index']
+        state.legs = data['legs']
+        return state
+
+    def _trade(self, leg, price, side, inj):
+        new_clt = leg['clt'] + leg['change_pnl'] + leg['funding_pnl'] + inj
+        fee = new_clt * self.leverage * self.fee_percent
+        new_clt = new_clt - fee
+
+        leg['eq'] = leg['eq'] + inj
+        leg['clt'] = max(new_clt, 0)
+        leg['entry'] = price
+        leg['pos_size'] = leg['clt'] * self.leverage * side / price
+        leg['change_pnl'] = 0.0
+        leg['funding_pnl'] = 0.0
+        leg['margin'] = leg['clt']
+        leg['is_sl'] = bool(leg['margin'] < leg['clt'] * self.leverage * self.stop_loss_margin)
+        leg['pnl'] = leg['margin'] - leg['eq']
+
+    def _record(self, leg, price, funding_rate):
+        leg['change_pnl'] = (price - leg['entry']) * leg['pos_size']
+        leg['funding_pnl'] = leg['funding_pnl'] + -funding_rate * leg['pos_size'] * price
+        leg['margin'] = leg['clt'] + leg['change_pnl'] + leg['funding_pnl']
+        leg['is_sl'] = bool(leg['margin'] < leg['clt'] * self.leverage * self.stop_loss_margin)
+        leg['pnl'] = leg['margin'] - leg['eq']
+
+def new_leg(clt):
+    return {'eq': float(clt), 'clt': float(clt), 'entry': 0.0, 'pos_size': 0.0, 'change_pnl': 0.0, 'funding_pnl': 0.0, 'margin': 0.0, 'is_sl': False, 'pnl': 0.0}
+
+# Long-running paper trading of dual (long, short) funding strategies on live funding.
+# strategies is {name: {'long': (exchange, market), 'short': (exchange, market), 'leverage': 3}} plus the optional
+# init_clt, fee_percent and stop_loss_margin of get_dual_backtest_result. Every poll reads the funding snapshot of
+# both legs (Fetcher.fetch_funding_snapshot). A funding is settled when the next funding time of its venue moves on,
+# and every settled funding of the long leg is one record of the backtest: it is applied to the saved state and
+# appended to {name}.csv, so each record costs the same whatever the length of the history. The short leg uses its
+# last settled rate (or the predicted one before the first settlement), like the merge_asof of the backtest.
+# Every polled snapshot (funding rate, next funding time and mark price) is appended to
+# snapshots/{exchange}_{market}.csv, each market is polled once per poll even when strategies share it.
+# A market whose snapshot fails is skipped until the next poll, a venue without snapshots is rejected at startup.
+# Fundings settled while the monitor is not running are not replayed.
+class FundingMonitor:
+    def __init__(self, strategies, fetcher = None, folder_path = MONITOR_PATH, poll_interval = POLL_INTERVAL):
+        self.strategies = strategies
+        self.fetcher = fetcher or Fetcher()
+        self.folder_path = folder_path
+        self.poll_interval = poll_interval
+        # A venue without live snapshots fails here rather than on the first poll
+        for name, strategy in strategies.items():
+            for leg in ('long', 'short'):
+                exchange = strategy[leg][0]
+                if not hasattr(self.fetcher.exchanges[exchange], 'fetch_funding_snapshot'):
+                    raise ValueError(f"{name}: {exchange} has no fetch_funding_snapshot, it can't be monitored")
+        self.states = {name: self._load_state(name, strategy) for name, strategy in strategies.items()}
+
+    def run(self, stop_event = None):
+        while stop_event is None or not stop_event.is_set():
+            self.poll()
+            if stop_event is None:
+                time.sleep(self.poll_interval)
+            else:
+                stop_event.wait(self.poll_interval)
+
+    # One poll of every strategy, returns {name: new result records}
+    def poll(self):
+        markets = set(tuple(strategy[leg]) for strategy in self.strategies.values() for leg in ('long', 'short'))
+        snapshots = {market: self._fetch_snapshot(*market) for market in markets}
+        for market, snapshot in snapshots.items():
+            if snapshot is not None:
+                self._append_snapshot(market, snapshot)
+        return {name: self._poll_strategy(name, strategy, snapshots) for name, strategy in self.strategies.items()}
+
+    # A failed request (retries exhausted, unexpected payload) skips the market for this poll only
+    def _fetch_snapshot(self, exchange, market):
+        try:
+            return self.fetcher.fetch_funding_snapshot(exchange, market)
+        except Exception as e:
+            print(f"{exchange} {market} Error: {e}")
+            return None
+
+    def _poll_strategy(self, name, strategy, snapshots):
+        state = self.states[name]
+        snapshots = [snapshots[tuple(strategy[leg])] for leg in ('long', 'short')]
+        if any(snapshot is None for snapshot in snapshots):
+            return []
+        long_snapshot, short_snapshot = snapshots
+
+        # The short leg first, a short funding settled at the same time as a long one applies to it
+        short_settled = settle(state['short'], short_snapshot)
+        if short_settled is not None:
+            state['short_funding_rate'] = short_settled['funding_rate']
+        elif state['short_funding_rate'] is None:
+            state['short_funding_rate'] = short_snapshot['funding_rate']
+
+        long_settled = settle(state['long'], long_snapshot)
+        records = []
+        if long_settled is not None:
+            short_funding_rate = state['short_funding_rate'] * state['long_funding_freq'] / state['short_funding_freq']
+            long_pnl, short_pnl = state['backtest'].update(long_snapshot['mark_price'], long_settled['funding_rate'], short_funding_rate)
+            records.append({
+                'datetime': pd.to_datetime(long_settled['funding_time'], unit='s'),
+                'timestamp': long_settled['funding_time'],
+                'close': long_snapshot['mark_price'],
+                'long_funding': long_settled['funding_rate'],
+                'short_funding': short_funding_rate,
+                'long_pnl': long_pnl,
+                'short_pnl': short_pnl,
+                'final_pnl': long_pnl + short_pnl,
+            })
+            self._append_records(name, records)
+
+        self._save_state(name, state)
+        return records
+
+    def _get_state_path(self, name):
+        return os.path.join(self.folder_path, f'{name}.json')
+
+    def _get_records_path(self, name):
+        return os.path.join(self.folder_path, f'{name}.csv')
+
+    def _get_snapshots_path(self, exchange, market):
+        return os.path.join(self.folder_path, 'snapshots', f'{exchange}_{market}.csv')
+
+    def _load_state(self, name, strategy):
+        state_path = self._get_state_path(name)
+        if os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            state['backtest'] = DualBacktestState.from_dict(state['backtest'])
+            return state
+        return {
+            'long': {},
+            'short': {},
+            'short_funding_rate': None,
+            'long_funding_freq': self.fetcher.exchanges[strategy['long'][0]].funding_interval,
+            'short_funding_freq': self.fetcher.exchanges[strategy['short'][0]].funding_interval,
+            'backtest': DualBacktestState(
+                strategy['leverage'],
+                strategy.get('init_clt', 1),
+                strategy.get('fee_percent', 0.001),
+                strategy.get('stop_loss_margin', 0.0625),
+            ),
+        }
+
+    def _save_state(self, name, state):
+        os.makedirs(self.folder_path, exist_ok=True)
+        state_path = self._get_state_path(name)
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(dict(state, backtest=state['backtest'].to_dict()), f)
+        os.replace(state_path + '.tmp', state_path)
+
+    def _append_records(self, name, records):
+        os.makedirs(self.folder_path, exist_ok=True)
+        records_path = self._get_records_path(name)
+        pd.DataFrame(records, columns=RESULT_COLUMNS).to_csv(records_path, mode='a', header=not os.path.exists(records_path), index=False)
+
+    def _append_snapshot(self, market, snapshot):
+        snapshots_path = self._get_snapshots_path(*market)
+        os.makedirs(os.path.dirname(snapshots_path), exist_ok=True)
+        pd.DataFrame([snapshot], columns=SNAPSHOT_COLUMNS).to_csv(snapshots_path, mode='a', header=not os.path.exists(snapshots_path), index=False)
+
+# Track the pending funding of one leg, returns the funding settled since the previous snapshot (or None)
+def settle(leg_state, snapshot):
+    pending = leg_state.get('pending')
+    leg_state['pending'] = {'funding_time': snapshot['funding_time'], 'funding_rate': snapshot['funding_rate']}
+    if pending is not None and snapshot['funding_time'] > pending['funding_time']:
+        return pending
+    return None
@@ -0,0 +1,106 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from common import load_cache_data
+
+HOUR = 60 * 60
+PANEL_COLUMNS = ['close', 'funding_rate']
+
+# Build an aligned panel of all venues on one hourly grid and persist it as a memory-mapped array.
+# pairs is a list of (exchange, market) and funding_freq_map maps a market to its funding interval in hours.
+# Prices are forward-filled onto the grid and every funding payment is spread evenly over the hours of its
+# funding interval, so the funding_rate column of every venue is a per-hour rate.
+# The array has shape (len(pairs) * len(PANEL_COLUMNS), hours) so each series is one contiguous row.
+def build_panel(pairs, funding_freq_map, path = './data/panel', start = None, end = None):
+    data_df_map = {(exchange, market): load_cache_data(exchange, market, start, end) for exchange, market in pairs}
+
+    first_time = min(data_df['timestamp'].min() for data_df in data_df_map.values())
+    last_time = max(data_df['timestamp'].max() for data_df in data_df_map.values())
+    first_time = int(np.floor(first_time / HOUR) * HOUR)
+    last_time = int(np.floor(last_time / HOUR) * HOUR)
+    grid = np.arange(first_time, last_time + HOUR, HOUR, dtype=float)
+
+    os.makedirs(path, exist_ok=True)
+    values = np.lib.format.open_memmap(
+        os.path.join(path, 'panel.npy'),
+        mode='w+',
+        dtype=np.float64,
+        shape=(len(pairs) * len(PANEL_COLUMNS), len(grid)),
+    )
+
+    columns = []
+    for exchange, market in pairs:
+        data_df = data_df_map[(exchange, market)]
+        timestamp = data_df['timestamp'].to_numpy(dtype=float)
+        close = data_df['close'].to_numpy(dtype=float)
+        funding_rate = data_df['funding_rate'].to_numpy(dtype=float)
+        funding_freq = funding_freq_map[market]
+
+        # Last price at or before each grid hour
+        price_index = np.searchsorted(timestamp, grid, side='right') - 1
+        row = len(columns)
+        values[row] = np.where(price_index >= 0, close[np.maximum(price_index, 0)], np.nan)
+        columns.append([exchange, market, 'close'])
+
+        # Funding payment that covers each grid hour (the next payment within one funding interval)
+        funding_hour = np.floor(timestamp / HOUR) * HOUR
+        funding_index = np.searchsorted(funding_hour, grid, side='left')
+        clipped_index = np.minimum(funding_index, len(funding_hour) - 1)
+        covered = (funding_index < len(funding_hour)) & (funding_hour[clipped_index] - grid < funding_freq * HOUR)
+        values[row + 1] = np.where(covered, funding_rate[clipped_index] / funding_freq, np.nan)
+        columns.append([exchange, market, 'funding_rate'])
+
+    values.flush()
+    del values
+
+    with open(os.path.join(path, 'panel.json'), 'w') as f:
+        json.dump({'start': first_time, 'step': HOUR, 'length': len(grid), 'columns': columns}, f)
+
+    return Panel(path)
+
+# Read-only view of a panel written by build_panel. Every series is a zero-copy slice of the memory-mapped array.
+class Panel:
+    def __init__(self, path = './data/panel'):
+        with open(os.path.join(path, 'panel.json'), 'r') as f:
+            meta = json.load(f)
+        self.values = np.load(os.path.join(path, 'panel.npy'), mmap_mode='r')
+        self.start = meta['start']
+        self.step = meta['step']
+        self.length = meta['length']
+        self.columns = [tuple(column) for column in meta['columns']]
+        self.index = {column: row for row, column in enumerate(self.columns)}
+
+    def pairs(self):
+        return list(dict.fromkeys((exchange, market) for exchange, market, _ in self.columns))
+
+    def timestamps(self):
+        return self.start + self.step * np.arange(self.length, dtype=float)
+
+    def get_slice(self, start = None, end = None):
+        first = 0 if start is None else int(np.ceil((start - self.start) / self.step))
+        last = self.length if end is None else int(np.floor((end - self.start) / self.step)) + 1
+        return slice(max(first, 0), min(max(last, 0), self.length))
+
+    def series(self, exchange, market, column, start = None, end = None):
+        return self.values[self.index[(exchange, market, column)], self.get_slice(start, end)]
+
+    # Same columns as load_cache_data (close, funding_rate) on the hourly grid, ready for the backtest functions
+    def frame(self, exchange, market, start = None, end = None):
+        window = self.get_slice(start, end)
+        timestamp = self.timestamps()[window]
+        return pd.DataFrame({
+            'datetime': pd.to_datetime(timestamp, unit='s'),
+            'timestamp': timestamp.astype(np.int64),
+            'close': self.values[self.index[(exchange, market, 'close')], window],
+            'funding_rate': self.values[self.index[(exchange, market, 'funding_rate')], window],
+        })
+
+    # One series for many pairs as a (hours x pairs) frame, e.g. for correlation analysis
+    def table(self, column, pairs = None, start = None, end = None):
+        pairs = self.pairs() if pairs is None else pairs
+        window = self.get_slice(start, end)
+        return pd.DataFrame(
+            {f'{exchange}_{market}': self.values[self.index[(exchange, market, column)], window] for exchange, market in pairs},
+            index=pd.to_datetime(self.timestamps()[window], unit='s'),
+        )
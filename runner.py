@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from common import load_cache_data, get_backtest_result, get_dual_backtest_result
+
+# Columns shipped to the workers. Datetime is stored as int64 nanoseconds, timestamp as int64 seconds (like the
+# store), the others as float64.
+SHARED_COLUMNS = ['datetime', 'timestamp', 'open', 'high', 'low', 'close', 'funding_rate']
+
+# Shared memory block and layout attached by each worker process
+_worker_shm = None
+_worker_layout = None
+
+# Run every exchange x market x leverage backtest of the matrix in a process pool.
+# exchanges_markets is a list of {exchange: market} dicts, hedge_map maps an exchange to its hedge exchange and
+# funding_freq_map maps a market to its funding interval in hours. Leverage 1 uses get_backtest_result,
+# any other leverage uses get_dual_backtest_result against the hedge venue (same convention as the notebooks).
+# Returns results[exchange][market][leverage] = result_df.
+def run_backtest_matrix(exchanges_markets, hedge_map, funding_freq_map, leverages, min_time = None, max_time = None, max_workers = None):
+    data_df_map = load_matrix_data(exchanges_markets, min_time, max_time)
+
+    tasks = []
+    for exchanges_market in exchanges_markets:
+        for exchange, market in exchanges_market.items():
+            long_exchange = hedge_map[exchange]
+            long_market = exchanges_market[long_exchange]
+            for leverage in leverages:
+                tasks.append((exchange, market, long_exchange, long_market, leverage, funding_freq_map[long_market], funding_freq_map[market]))
+
+    shm, layout = create_shared_data(data_df_map)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_attach_shared_data, initargs=(shm.name, layout)) as executor:
+            outputs = list(executor.map(_run_backtest_task, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    results = {}
+    for (exchange, market, _, _, leverage, _, _), result_df in zip(tasks, outputs):
+        results.setdefault(exchange, {}).setdefault(market, {})[leverage] = result_df
+    return results
+
+# Load the cached data of every venue once and trim all of them to the common time range
+def load_matrix_data(exchanges_markets, min_time = None, max_time = None):
+    data_df_map = {}
+    for exchanges_market in exchanges_markets:
+        for exchange, market in exchanges_market.items():
+            if (exchange, market) not in data_df_map:
+                data_df_map[(exchange, market)] = load_cache_data(exchange, market)
+
+    for data_df in data_df_map.values():
+        min_time = data_df['timestamp'].min() if min_time is None else max(min_time, data_df['timestamp'].min())
+        max_time = data_df['timestamp'].max() if max_time is None else min(max_time, data_df['timestamp'].max())
+
+    for key, data_df in data_df_map.items():
+        data_df['datetime'] = pd.to_datetime(data_df['datetime'])
+        data_df = data_df[(data_df['timestamp'] >= min_time) & (data_df['timestamp'] <= max_time)]
+        data_df = data_df.sort_values(by='datetime', ascending=True)
+        data_df_map[key] = data_df.reset_index(drop=True)
+
+    return data_df_map
+
+# Copy every venue frame into one shared memory block, column by column.
+# The layout maps (exchange, market) to the byte offset and number of rows of its columns.
+def create_shared_data(data_df_map):
+    total_rows = sum(len(data_df) for data_df in data_df_map.values())
+    shm = shared_memory.SharedMemory(create=True, size=max(1, total_rows * len(SHARED_COLUMNS) * 8))
+
+    layout = {}
+    offset = 0
+    for key, data_df in data_df_map.items():
+        rows = len(data_df)
+        layout[key] = (offset, rows)
+        for column in SHARED_COLUMNS:
+            if column == 'datetime':
+                values = data_df[column].to_numpy(dtype='datetime64[ns]').view(np.int64)
+                dtype = np.int64
+            elif column == 'timestamp':
+                values = data_df[column].to_numpy(dtype=np.int64)
+                dtype = np.int64
+            else:
+                values = data_df[column].to_numpy(dtype=float)
+                dtype = np.float64
+            np.ndarray((rows,), dtype=dtype, buffer=shm.buf, offset=offset)[:] = values
+            offset += rows * 8
+
+    return shm, layout
+
+# Rebuild a venue frame from the shared memory block (the numeric columns are views, not copies)
+def read_shared_data(shm, layout, key):
+    offset, rows = layout[key]
+    columns = {}
+    for column in SHARED_COLUMNS:
+        if column == 'datetime':
+            values = np.ndarray((rows,), dtype=np.int64, buffer=shm.buf, offset=offset)
+            columns[column] = values.view('datetime64[ns]')
+        elif column == 'timestamp':
+            columns[column] = np.ndarray((rows,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        else:
+            columns[column] = np.ndarray((rows,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += rows * 8
+    return pd.DataFrame(columns, copy=False)
+
+def _attach_shared_data(shm_name, layout):
+    global _worker_shm, _worker_layout
+    # Workers share the parent's resource tracker, the parent unlinks the block when the matrix is done
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_layout = layout
+
+def _run_backtest_task(task):
+    exchange, market, long_exchange, long_market, leverage, long_funding_freq, short_funding_freq = task
+    short_df = read_shared_data(_worker_shm, _worker_layout, (exchange, market))
+
+    if leverage == 1:
+        return get_backtest_result(short_df, leverage)
+
+    long_df = read_shared_data(_worker_shm, _worker_layout, (long_exchange, long_market))
+    (result_df, _, _) = get_dual_backtest_result(long_df, short_df, long_funding_freq, short_funding_freq, leverage)
+    return result_df
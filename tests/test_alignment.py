@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from modules.alignment import align_histories
+
+# merge_funding_ohlc before the alignment stage: merge_asof to the nearest price then ffill of every column
+def merge_asof_reference(funding_df, price_df):
+    min_time = max(funding_df["timestamp"].min(), price_df["timestamp"].min())
+    max_time = min(funding_df["timestamp"].max(), price_df["timestamp"].max())
+    funding_df = funding_df[(funding_df["timestamp"] >= min_time) & (funding_df["timestamp"] <= max_time)]
+    price_df = price_df[(price_df["timestamp"] >= min_time) & (price_df["timestamp"] <= max_time)]
+    result_df = pd.merge_asof(funding_df, price_df.drop(columns="timestamp"), on="datetime", tolerance=pd.Timedelta("1h"), direction="nearest")
+    for column in ["open", "high", "low", "close"]:
+        result_df[column] = result_df[column].ffill()
+    return result_df[["datetime", "timestamp", "open", "high", "low", "close", "funding_rate"]]
+
+def make_history(rng, nan_share):
+    funding_times = np.sort(rng.choice(np.arange(0, 400 * 3600, 600), 120, replace=False)) + 1_600_000_000
+    price_times = np.sort(rng.choice(np.arange(-2, 402) * 3600, 300, replace=False)) + 1_600_000_000
+    funding_df = pd.DataFrame({"datetime": pd.to_datetime(funding_times, unit="s"), "timestamp": funding_times, "funding_rate": rng.normal(0, 1e-4, len(funding_times))})
+    prices = rng.random((len(price_times), 4))
+    prices[rng.random(prices.shape) < nan_share] = np.nan
+    price_df = pd.DataFrame(prices, columns=["open", "high", "low", "close"])
+    price_df.insert(0, "timestamp", price_times)
+    price_df.insert(0, "datetime", pd.to_datetime(price_times, unit="s"))
+    return funding_df, price_df
+
+def test_matches_merge_asof_with_nan_prices():
+    rng = np.random.default_rng(0)
+    histories = {("venue", str(i)): make_history(rng, nan_share=0.2 if i % 2 else 0) for i in range(20)}
+
+    results, _ = align_histories(histories)
+
+    for pair, (funding_df, price_df) in histories.items():
+        pd.testing.assert_frame_equal(results[pair], merge_asof_reference(funding_df, price_df), check_exact=True)
+
+def test_gap_report():
+    times = 1_600_000_000 + 3600 * np.array([0, 8, 24, 32])
+    funding_df = pd.DataFrame({"timestamp": times, "funding_rate": 0.1})
+    price_times = 1_600_000_000 + 3600 * np.array([0, 1, 2, 6, 7, 32])
+    price_df = pd.DataFrame({"timestamp": price_times, "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0})
+
+    _, gaps_df = align_histories({("venue", "BTC"): (funding_df, price_df)}, {("venue", "BTC"): 8})
+
+    assert gaps_df[["kind", "start", "end", "missing"]].values.tolist() == [
+        ["funding", times[1], times[2], 1],
+        ["price", price_times[2], price_times[3], 3],
+        ["price", price_times[4], price_times[5], 24],
+    ]
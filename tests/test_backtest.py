@@ -0,0 +1,67 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from common import get_backtest_sweep, get_backtest_result, get_iterative_backtest_result, get_dual_backtest_result, get_iterative_dual_backtest_result
+
+def make_history(n, seed, volatility, funding=1e-4, start=1_700_000_000):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, volatility, n)))
+    timestamp = start + 3600 * np.arange(n)
+    return pd.DataFrame({
+        "datetime": pd.to_datetime(timestamp, unit="s"),
+        "timestamp": timestamp,
+        "open": close,
+        "high": close,
+        "low": close,
+        "close": close,
+        "funding_rate": rng.normal(funding, 2 * abs(funding), n),
+    })
+
+# Calm prices never trade again, wilder prices stop out and then liquidate over and over
+@pytest.mark.parametrize("leverage, volatility, stop_losses, liquidations", [(1, 0.001, False, False), (3, 0.02, True, False), (10, 0.05, True, True)])
+def test_backtest_matches_iterative_reference(leverage, volatility, stop_losses, liquidations):
+    df = make_history(300, 7, volatility)
+
+    result = get_backtest_result(df, leverage)
+    expected = get_iterative_backtest_result(df, leverage)
+
+    assert result["is_sl"].any() == stop_losses and result["is_liq"].any() == liquidations
+    pd.testing.assert_frame_equal(result, expected, check_exact=True, check_dtype=False)
+
+def test_backtest_without_fee_matches_iterative_reference():
+    df = make_history(200, 3, 0.05)
+
+    pd.testing.assert_frame_equal(get_backtest_result(df, 10, fee=0), get_iterative_backtest_result(df, 10, fee=0), check_exact=True, check_dtype=False)
+
+@pytest.mark.parametrize("leverage, volatility", [(1, 0.001), (5, 0.02), (20, 0.05)])
+def test_dual_backtest_matches_iterative_reference(leverage, volatility):
+    long_df = make_history(300, 11, volatility)
+    short_df = make_history(300, 12, volatility, funding=3e-4)[["datetime", "timestamp", "close", "funding_rate"]]
+    long_df = long_df[["datetime", "timestamp", "close", "funding_rate"]]
+
+    result = get_dual_backtest_result(long_df, short_df, 1, 8, leverage)
+    expected = get_iterative_dual_backtest_result(long_df.copy(), short_df.copy(), 1, 8, leverage)
+
+    if volatility > 0.01:
+        assert result[1]["is_sl"].any() or result[2]["is_sl"].any()
+    for frame, expected_frame in zip(result, expected):
+        pd.testing.assert_frame_equal(frame, expected_frame[frame.columns], check_exact=True, check_dtype=False)
+
+def test_sweep_matches_backtest():
+    df = make_history(300, 5, 0.03)
+
+    sweep = get_backtest_sweep(df, [1, 3, 10])
+
+    assert sweep["final_pnl"].tolist() == [get_backtest_result(df, leverage)["final_pnl"].iloc[-1] for leverage in (1, 3, 10)]
+
+@pytest.mark.parametrize("n, pnl", [(0, np.nan), (1, 0.0)])
+def test_sweep_of_short_inputs_has_nan_stats(n, pnl):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        sweep = get_backtest_sweep(make_history(n, 5, 0.03), [1, 3])
+
+    assert len(sweep) == 2
+    assert sweep["sharpe_ratio"].isna().all()
+    np.testing.assert_array_equal(sweep["final_pnl"], pnl)
+    np.testing.assert_array_equal(sweep["max_drawdown"], pnl)
@@ -0,0 +1,5 @@
+from modules.exchanges.bitmex import format_utc
+
+def test_format_utc():
+    assert format_utc(1704067200) == "2024-01-01T00:00:00.000000Z"
+    assert format_utc(1704067201.5) == "2024-01-01T00:00:01.500000Z"
@@ -0,0 +1,44 @@
+import os
+import shutil
+import warnings
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from modules.exchanges import drift
+from modules.exchanges.drift import DriftMarketFetcher
+from modules.exchanges.libs.raw_cache import save_month
+from modules.policy import FetchPolicy, OFFLINE
+
+SYMBOL = "OFFLINE-TEST-PERP"
+
+@pytest.fixture
+def funding_path():
+    folder_path = os.path.join(os.path.dirname(drift.__file__), f"../data/drift/funding/{SYMBOL}")
+    yield folder_path
+    shutil.rmtree(folder_path, ignore_errors=True)
+
+# Month files cached before the CSV reader hold "undefined" for missing prices, the fill prices are used for them
+def test_undefined_prices_use_the_fill_prices():
+    records = [
+        {"start": 1700000000000, "open": "undefined", "high": 2.5, "low": 1.5, "close": "undefined", "fillOpen": 2.0, "fillHigh": 3.0, "fillLow": 1.0, "fillClose": "undefined"},
+        {"start": 1700003600000, "open": 2.0, "high": 3.0, "low": 1.0, "close": 2.5, "fillOpen": 2.0, "fillHigh": 3.0, "fillLow": 1.0, "fillClose": 2.5},
+    ]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        df = DriftMarketFetcher()._format_ohlc(records)
+
+    assert df["open"].tolist() == [2.0, 2.0]
+    assert df["high"].tolist() == [2.5, 3.0]
+    assert np.isnan(df["close"].iloc[0]) and df["close"].iloc[1] == 2.5
+
+# Early in a month only the previous one is cached, offline the walk starts there
+def test_offline_history_starts_at_the_newest_cached_month(funding_path):
+    last_month = datetime.now().replace(day=1) - timedelta(days=1)
+    times = [int(last_month.replace(day=1, hour=hour).timestamp()) for hour in range(3)]
+    save_month(funding_path, SYMBOL, last_month.year, last_month.month, [{"ts": t, "fundingRate": "1", "oraclePriceTwap": "1000"} for t in times])
+
+    df = DriftMarketFetcher(policy=FetchPolicy(OFFLINE)).fetch_funding_rate_history_until_start(SYMBOL)
+
+    assert df["timestamp"].tolist() == times
+    assert df["funding_rate"].tolist() == [0.001] * 3
@@ -0,0 +1,31 @@
+import pandas as pd
+from modules.fetcher import Fetcher
+from modules.policy import FetchPolicy, OFFLINE
+
+class FundingOnlyFetcher:
+    def fetch_funding_rate_history_until_start(self, market):
+        return pd.DataFrame({"datetime": pd.to_datetime([0, 3600], unit="s"), "timestamp": [0, 3600], "funding_rate": [0.1, 0.2]})
+
+class OhlcFetcher(FundingOnlyFetcher):
+    def fetch_hourly_ohlc(self, market, start_time, end_time):
+        times = [0, 3600]
+        return pd.DataFrame({"datetime": pd.to_datetime(times, unit="s"), "timestamp": times, "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0})
+
+class FailingFetcher(OhlcFetcher):
+    def fetch_funding_rate_history_until_start(self, market):
+        raise ConnectionError("down")
+
+# A pair without hourly ohlc or with a failing request does not lose the history of the other pairs
+def test_backfill_captures_errors_per_pair(capsys):
+    fetcher = Fetcher(FetchPolicy(OFFLINE))
+    fetcher.exchanges = {"ohlc": OhlcFetcher(), "funding_only": FundingOnlyFetcher(), "failing": FailingFetcher()}
+
+    history = fetcher.backfill([("ohlc", "BTC"), ("funding_only", "BTC"), ("failing", "BTC")])
+
+    funding_df, price_df = history[("ohlc", "BTC")]
+    assert len(funding_df) == 2 and len(price_df) == 2
+    assert history[("funding_only", "BTC")] == (None, None)
+    assert history[("failing", "BTC")] == (None, None)
+    output = capsys.readouterr().out
+    assert "funding_only BTC Error: funding_only has no hourly ohlc source" in output
+    assert "failing BTC Error: down" in output
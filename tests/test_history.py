@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+from modules.exchanges.libs.history import append_month_records, find_high_water_mark, load_high_water_mark, load_history_until_start, save_high_water_mark, sync_month_history
+from modules.exchanges.libs.raw_cache import load_month, save_month
+from modules.policy import FetchPolicy, OFFLINE
+
+def previous_month(year, month):
+    cur = datetime(year, month, 1) - timedelta(days=1)
+    return cur.year, cur.month
+
+def fail_fetch(year, month):
+    pytest.fail(f"fetched {year}-{month} offline")
+
+# Early in a month the current month is not cached yet, offline loads still return the cached months before it
+def test_offline_walk_starts_at_newest_cached_month(tmp_path):
+    now = datetime.now()
+    last_month = previous_month(now.year, now.month)
+    month_before = previous_month(*last_month)
+    save_month(str(tmp_path), "BTC", *last_month, [{"fundingTime": 2, "fundingRate": "0.2"}])
+    save_month(str(tmp_path), "BTC", *month_before, [{"fundingTime": 1, "fundingRate": "0.1"}])
+
+    df = load_history_until_start(str(tmp_path), "BTC", fail_fetch, FetchPolicy(OFFLINE))
+
+    assert sorted(df["fundingTime"].tolist()) == [1, 2]
+
+def test_offline_walk_stops_at_gap(tmp_path):
+    now = datetime.now()
+    last_month = previous_month(now.year, now.month)
+    save_month(str(tmp_path), "BTC", now.year, now.month, [{"fundingTime": 3, "fundingRate": "0.3"}])
+    save_month(str(tmp_path), "BTC", *previous_month(*last_month), [{"fundingTime": 1, "fundingRate": "0.1"}])
+
+    df = load_history_until_start(str(tmp_path), "BTC", fail_fetch, FetchPolicy(OFFLINE))
+
+    assert df["fundingTime"].tolist() == [3]
+
+def test_offline_walk_without_cache(tmp_path):
+    df = load_history_until_start(str(tmp_path), "BTC", fail_fetch, FetchPolicy(OFFLINE))
+
+    assert len(df) == 0
+
+def time_of(item):
+    return item["time"]
+
+# A full refresh stored records newer than sync.json, the next sync starts after them and appends nothing twice
+def test_sync_starts_after_newest_stored_record(tmp_path):
+    folder_path = str(tmp_path)
+    first, second = datetime(2024, 1, 10).timestamp(), datetime(2024, 1, 11).timestamp()
+    save_high_water_mark(folder_path, first)
+    save_month(folder_path, "BTC", 2024, 1, [{"time": first}, {"time": second}])
+    requested = []
+
+    def fetch_since(since):
+        requested.append(since)
+        return [{"time": first}, {"time": second}, {"time": second + 3600}]
+
+    data = sync_month_history(folder_path, "BTC", fetch_since, time_of)
+
+    assert requested == [second]
+    assert data == [{"time": second + 3600}]
+    assert [item["time"] for item in load_month(folder_path, "BTC", 2024, 1)] == [first, second, second + 3600]
+    assert load_high_water_mark(folder_path) == second + 3600
+
+def test_append_skips_stored_records(tmp_path):
+    folder_path = str(tmp_path)
+    stored = datetime(2024, 1, 10).timestamp()
+    save_month(folder_path, "BTC", 2024, 1, [{"time": stored}])
+
+    append_month_records(folder_path, "BTC", [{"time": stored}, {"time": stored + 60}], time_of)
+
+    assert [item["time"] for item in load_month(folder_path, "BTC", 2024, 1)] == [stored, stored + 60]
+
+# Drift month files hold frames
+def test_append_to_frame_month(tmp_path):
+    folder_path = str(tmp_path)
+    stored = datetime(2024, 1, 10).timestamp()
+    save_month(folder_path, "SOL-PERP", 2024, 1, pd.DataFrame({"time": [stored], "rate": [0.1]}))
+
+    append_month_records(folder_path, "SOL-PERP", [{"time": stored, "rate": 0.1}, {"time": stored + 60, "rate": 0.2}], time_of)
+
+    df = load_month(folder_path, "SOL-PERP", 2024, 1)
+    assert df["time"].tolist() == [stored, stored + 60]
+    assert find_high_water_mark(folder_path, "SOL-PERP", time_of) == stored + 60
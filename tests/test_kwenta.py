@@ -0,0 +1,38 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+import pytest
+
+# Needs the optional web3, eth_abi and gql dependencies
+kwenta = pytest.importorskip("modules.exchanges.kwenta")
+
+from modules.exchanges.libs.raw_cache import save_month
+from modules.policy import FetchPolicy, OFFLINE
+
+SYMBOLS = ["OFFLINE-TEST-A", "OFFLINE-TEST-B", "OFFLINE-TEST-C"]
+
+@pytest.fixture
+def data_path():
+    data_path = os.path.join(os.path.dirname(kwenta.__file__), "../data/kwenta")
+    yield data_path
+    for symbol in SYMBOLS:
+        shutil.rmtree(os.path.join(data_path, symbol), ignore_errors=True)
+
+def save_hours(data_path, symbol, month, hours):
+    times = [int(month.replace(day=1, hour=hour).timestamp()) for hour in hours]
+    save_month(os.path.join(data_path, symbol), symbol, month.year, month.month, [{"timestamp": str(t), "fundingRate": str(24 * 10**15)} for t in times])
+    return times
+
+# Offline every market walks back from its newest cached month, markets without a cache are empty
+def test_offline_history_starts_at_the_newest_cached_month_of_every_market(data_path):
+    last_month = datetime.now().replace(day=1) - timedelta(days=1)
+    month_before = last_month.replace(day=1) - timedelta(days=1)
+    a_times = save_hours(data_path, "OFFLINE-TEST-A", month_before, [0]) + save_hours(data_path, "OFFLINE-TEST-A", last_month, [0, 1])
+    b_times = save_hours(data_path, "OFFLINE-TEST-B", month_before, [0, 1, 2])
+
+    result = kwenta.KwentaMarketFetcher(policy=FetchPolicy(OFFLINE)).fetch_all_funding_rate_history(SYMBOLS)
+
+    assert sorted(result["OFFLINE-TEST-A"]["timestamp"].tolist()) == a_times
+    assert sorted(result["OFFLINE-TEST-B"]["timestamp"].tolist()) == b_times
+    assert result["OFFLINE-TEST-B"]["funding_rate"].tolist() == [0.001] * 3
+    assert len(result["OFFLINE-TEST-C"]) == 0
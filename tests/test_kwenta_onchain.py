@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("web3")
+pytest.importorskip("eth_abi")
+
+from eth_abi import decode, encode
+from web3 import Web3
+from web3.providers import BaseProvider
+from modules.exchanges.libs.kwenta.onchain import OnchainClient
+
+VALUE_ABI = [{"name": "value", "type": "function", "stateMutability": "view", "inputs": [{"name": "key", "type": "uint256"}], "outputs": [{"name": "", "type": "uint256"}]}]
+TARGET = "0x" + "11" * 20
+
+# Node answering aggregate3 with key * 2 for every call, records the methods it is sent
+class FakeProvider(BaseProvider):
+    def __init__(self):
+        self.methods = []
+        self.block_number = 100
+
+    def make_request(self, method, params):
+        self.methods.append(method)
+        if method == "eth_blockNumber":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(self.block_number)}
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 1, "result": "0xa"}
+        if method == "eth_call":
+            calls = decode(["(address,bool,bytes)[]"], bytes.fromhex(params[0]["data"][10:]))[0]
+            results = [(True, encode(["uint256"], [decode(["uint256"], data[4:])[0] * 2])) for _, _, data in calls]
+            return {"jsonrpc": "2.0", "id": 1, "result": "0x" + encode(["(bool,bytes)[]"], [results]).hex()}
+        raise ValueError(method)
+
+def make_client():
+    provider = FakeProvider()
+    client = OnchainClient(web3=Web3(provider))
+    return client, provider, client.get_contract(TARGET, VALUE_ABI)
+
+def test_multicall_sends_one_eth_call_per_batch():
+    client, provider, contract = make_client()
+
+    assert client.multicall([(contract, "value", [key]) for key in range(50)]) == [key * 2 for key in range(50)]
+    assert client.multicall([(contract, "value", [7])]) == [14]
+    assert provider.methods.count("eth_call") == 2
+
+def test_cached_reads_within_ttl_cost_only_the_block_number():
+    client, provider, contract = make_client()
+    read = lambda block_number: client.multicall([(contract, "value", [block_number])], block_number)[0]
+
+    assert client.cached("value", 10, read) == 200
+    provider.block_number = 109
+    assert client.cached("value", 10, read) == 200
+    assert provider.methods.count("eth_call") == 1
+    assert provider.methods[-1] == "eth_blockNumber"
+
+    provider.block_number = 110
+    assert client.cached("value", 10, read) == 220
+    assert provider.methods.count("eth_call") == 2
+    assert client.rpc_calls == len(provider.methods)
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+from common import get_dual_backtest_result
+from monitor import DualBacktestState, FundingMonitor, settle
+
+def make_history(n, seed, start=1_700_000_000):
+    rng = np.random.default_rng(seed)
+    timestamp = start + 3600 * np.arange(n)
+    return pd.DataFrame({
+        "datetime": pd.to_datetime(timestamp, unit="s"),
+        "timestamp": timestamp,
+        "close": 100 * np.exp(np.cumsum(rng.normal(0, 0.03, n))),
+        "funding_rate": rng.normal(1e-4, 3e-4, n),
+    })
+
+@pytest.mark.parametrize("leverage", [1, 20])
+def test_state_matches_dual_backtest(leverage):
+    long_df, short_df = make_history(200, 1), make_history(200, 2)
+    result_df, _, short_legs = get_dual_backtest_result(long_df, short_df, 1, 8, leverage)
+    if leverage > 1:
+        assert short_legs["is_sl"].any()
+
+    state = DualBacktestState(leverage)
+    df = pd.merge_asof(long_df, short_df, on="timestamp")
+    pnl = [state.update(row.close_x, row.funding_rate_x, row.funding_rate_y * 1 / 8) for row in df.itertuples()]
+
+    assert [long_pnl for long_pnl, _ in pnl] == result_df["long_pnl"].tolist()
+    assert [short_pnl for _, short_pnl in pnl] == result_df["short_pnl"].tolist()
+
+def test_settle_returns_the_pending_funding_once_its_time_has_passed():
+    leg = {}
+    assert settle(leg, {"funding_time": 100, "funding_rate": 1e-4}) is None
+    assert settle(leg, {"funding_time": 100, "funding_rate": 2e-4}) is None
+    assert settle(leg, {"funding_time": 200, "funding_rate": 3e-4}) == {"funding_time": 100, "funding_rate": 2e-4}
+    assert settle(leg, {"funding_time": 200, "funding_rate": 3e-4}) is None
+
+class Venue:
+    def __init__(self, funding_interval):
+        self.funding_interval = funding_interval
+
+    # Snapshots are read through SnapshotFetcher.fetch_funding_snapshot
+    def fetch_funding_snapshot(self, market):
+        raise NotImplementedError
+
+# Replays one snapshot per market and poll, the long venue settles hourly and the short one every 8 hours
+class SnapshotFetcher:
+    exchanges = {"long": Venue(1), "short": Venue(8)}
+
+    def __init__(self, snapshots):
+        self.snapshots = {market: iter(market_snapshots) for market, market_snapshots in snapshots.items()}
+
+    def fetch_funding_snapshot(self, exchange, market):
+        return next(self.snapshots[(exchange, market)])
+
+def make_snapshots(n, start=1_700_000_000):
+    rng = np.random.default_rng(3)
+    polls = start + 1800 * np.arange(n)
+    return {
+        (exchange, "BTC"): [{
+            "exchange": exchange,
+            "market": "BTC",
+            "timestamp": float(poll),
+            "funding_time": float(poll // (3600 * hours) * 3600 * hours + 3600 * hours),
+            "funding_rate": float(rate),
+            "mark_price": float(price),
+        } for poll, rate, price in zip(polls, rng.normal(1e-4, 1e-4, n), 100 + rng.normal(0, 1, n))]
+        for exchange, hours in (("long", 1), ("short", 8))
+    }
+
+STRATEGIES = {"carry": {"long": ("long", "BTC"), "short": ("short", "BTC"), "leverage": 3}}
+
+def poll(folder_path, fetcher, count):
+    monitor = FundingMonitor(STRATEGIES, fetcher, folder_path)
+    return [record for _ in range(count) for record in monitor.poll()["carry"]]
+
+def test_monitor_restarts_from_its_saved_state(tmp_path):
+    snapshots = make_snapshots(40)
+
+    expected = poll(tmp_path / "once", SnapshotFetcher(snapshots), 40)
+    fetcher = SnapshotFetcher(snapshots)
+    records = poll(tmp_path / "restarted", fetcher, 15) + poll(tmp_path / "restarted", fetcher, 25)
+
+    assert len(expected) == 19
+    assert records == expected
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "restarted" / "carry.csv"), pd.read_csv(tmp_path / "once" / "carry.csv"))
+
+def test_monitor_stores_every_snapshot(tmp_path):
+    snapshots = make_snapshots(5)
+    poll(tmp_path, SnapshotFetcher(snapshots), 5)
+
+    for exchange in ("long", "short"):
+        stored = pd.read_csv(tmp_path / "snapshots" / f"{exchange}_BTC.csv", float_precision="round_trip")
+        assert stored["mark_price"].tolist() == [snapshot["mark_price"] for snapshot in snapshots[(exchange, "BTC")]]
+        assert stored["funding_time"].tolist() == [snapshot["funding_time"] for snapshot in snapshots[(exchange, "BTC")]]
+
+class FailingFetcher(SnapshotFetcher):
+    def __init__(self, snapshots, failures):
+        super().__init__(snapshots)
+        self.failures = failures
+        self.calls = {}
+
+    def fetch_funding_snapshot(self, exchange, market):
+        snapshot = super().fetch_funding_snapshot(exchange, market)
+        call = self.calls[(exchange, market)] = self.calls.get((exchange, market), 0) + 1
+        if call in self.failures.get((exchange, market), ()):
+            raise ConnectionError("retries exhausted")
+        return snapshot
+
+# A failed snapshot skips one poll of its market, the next poll settles the funding it missed (with the rate of the
+# last snapshot before it)
+def test_monitor_keeps_polling_after_a_failed_snapshot(tmp_path):
+    snapshots = make_snapshots(12)
+    expected = poll(tmp_path / "once", SnapshotFetcher(snapshots), 12)
+
+    records = poll(tmp_path / "failed", FailingFetcher(snapshots, {("long", "BTC"): (4, 7)}), 12)
+
+    assert [record["timestamp"] for record in records] == [record["timestamp"] for record in expected]
+    assert pd.read_csv(tmp_path / "failed" / "snapshots" / "long_BTC.csv").shape[0] == 10
+
+class NoSnapshots:
+    funding_interval = 8
+
+def test_venues_without_snapshots_are_rejected_at_startup(tmp_path):
+    fetcher = SnapshotFetcher(make_snapshots(1))
+    fetcher.exchanges = dict(fetcher.exchanges, short=NoSnapshots())
+
+    with pytest.raises(ValueError, match="short has no fetch_funding_snapshot"):
+        FundingMonitor(STRATEGIES, fetcher, tmp_path)
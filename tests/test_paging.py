@@ -0,0 +1,114 @@
+import os
+import shutil
+import threading
+import time
+import pytest
+from modules.exchanges import huobi
+from modules.exchanges.huobi import HuobiFetcher
+from modules.exchanges.libs.paging import fetch_all_pages, fetch_cursor_pages
+
+# Pages of 3 records, later pages answer faster so they complete out of order. failed pages return None.
+class Pages:
+    def __init__(self, total_pages, failed=()):
+        self.total_pages = total_pages
+        self.failed = failed
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def __call__(self, page_index):
+        with self.lock:
+            self.requested.append(page_index)
+        time.sleep(0.002 * (self.total_pages - page_index))
+        if page_index in self.failed:
+            return None
+        return [3 * (page_index - 1) + i for i in range(3)], self.total_pages
+
+def test_pages_are_joined_in_page_order():
+    pages = Pages(12)
+
+    assert fetch_all_pages(pages) == list(range(36))
+    assert sorted(pages.requested) == list(range(1, 13))
+
+def test_walk_stops_at_the_page_reaching_the_cache():
+    pages = Pages(40)
+
+    assert fetch_all_pages(pages, max_workers=4, stop=lambda records: records[-1] >= 16) == list(range(18))
+    assert max(pages.requested) <= 9
+
+def test_failed_page_leaves_the_pages_before_it():
+    assert fetch_all_pages(Pages(10, failed={5})) == list(range(12))
+    assert fetch_all_pages(Pages(10, failed={1})) == []
+
+def test_cursor_pages():
+    history = list(range(100, 0, -1))
+    page = lambda before: [t for t in history if before is None or t < before][:10]
+
+    assert fetch_cursor_pages(page, None, lambda records: records[-1], 10) == history
+    assert fetch_cursor_pages(page, None, lambda records: records[-1] if records[-1] > 75 else None, 10) == history[:30]
+    # A cursor that does not move ends the walk instead of requesting the same page forever
+    assert fetch_cursor_pages(lambda cursor: [1, 2], 0, lambda records: 0) == [1, 2]
+
+SYMBOL = "PAGING-TEST"
+
+@pytest.fixture
+def huobi_path():
+    folder_path = os.path.join(os.path.dirname(huobi.__file__), f"../data/huobi/{SYMBOL}")
+    yield folder_path
+    shutil.rmtree(folder_path, ignore_errors=True)
+
+# Huobi history of funding times (newest first) served in pages of 50
+def serve(fetcher, times, shift_after=None):
+    requests = []
+
+    def fetch_page(symbol, page_index=1, limit=50):
+        requests.append(page_index)
+        # A funding published after the first page shifts the following pages by one record
+        served = [times[0] + 1] + times if shift_after is not None and len(requests) > shift_after else times
+        records = [{"funding_time": t, "funding_rate": "0.0001"} for t in served[(page_index - 1) * limit:page_index * limit]]
+        return records, (len(served) + limit - 1) // limit
+
+    fetcher._fetch_funding_rate_history = fetch_page
+    return requests
+
+def test_huobi_refresh_keeps_every_funding_once(huobi_path):
+    fetcher = HuobiFetcher()
+    times = list(range(1_700_000_000_000 + 3_600_000 * 200, 1_700_000_000_000, -3_600_000))
+    serve(fetcher, times[100:])
+    fetcher.fetch_funding_rate_history_until_start(SYMBOL)
+
+    requests = serve(fetcher, times, shift_after=1)
+    df = fetcher.fetch_funding_rate_history_until_start(SYMBOL)
+
+    assert df["funding_time"].tolist() == times
+    assert max(requests) <= 4
+
+def test_okx_walk_ends_at_the_high_water_mark():
+    from modules.exchanges.okx import OKXFetcher
+    fetcher = OKXFetcher()
+    history = [{"fundingTime": str(t * 1000), "fundingRate": "0.0001"} for t in range(10_000, 0, -100)]
+    requests = []
+
+    def fetch_page(symbol, before=None, after=None, limit=100):
+        requests.append(after)
+        return [item for item in history if int(item["fundingTime"]) < after * 1000][:10]
+
+    fetcher._fetch_funding_rate_history = fetch_page
+    data = fetcher._fetch_funding_rate_history_since("BTC-USDT-SWAP", 5_000, limit=10)
+
+    assert data == history[:60]
+    assert len(requests) == 6
+
+def test_zeta_walk_joins_the_bars_of_every_page():
+    from modules.exchanges.zeta import ZetaFetcher
+    fetcher = ZetaFetcher()
+    times = list(range(1_000, 5_000, 100))
+
+    def fetch_page(symbol, start_time=None, end_time=None, limit=1000):
+        bars = [t for t in times if start_time <= t <= end_time][-limit:]
+        return {"s": "ok", "t": bars, "o": [t / 100 for t in bars]}
+
+    fetcher._fetch_funding_rate_history = fetch_page
+    data = fetcher._fetch_funding_rate_history_since("BTC", 2_000, limit=7)
+
+    assert sorted(data["t"]) == times[11:]
+    assert data["o"] == [t / 100 for t in data["t"]]
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from common import save_store_data
+from panel import Panel, build_panel
+
+START = 1_700_000_000 // 3600 * 3600
+
+def make_history(hours, seed):
+    rng = np.random.default_rng(seed)
+    timestamp = START + 3600 * np.asarray(hours)
+    close = 100 + rng.normal(0, 1, len(timestamp)).cumsum()
+    return pd.DataFrame({
+        "datetime": pd.to_datetime(timestamp, unit="s"),
+        "timestamp": timestamp,
+        "open": close,
+        "high": close,
+        "low": close,
+        "close": close,
+        "funding_rate": rng.normal(1e-4, 1e-4, len(timestamp)),
+    })
+
+def test_panel_build_and_reopen(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Binance pays every 8 hours over the whole range, Drift every hour over a part of it
+    binance_df = make_history(range(0, 48, 8), 1)
+    drift_df = make_history(range(10, 31), 2)
+    save_store_data("binance", "BTCUSDT", binance_df)
+    save_store_data("drift", "BTC-PERP", drift_df)
+
+    build_panel([("binance", "BTCUSDT"), ("drift", "BTC-PERP")], {"BTCUSDT": 8, "BTC-PERP": 1}, path=tmp_path / "panel")
+    panel = Panel(tmp_path / "panel")
+
+    assert panel.values.shape == (4, 41) and panel.values.dtype == np.float64
+    assert panel.pairs() == [("binance", "BTCUSDT"), ("drift", "BTC-PERP")]
+    np.testing.assert_array_equal(panel.timestamps(), START + 3600 * np.arange(41))
+
+    # Prices hold until the next record, every funding is spread over the hours before it
+    binance = panel.frame("binance", "BTCUSDT")
+    np.testing.assert_array_equal(binance["close"], np.repeat(binance_df["close"].to_numpy(), 8)[:41])
+    np.testing.assert_array_equal(binance["funding_rate"], np.r_[binance_df["funding_rate"].to_numpy()[0] / 8, np.repeat(binance_df["funding_rate"].to_numpy()[1:] / 8, 8)][:41])
+
+    # Drift starts later and ends earlier: no price before its first record, no funding after its last one
+    drift = panel.frame("drift", "BTC-PERP")
+    assert drift["close"][:10].isna().all() and drift["funding_rate"][:10].isna().all()
+    np.testing.assert_array_equal(drift["close"][10:31], drift_df["close"])
+    np.testing.assert_array_equal(drift["funding_rate"][10:31], drift_df["funding_rate"])
+    assert (drift["close"][31:] == drift_df["close"].iloc[-1]).all() and drift["funding_rate"][31:].isna().all()
+
+    window = panel.table("close", start=START + 5 * 3600, end=START + 12 * 3600)
+    assert window.shape == (8, 2)
+    np.testing.assert_array_equal(window["drift_BTC-PERP"], np.r_[[np.nan] * 5, drift_df["close"][:3]])
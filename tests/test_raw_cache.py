@@ -0,0 +1,24 @@
+import json
+import os
+import pandas as pd
+from modules.exchanges.libs.raw_cache import get_month_path, load_month, migrate_json_tree, save_month
+
+def test_migrate_counts_converted_files_only(tmp_path):
+    folder_path = str(tmp_path)
+    with open(get_month_path(folder_path, "BTC", 2024, 1, "json"), "w") as f:
+        json.dump([{"time": 1, "rate": "0.1"}], f)
+    with open(get_month_path(folder_path, "BTC", 2024, 2, "json"), "w") as f:
+        json.dump([], f)
+    with open(get_month_path(folder_path, "BTC", 2024, 3, "json"), "w") as f:
+        f.write("{not json")
+
+    assert migrate_json_tree(folder_path) == 1
+    assert os.path.exists(get_month_path(folder_path, "BTC", 2024, 1))
+    assert os.path.exists(get_month_path(folder_path, "BTC", 2024, 2, "json"))
+    assert os.path.exists(get_month_path(folder_path, "BTC", 2024, 3, "json"))
+
+def test_frame_payload_round_trip(tmp_path):
+    df = pd.DataFrame({"ts": [1, 2], "fundingRate": ["0.1", "undefined"]})
+    save_month(str(tmp_path), "SOL-PERP", 2024, 1, df)
+
+    pd.testing.assert_frame_equal(load_month(str(tmp_path), "SOL-PERP", 2024, 1), df)
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from multiprocessing import shared_memory
+import runner
+from common import get_backtest_result, get_dual_backtest_result, save_store_data
+from runner import load_matrix_data, run_backtest_matrix
+
+EXCHANGES_MARKETS = [{"binance": "BTCUSDT", "drift": "BTC-PERP"}]
+HEDGE_MAP = {"binance": "drift", "drift": "binance"}
+FUNDING_FREQ_MAP = {"BTCUSDT": 8, "BTC-PERP": 1}
+LEVERAGES = [1, 3, 10]
+
+def make_history(n, seed, start=1_700_000_000 // 3600 * 3600):
+    rng = np.random.default_rng(seed)
+    timestamp = start + 3600 * np.arange(n)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    return pd.DataFrame({
+        "datetime": pd.to_datetime(timestamp, unit="s"),
+        "timestamp": timestamp,
+        "open": close,
+        "high": close,
+        "low": close,
+        "close": close,
+        "funding_rate": rng.normal(1e-4, 1e-4, n),
+    })
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    save_store_data("binance", "BTCUSDT", make_history(300, 1))
+    save_store_data("drift", "BTC-PERP", make_history(280, 2, start=1_700_000_000 // 3600 * 3600 + 7200))
+
+def run_serially():
+    data_df_map = load_matrix_data(EXCHANGES_MARKETS)
+    results = {}
+    for exchanges_market in EXCHANGES_MARKETS:
+        for exchange, market in exchanges_market.items():
+            long_exchange = HEDGE_MAP[exchange]
+            long_market = exchanges_market[long_exchange]
+            for leverage in LEVERAGES:
+                short_df = data_df_map[(exchange, market)]
+                if leverage == 1:
+                    result_df = get_backtest_result(short_df, leverage)
+                else:
+                    long_df = data_df_map[(long_exchange, long_market)]
+                    result_df, _, _ = get_dual_backtest_result(long_df, short_df, FUNDING_FREQ_MAP[long_market], FUNDING_FREQ_MAP[market], leverage)
+                results.setdefault(exchange, {}).setdefault(market, {})[leverage] = result_df
+    return results
+
+def test_matrix_matches_a_serial_run_and_frees_the_shared_memory(store, monkeypatch):
+    names = []
+    create_shared_data = runner.create_shared_data
+
+    def create_and_record(data_df_map):
+        shm, layout = create_shared_data(data_df_map)
+        names.append(shm.name)
+        return shm, layout
+
+    monkeypatch.setattr(runner, "create_shared_data", create_and_record)
+    results = run_backtest_matrix(EXCHANGES_MARKETS, HEDGE_MAP, FUNDING_FREQ_MAP, LEVERAGES, max_workers=2)
+    expected = run_serially()
+
+    for exchange, market in [("binance", "BTCUSDT"), ("drift", "BTC-PERP")]:
+        for leverage in LEVERAGES:
+            pd.testing.assert_frame_equal(results[exchange][market][leverage], expected[exchange][market][leverage], check_exact=True)
+
+    assert len(names) == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=names[0])
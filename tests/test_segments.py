@@ -0,0 +1,21 @@
+import pandas as pd
+from modules.exchanges.libs import segments
+from modules.exchanges.libs.segments import append_segment, list_segments, load_segments, get_tier
+
+def test_tiers():
+    assert [get_tier(num_rows) for num_rows in (1, 15, 16, 255, 256, 9999)] == [0, 0, 1, 1, 2, 3]
+
+# One record per sync: a merge output is not read and written again by every following compaction
+def test_every_record_is_rewritten_once_per_tier(tmp_path, monkeypatch):
+    written = []
+    write_segment = segments.write_segment
+    monkeypatch.setattr(segments, "write_segment", lambda folder_path, df: (written.append(len(df)), write_segment(folder_path, df)))
+
+    for epoch in range(600):
+        append_segment(tmp_path, pd.DataFrame({"rate": [epoch / 10]}), [epoch])
+
+    df = load_segments(tmp_path)
+    assert df["epoch"].tolist() == list(range(600))
+    assert df["rate"].tolist() == [epoch / 10 for epoch in range(600)]
+    assert len(list_segments(tmp_path)) <= 3 * (segments.MAX_TIER_SEGMENTS + 1)
+    assert sum(written) <= 600 * 3
@@ -0,0 +1,104 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import pytest
+from modules import fetcher as fetcher_module
+from modules.fetcher import Fetcher
+from modules.session import HTTPClient
+from monitor import FundingMonitor
+
+PREMIUM_INDEX = {"symbol": "BTCUSDT", "markPrice": "43000.10000000", "indexPrice": "42990.5", "lastFundingRate": "0.00010000", "nextFundingTime": 1700006400000, "time": 1700000000000}
+
+# Responses of the venue endpoints by host and path, as (status, payload)
+ROUTES = {
+    "/fapi.binance.com/fapi/v1/premiumIndex": (200, PREMIUM_INDEX),
+    "/fapi.apollox.finance/fapi/v1/premiumIndex": (200, dict(PREMIUM_INDEX, markPrice="43001.5", lastFundingRate="-0.00005000")),
+    "/api.gateio.ws/api/v4/futures/usdt/contracts/BTC_USDT": (200, {"name": "BTC_USDT", "funding_rate": "0.000125", "funding_next_apply": 1700006400, "mark_price": "42999.9", "funding_interval": 28800}),
+    "/www.okx.com/api/v5/public/funding-rate": (200, {"code": "0", "msg": "", "data": [{"instId": "BTC-USDT-SWAP", "fundingRate": "0.0002", "fundingTime": "1700006400000", "nextFundingRate": ""}]}),
+    "/www.okx.com/api/v5/public/mark-price": (200, {"code": "0", "msg": "", "data": [{"instId": "BTC-USDT-SWAP", "instType": "SWAP", "markPx": "43002", "ts": "1700000001000"}]}),
+}
+
+# Local exchange serving ROUTES, every request is recorded as (path, query)
+@pytest.fixture
+def exchange_server():
+    routes = dict(ROUTES)
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            requests.append((url.path, url.query))
+            status, payload = routes.get(url.path, (404, {"msg": "not found"}))
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    server.routes = routes
+    server.requests = requests
+    yield server
+    server.shutdown()
+    server.server_close()
+
+# HTTPClient sending every venue request to the local exchange, the venue host becomes the first path segment
+class LocalHTTPClient(HTTPClient):
+    def __init__(self, server, **kwargs):
+        super().__init__(max_retries=0, **kwargs)
+        self.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def request(self, method, url, **kwargs):
+        url = urlparse(url)
+        return super().request(method, f"{self.base_url}/{url.netloc}{url.path}", **kwargs)
+
+@pytest.fixture
+def fetcher(exchange_server, monkeypatch):
+    monkeypatch.setattr(fetcher_module, "HTTPClient", lambda offline: LocalHTTPClient(exchange_server, offline=offline))
+    fetcher = Fetcher()
+    yield fetcher
+    fetcher.close()
+
+@pytest.mark.parametrize("exchange, market, expected", [
+    ("binance", "BTCUSDT", {"timestamp": 1700000000.0, "funding_time": 1700006400.0, "funding_rate": 0.0001, "mark_price": 43000.1}),
+    ("apollox", "BTCUSDT", {"timestamp": 1700000000.0, "funding_time": 1700006400.0, "funding_rate": -0.00005, "mark_price": 43001.5}),
+    ("gate", "BTC_USDT", {"funding_time": 1700006400.0, "funding_rate": 0.000125, "mark_price": 42999.9}),
+    ("okx", "BTC-USDT-SWAP", {"timestamp": 1700000001.0, "funding_time": 1700006400.0, "funding_rate": 0.0002, "mark_price": 43002.0}),
+])
+def test_funding_snapshot(fetcher, exchange, market, expected):
+    snapshot = fetcher.fetch_funding_snapshot(exchange, market)
+
+    assert snapshot["exchange"] == exchange and snapshot["market"] == market
+    assert {key: snapshot[key] for key in expected} == expected
+
+def test_snapshot_requests(fetcher, exchange_server):
+    fetcher.fetch_funding_snapshot("binance", "BTCUSDT")
+    fetcher.fetch_funding_snapshot("okx", "BTC-USDT-SWAP")
+
+    assert exchange_server.requests == [
+        ("/fapi.binance.com/fapi/v1/premiumIndex", "symbol=BTCUSDT"),
+        ("/www.okx.com/api/v5/public/funding-rate", "instId=BTC-USDT-SWAP"),
+        ("/www.okx.com/api/v5/public/mark-price", "instType=SWAP&instId=BTC-USDT-SWAP"),
+    ]
+
+def test_failed_snapshot_is_none(fetcher, exchange_server):
+    exchange_server.routes["/fapi.binance.com/fapi/v1/premiumIndex"] = (400, {"code": -1121, "msg": "Invalid symbol."})
+
+    assert fetcher.fetch_funding_snapshot("binance", "BTCUSDT") is None
+
+def test_monitor_polls_the_exchange(fetcher, exchange_server, tmp_path):
+    monitor = FundingMonitor({"carry": {"long": ("binance", "BTCUSDT"), "short": ("gate", "BTC_USDT"), "leverage": 3}}, fetcher, tmp_path)
+
+    assert monitor.poll() == {"carry": []}
+    exchange_server.routes["/fapi.binance.com/fapi/v1/premiumIndex"] = (200, dict(PREMIUM_INDEX, nextFundingTime=1700010000000, lastFundingRate="0.0003"))
+    records = monitor.poll()["carry"]
+
+    assert [(record["timestamp"], record["long_funding"], record["close"]) for record in records] == [(1700006400.0, 0.0001, 43000.1)]
+    assert (tmp_path / "snapshots" / "binance_BTCUSDT.csv").exists() and (tmp_path / "snapshots" / "gate_BTC_USDT.csv").exists()
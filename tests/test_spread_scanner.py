@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from modules.spread_scanner import scan_funding_spreads
+
+END_TIME = 1_700_000_000 // 3600 * 3600
+
+class Venue:
+    funding_interval = 1
+
+class HistoryFetcher:
+    def __init__(self, histories):
+        self.histories = histories
+        self.exchanges = {exchange: Venue() for exchange, _ in histories}
+
+    def fetch_funding_records(self, exchange, market):
+        rates = self.histories[(exchange, market)]
+        times = END_TIME - 3600 * np.arange(len(rates) - 1, -1, -1)
+        return pd.DataFrame({"timestamp": times, "hourly_rate": rates})
+
+def scan(histories, **kwargs):
+    universe = pd.DataFrame([(exchange, market, "BTC") for exchange, market in histories], columns=["exchange", "market", "base"])
+    return scan_funding_spreads(HistoryFetcher(histories), universe, end_time=END_TIME, fee_percent=0, **kwargs)
+
+# The side is chosen on the formation window: a spread that flips in the scored window loses money
+def test_side_is_chosen_before_the_scored_window():
+    histories = {
+        ("a", "BTC"): np.r_[np.full(48, 0.0), np.full(24, 0.0)],
+        ("b", "BTC"): np.r_[np.full(48, 1e-4), np.full(24, -1e-4)],
+    }
+
+    result = scan(histories, lookback_hours=24, formation_hours=48)
+
+    row = result.iloc[0]
+    assert (row["long_exchange"], row["short_exchange"]) == ("a", "b")
+    assert np.isclose(row["pnl"], -24e-4)
+    assert np.isclose(row["spread"], -1e-4 * 24 * 365)
+    assert np.isclose(row["max_drawdown"], 24e-4)
+
+def test_pairs_without_formation_history_are_left_out():
+    histories = {
+        ("a", "BTC"): np.full(24, 0.0),
+        ("b", "BTC"): np.full(24, 1e-4),
+    }
+
+    assert len(scan(histories, lookback_hours=24, formation_hours=48)) == 0
+    assert len(scan(histories, lookback_hours=24, formation_hours=48, min_coverage=0)) == 1
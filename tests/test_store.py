@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import pandas as pd
+from common import CACHE_COLUMNS, get_dual_backtest_result, get_iterative_dual_backtest_result, load_cache_data, save_store_data
+from modules.exchanges.libs.timestamps import add_time_columns
+from panel import build_panel
+
+def make_history(n, seed, start=1_700_000_000):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    df = pd.DataFrame({"funding_time": start + 3600 * np.arange(n)})
+    add_time_columns(df, "funding_time", "s")
+    return df.assign(open=close, high=close, low=close, close=close, funding_rate=rng.normal(1e-4, 1e-4, n)).drop(columns="funding_time")
+
+# A leg fresh from a fetcher next to a leg read back from the store
+def test_dual_backtest_of_a_fetched_and_a_stored_leg(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fetched_df = make_history(100, 1)
+    save_store_data("binance", "BTCUSDT", make_history(100, 2))
+    stored_df = load_cache_data("binance", "BTCUSDT")
+
+    assert stored_df["timestamp"].dtype == fetched_df["timestamp"].dtype == np.int64
+    result_df, _, _ = get_dual_backtest_result(fetched_df, stored_df, 1, 8, 3)
+    expected_df, _, _ = get_iterative_dual_backtest_result(fetched_df.copy(), stored_df.copy(), 1, 8, 3)
+    assert result_df["final_pnl"].tolist() == expected_df["final_pnl"].tolist()
+    assert result_df["short_funding"].notna().all()
+
+def test_store_round_trip_by_year(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Two days around new year, out of order
+    df = make_history(48, 3, start=1704067200 - 24 * 3600).sample(frac=1, random_state=0)
+    save_store_data("binance", "BTCUSDT", df)
+
+    assert sorted(os.listdir(tmp_path / "data/store/binance/BTCUSDT")) == ["year=2023", "year=2024"]
+    stored_df = load_cache_data("binance", "BTCUSDT")
+    expected_df = df.sort_values(by="timestamp").reset_index(drop=True)[CACHE_COLUMNS]
+    pd.testing.assert_frame_equal(stored_df, expected_df, check_exact=True)
+
+def test_store_filters_by_time(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    df = make_history(48, 3, start=1704067200 - 24 * 3600)
+    save_store_data("binance", "BTCUSDT", df)
+
+    start, end = 1704067200 - 3 * 3600, 1704067200 + 2 * 3600
+    assert load_cache_data("binance", "BTCUSDT", start=start, end=end)["timestamp"].tolist() == list(range(start, end + 1, 3600))
+    assert load_cache_data("binance", "BTCUSDT", start=1704067200)["timestamp"].min() == 1704067200
+    assert load_cache_data("binance", "BTCUSDT", end=1704067200 - 3600)["timestamp"].max() == 1704067200 - 3600
+
+# Saving replaces the whole store, partitions of years no longer in the data are removed
+def test_store_is_overwritten(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    save_store_data("binance", "BTCUSDT", make_history(48, 3, start=1704067200 - 24 * 3600))
+    df = make_history(10, 4, start=1704067200 + 3600)
+    save_store_data("binance", "BTCUSDT", df)
+
+    assert os.listdir(tmp_path / "data/store/binance/BTCUSDT") == ["year=2024"]
+    pd.testing.assert_frame_equal(load_cache_data("binance", "BTCUSDT"), df[CACHE_COLUMNS], check_exact=True)
+
+# The store is rebuilt from the CSV snapshot when the CSV is newer
+def test_store_is_rebuilt_from_a_newer_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    save_store_data("binance", "BTCUSDT", make_history(10, 3))
+    df = make_history(20, 4)
+    df.to_csv(tmp_path / "data/binance_BTCUSDT.csv", index=False)
+    store_time = os.path.getmtime(tmp_path / "data/store/binance/BTCUSDT")
+    os.utime(tmp_path / "data/binance_BTCUSDT.csv", (store_time + 10, store_time + 10))
+
+    assert load_cache_data("binance", "BTCUSDT")["timestamp"].tolist() == df["timestamp"].tolist()
+
+def test_dual_backtest_of_a_fetched_and_a_panel_leg(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    save_store_data("binance", "BTCUSDT", make_history(100, 2))
+    panel = build_panel([("binance", "BTCUSDT")], {"BTCUSDT": 1}, path=tmp_path / "panel")
+
+    result_df, _, _ = get_dual_backtest_result(make_history(100, 1), panel.frame("binance", "BTCUSDT"), 1, 1, 3)
+    assert result_df["short_funding"].notna().all()
@@ -0,0 +1,32 @@
+import os
+import shutil
+from datetime import datetime, timedelta
+import pytest
+from modules.exchanges import zeta
+from modules.exchanges.zeta import ZetaFetcher
+from modules.exchanges.libs.raw_cache import save_month
+from modules.policy import FetchPolicy, OFFLINE
+
+SYMBOL = "OFFLINE-TEST"
+
+@pytest.fixture
+def funding_path():
+    folder_path = os.path.join(os.path.dirname(zeta.__file__), f"../data/zeta/{SYMBOL}")
+    yield folder_path
+    shutil.rmtree(folder_path, ignore_errors=True)
+
+def save_hours(folder_path, month, hours):
+    times = [int(month.replace(day=1, hour=hour).timestamp()) for hour in hours]
+    save_month(folder_path, SYMBOL, month.year, month.month, {"t": times, "o": [1.0] * len(times)})
+    return times
+
+# Early in a month only the previous ones are cached, offline the walk starts at the newest one
+def test_offline_history_starts_at_the_newest_cached_month(funding_path):
+    last_month = datetime.now().replace(day=1) - timedelta(days=1)
+    month_before = last_month.replace(day=1) - timedelta(days=1)
+    times = save_hours(funding_path, month_before, [0, 1]) + save_hours(funding_path, last_month, [0, 1, 2])
+
+    df = ZetaFetcher(policy=FetchPolicy(OFFLINE)).fetch_funding_rate_history_until_start(SYMBOL)
+
+    assert sorted(df["timestamp"].tolist()) == times
+    assert df["funding_rate"].tolist() == [1e-4] * 5